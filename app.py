@@ -1,10 +1,13 @@
 """
 Główna aplikacja Flask - system monitorowania cen z synchronizacją API - NAPRAWIONA Z LOGAMI
 """
-from flask import Flask, render_template, request, jsonify, redirect, flash
+from flask import Flask, render_template, request, jsonify, redirect, flash, Response
 import os
 import logging
 import atexit
+import multiprocessing
+import sys
+import threading
 from datetime import datetime
 
 # Import blueprintów
@@ -35,10 +38,13 @@ app.secret_key = 'your-secret-key-here'
 # Konfiguracja synchronizacji
 API_BASE_URL = os.getenv('PRICE_TRACKER_API_URL', 'http://serwer327940.lh.pl/price-api')
 SYNC_ENABLED = os.getenv('ENABLE_SYNC', 'true').lower() == 'true'
+# Sync (health check API) i odświeżanie optymalizacji w tle - serwer przyjmuje żądania od razu
+BACKGROUND_STARTUP = os.getenv('BACKGROUND_STARTUP', 'true').lower() == 'true'
 
 # Globalne zmienne
 sync_manager = None
 startup_sync_completed = False
+startup_state = 'pending'  # pending -> running -> done
 
 logger.info(f"=== APPLICATION STARTUP ===")
 logger.info(f"SYNC_ENABLED: {SYNC_ENABLED}")
@@ -163,6 +169,20 @@ def cleanup_on_exit():
             logger.info("Sync manager shut down successfully")
         except Exception as e:
             logger.error(f"Error during sync manager shutdown: {e}")
+    
+    try:
+        from optimization_refresh import optimization_refresh
+        optimization_refresh.stop()
+    except Exception as e:
+        logger.error(f"Error during optimization refresh shutdown: {e}")
+    
+    # Pula zadań optymalizacji - tylko jeśli była używana (bez importu przy zamykaniu)
+    jobs_module = sys.modules.get('optimization_jobs')
+    if jobs_module is not None:
+        try:
+            jobs_module.optimization_jobs.shutdown()
+        except Exception as e:
+            logger.error(f"Error during optimization jobs shutdown: {e}")
 
 # Rejestracja funkcji cleanup
 atexit.register(cleanup_on_exit)
@@ -171,8 +191,32 @@ atexit.register(cleanup_on_exit)
 logger.info("Creating directories...")
 ensure_directories()
 
-logger.info("Initializing sync...")
-initialize_sync()
+def background_startup():
+    """Inicjalizacja sync'u i odświeżania optymalizacji - w tle, żeby nie blokować startu serwera"""
+    global startup_state
+    startup_state = 'running'
+    
+    logger.info("Initializing sync...")
+    initialize_sync()
+    
+    # Ponowna optymalizacja koszyków po zmianach cen (po inicjalizacji sync - save_price już podmienione)
+    logger.info("Starting optimization refresh...")
+    try:
+        from optimization_refresh import optimization_refresh
+        optimization_refresh.start()
+    except Exception as e:
+        logger.error(f"Optimization refresh not started: {e}")
+    
+    startup_state = 'done'
+    logger.info("Background startup complete")
+
+# Procesy robocze pul optymalizacji (spawn) importują app.py jako __mp_main__ - bez startu sync'u
+if multiprocessing.current_process().name != 'MainProcess':
+    logger.debug("Worker process - skipping background startup")
+elif BACKGROUND_STARTUP:
+    threading.Thread(target=background_startup, daemon=True, name='startup-init').start()
+else:
+    background_startup()
 
 logger.info("Registering blueprints...")
 # Rejestracja blueprintów
@@ -497,16 +541,17 @@ def debug_patch_status():
 def health_check():
     """Health check endpoint"""
     try:
-        # Test podstawowych funkcji
-        from utils.data_utils import load_products
-        products = load_products()
+        # Test podstawowych funkcji (produkty z cache - bez kopiowania listy)
+        from utils.data_utils import _load_products_shared
+        products = _load_products_shared()
         
         health_status = {
             'status': 'OK',
             'timestamp': datetime.now().isoformat(),
             'products_count': len(products),
             'sync_enabled': SYNC_ENABLED,
-            'sync_available': sync_manager is not None
+            'sync_available': sync_manager is not None,
+            'startup': startup_state
         }
         
         if sync_manager:
@@ -525,6 +570,16 @@ def health_check():
             'timestamp': datetime.now().isoformat()
         }), 500
 
+# =============================================================================
+# METRYKI
+# =============================================================================
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Metryki w formacie tekstowym Prometheusa (scraper, sync, kolejka, optymalizacja)"""
+    from utils.metrics import metrics, CONTENT_TYPE
+    return Response(metrics.render(), content_type=CONTENT_TYPE)
+
 if __name__ == '__main__':
     # Konfiguracja dla development
     debug_mode = os.getenv('FLASK_DEBUG', 'false').lower() == 'true'
@@ -539,18 +594,18 @@ if __name__ == '__main__':
     if SYNC_ENABLED:
         logger.info(f"API URL: {API_BASE_URL}")
         
-        # POPRAWKA: Usuń podwójne ustawienie - sync manager jest już ustawiony w initialize_sync()
-        logger.info("Sync manager already set during initialization")
-        
-        # Dodatkowa weryfikacja
-        try:
-            from sync.sync_integration import _sync_wrapper
-            if _sync_wrapper and _sync_wrapper.sync_manager:
-                logger.info("✅ Sync wrapper has sync manager - ready to go!")
-            else:
-                logger.warning("⚠️ Sync wrapper missing sync manager")
-        except Exception as e:
-            logger.error(f"Error checking sync wrapper: {e}")
+        # Sync manager ustawiany jest w initialize_sync() - przy BACKGROUND_STARTUP w tle
+        if startup_state == 'done':
+            try:
+                from sync.sync_integration import _sync_wrapper
+                if _sync_wrapper and _sync_wrapper.sync_manager:
+                    logger.info("✅ Sync wrapper has sync manager - ready to go!")
+                else:
+                    logger.warning("⚠️ Sync wrapper missing sync manager")
+            except Exception as e:
+                logger.error(f"Error checking sync wrapper: {e}")
+        else:
+            logger.info("Sync initialization running in background")
     
     logger.info("=== STARTING FLASK SERVER ===")
     
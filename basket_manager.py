@@ -4,6 +4,11 @@ Główny moduł zarządzania koszykami - POPRAWIONY z lepszą obsługą nowego s
 import json
 import os
 from datetime import datetime
+from utils.file_store import write_jsonl_atomic
+from optimization_cache import optimization_cache
+from optimization_engine import OptimizationCancelled
+from optimization_refresh import compact_plan
+from optimization_trace import OptimizationTrace
 
 class BasketManager:
     """Zarządzanie koszykami z wydzielonym silnikiem optymalizacji"""
@@ -17,35 +22,98 @@ class BasketManager:
         if not os.path.exists('data'):
             os.makedirs('data')
     
-    def optimize_basket(self, basket_id, products_data, prices_data, shop_configs):
-        """GŁÓWNY ALGORYTM OPTYMALIZACJI - używa nowego silnika"""
+    def optimize_basket(self, basket_id, products_data, prices_data, shop_configs,
+                        progress_callback=None, cancel_check=None, default_time_budget_ms=None):
+        """
+        GŁÓWNY ALGORYTM OPTYMALIZACJI - używa nowego silnika
         
-        optimization_log = []
+        progress_callback / cancel_check - opcjonalne hooki dla zadań w tle
+        (patrz optimization_jobs), przekazywane do silnika
+        default_time_budget_ms - budżet czasu gdy koszyk nie ma własnego
+        (np. synchroniczny request w UI); nie jest zapisywany w ustawieniach koszyka
+        """
         
-        def log(message):
-            """Dodaj wpis do logu optymalizacji"""
-            timestamp = datetime.now().strftime("%H:%M:%S")
-            optimization_log.append(f"[{timestamp}] {message}")
-            print(f"BASKET_MANAGER LOG: {message}")
+        # Log optymalizacji - pełny (i na stdout) tylko przy show_logs, inaczej
+        # tylko ostatnie wpisy w buforze (np. do pokazania przy błędzie)
+        log = OptimizationTrace(echo_prefix="BASKET_MANAGER LOG: ")
         
         log("🚀 ROZPOCZĘCIE OPTYMALIZACJI - POPRAWIONY SILNIK")
         
         # Pobierz koszyk
         basket = self.get_basket(basket_id)
         if not basket:
-            log("❌ BŁĄD: Koszyk nie został znaleziony")
-            return {'success': False, 'error': 'Koszyk nie został znaleziony', 'optimization_log': optimization_log}
+            log.error("❌ BŁĄD: Koszyk nie został znaleziony")
+            return {'success': False, 'error': 'Koszyk nie został znaleziony', 'optimization_log': log.lines()}
+        
+        return self.optimize_loaded_basket(
+            basket, products_data, prices_data, shop_configs, log=log,
+            progress_callback=progress_callback, cancel_check=cancel_check,
+            default_time_budget_ms=default_time_budget_ms
+        )
+    
+    def optimize_loaded_basket(self, basket, products_data, prices_data, shop_configs, log=None,
+                               progress_callback=None, cancel_check=None, default_time_budget_ms=None,
+                               shared_data=None, persist=True):
+        """
+        Optymalizacja koszyka już wczytanego z pliku
+        
+        shared_data - dane przygotowane raz dla wielu koszyków (optimization_batch)
+        persist=False - nie zapisuj koszyka; wołający zapisuje wszystkie naraz
+        (basket['last_optimization'], last_plan i poprawione ustawienia są ustawione w obiekcie)
+        """
+        if log is None:
+            log = OptimizationTrace(echo_prefix="BASKET_MANAGER LOG: ")
         
         if 'basket_items' not in basket or not basket['basket_items']:
-            log("❌ BŁĄD: Koszyk jest pusty")
-            return {'success': False, 'error': 'Koszyk jest pusty', 'optimization_log': optimization_log}
+            log.error("❌ BŁĄD: Koszyk jest pusty")
+            return {'success': False, 'error': 'Koszyk jest pusty', 'optimization_log': log.lines()}
         
         # Pobierz i zwaliduj ustawienia
         settings = basket.get('optimization_settings', {})
+        log.set_capture(settings.get('show_logs', False))
         settings = self._validate_and_fix_settings(settings, log)
+        log.set_capture(settings.get('show_logs', False))
+        
+        # Budżet czasu z wywołania - tylko dla tego uruchomienia
+        engine_settings = settings
+        if default_time_budget_ms and not settings.get('time_budget_ms'):
+            engine_settings = dict(settings, time_budget_ms=int(default_time_budget_ms))
         
         # Loguj wszystkie ustawienia
-        self._log_all_settings(basket, settings, log)
+        self._log_all_settings(basket, engine_settings, log)
+        
+        # Cache wyników - ten sam koszyk, ustawienia i ceny = ten sam wynik
+        cache_key = None
+        if shared_data is not None:
+            substitute_groups = shared_data.substitute_groups
+        else:
+            try:
+                from substitute_manager import substitute_manager
+                substitute_groups = substitute_manager.load_substitute_groups()
+            except ImportError:
+                substitute_groups = {}
+        try:
+            cache_key, relevant_product_ids = optimization_cache.make_key(
+                basket, engine_settings, products_data, prices_data, shop_configs, substitute_groups
+            )
+            cached_result = optimization_cache.get(cache_key)
+        except Exception as e:
+            log(f"⚠️ Cache optymalizacji niedostępny: {str(e)}")
+            cached_result = None
+        
+        if cached_result:
+            log(f"⚡ Wynik z cache (z {cached_result.get('optimized_at')}) - koszyk, ustawienia i ceny bez zmian")
+            cached_result['optimization_log'] = log.lines()
+            cached_result['show_logs'] = settings.get('show_logs', False)
+            cached_result['from_cache'] = True
+            # Plan i znacznik jak po liczeniu - koszyk bez last_plan byłby przeliczany po każdej zmianie cen
+            if basket.get('last_optimization') != cached_result.get('optimized_at') or not basket.get('last_plan'):
+                basket['last_optimization'] = cached_result['optimized_at']
+                basket['optimization_settings'] = settings
+                basket['last_plan'] = compact_plan(cached_result, basket, settings)
+                if persist:
+                    self.save_basket(basket)
+            return cached_result
         
         try:
             # UŻYJ NOWEGO SILNIKA OPTYMALIZACJI
@@ -54,7 +122,10 @@ class BasketManager:
             log("✅ Import sukces!")
             
             log("🎯 Tworzenie engine...")
-            engine = OptimizationEngine(settings, log)
+            engine = OptimizationEngine(engine_settings, log)
+            engine.set_job_hooks(progress_callback, cancel_check)
+            if shared_data is not None:
+                engine.set_shared_data(shared_data)
             log("✅ Engine utworzony!")
             
             log("🧮 Wywołuję engine.optimize_basket...")
@@ -82,43 +153,58 @@ class BasketManager:
                         'current_shop_limit': current_limit,
                         'min_shops_required': min_required,
                         'suggestion': f'Zwiększ limit sklepów do co najmniej {min_required} w ustawieniach koszyka.',
-                        'optimization_log': optimization_log,
+                        'optimization_log': log.lines(),
                         'show_logs': True
                     }
                 
-                # Dodaj logi do wyniku
-                result['optimization_log'] = optimization_log
+                if cache_key:
+                    optimization_cache.put(cache_key, relevant_product_ids, result)
+                
                 result['show_logs'] = settings.get('show_logs', False)
                 
                 # Zapisz informacje o ostatniej optymalizacji
                 basket['last_optimization'] = result['optimized_at']
                 basket['optimization_settings'] = settings  # Zapisz poprawione ustawienia
-                self.save_basket(basket)
+                basket['last_plan'] = compact_plan(result, basket, settings)  # do testów przy zmianach cen
+                if persist:
+                    self.save_basket(basket)
                 
                 log("✅ OPTYMALIZACJA ZAKOŃCZONA SUKCESEM!")
                 self._log_final_summary(result['best_option'], log)
                 
+                # Dodaj logi do wyniku
+                result['optimization_log'] = log.lines()
                 return result
             else:
-                result['optimization_log'] = optimization_log
                 result['show_logs'] = True  # Zawsze pokażj logi gdy błąd
-                log(f"❌ OPTYMALIZACJA NIEUDANA: {result.get('error', 'Nieznany błąd')}")
+                log.error(f"❌ OPTYMALIZACJA NIEUDANA: {result.get('error', 'Nieznany błąd')}")
+                result['optimization_log'] = log.lines()
                 return result
                 
+        except OptimizationCancelled:
+            log("🛑 OPTYMALIZACJA ANULOWANA")
+            return {
+                'success': False,
+                'error': 'Optymalizacja została anulowana',
+                'error_type': 'cancelled',
+                'optimization_log': log.lines(),
+                'show_logs': settings.get('show_logs', False)
+            }
+            
         except ImportError as e:
-            log(f"💥 BŁĄD IMPORTU OptimizationEngine: {str(e)}")
+            log.error(f"💥 BŁĄD IMPORTU OptimizationEngine: {str(e)}")
             log("📁 Sprawdź czy plik optimization_engine.py istnieje w tym samym katalogu")
             
             return {
                 'success': False,
                 'error': f'Błąd importu nowego silnika: {str(e)}. Sprawdź czy plik optimization_engine.py istnieje.',
                 'error_type': 'import_error',
-                'optimization_log': optimization_log,
+                'optimization_log': log.lines(),
                 'show_logs': True
             }
             
         except Exception as e:
-            log(f"💥 KRYTYCZNY BŁĄD w silniku optymalizacji: {str(e)}")
+            log.error(f"💥 KRYTYCZNY BŁĄD w silniku optymalizacji: {str(e)}")
             import traceback
             traceback.print_exc()
             
@@ -126,7 +212,7 @@ class BasketManager:
                 'success': False,
                 'error': f'Błąd w silniku optymalizacji: {str(e)}',
                 'error_type': 'optimization_error',
-                'optimization_log': optimization_log,
+                'optimization_log': log.lines(),
                 'show_logs': True
             }
     
@@ -145,6 +231,9 @@ class BasketManager:
             'consider_free_shipping': True,
             'show_logs': False,
             'max_combinations': 200000,
+            'time_budget_ms': 0,  # 0 = bez limitu czasu
+            'parallel_workers': 0,  # 0/1 = przeszukiwanie jednoprocesowe
+            'max_offers_per_need': 0,  # 0 = bez limitu rang ofert
             'substitute_settings': {
                 'allow_substitutes': True,
                 'max_price_increase_percent': 20.0,
@@ -164,6 +253,10 @@ class BasketManager:
             fixed_settings['min_savings_threshold'] = max(0, float(fixed_settings['min_savings_threshold']))
             fixed_settings['max_quantity_multiplier'] = max(1, min(10, int(fixed_settings['max_quantity_multiplier'])))
             fixed_settings['max_combinations'] = max(1000, min(2000000, int(fixed_settings['max_combinations'])))
+            time_budget_ms = int(fixed_settings['time_budget_ms'] or 0)
+            fixed_settings['time_budget_ms'] = 0 if time_budget_ms <= 0 else max(100, min(600000, time_budget_ms))
+            fixed_settings['parallel_workers'] = max(0, min(64, int(fixed_settings['parallel_workers'] or 0)))
+            fixed_settings['max_offers_per_need'] = max(0, min(100, int(fixed_settings['max_offers_per_need'] or 0)))
         except (ValueError, TypeError) as e:
             log_func(f"   ⚠️ Błąd walidacji numerycznej: {e}, używam domyślnych")
             
@@ -203,6 +296,9 @@ class BasketManager:
         log_func(f"   🎯 Priorytet: {settings.get('priority', 'lowest_total_cost')}")
         log_func(f"   🏪 Max sklepów: {settings.get('max_shops', 5)} ⚠️ BĘDZIE EGZEKWOWANY!")
         log_func(f"   🔥 Max kombinacji: {settings.get('max_combinations', 200000):,}")
+        log_func(f"   ✂️ Max ofert na potrzebę: {settings.get('max_offers_per_need') or 'bez limitu'}")
+        log_func(f"   🧵 Procesy równoległe: {settings.get('parallel_workers') or 'wyłączone'}")
+        log_func(f"   ⏱️ Budżet czasu: {str(settings['time_budget_ms']) + ' ms' if settings.get('time_budget_ms') else 'bez limitu'}")
         log_func(f"   📈 Sugeruj ilości: {settings.get('suggest_quantities', False)}")
         log_func(f"   💰 Próg oszczędności: {settings.get('min_savings_threshold', 5.0)} PLN")
         log_func(f"   📊 Max mnożnik ilości: {settings.get('max_quantity_multiplier', 3)}")
@@ -303,9 +399,11 @@ class BasketManager:
         baskets = self.load_baskets()
         baskets[basket_data['basket_id']] = basket_data
         
-        with open(self.baskets_file, 'w', encoding='utf-8') as f:
-            for basket in baskets.values():
-                f.write(json.dumps(basket, ensure_ascii=False) + '\n')
+        self.save_baskets(baskets)
+    
+    def save_baskets(self, baskets):
+        """Przepisuje plik koszyków jednym zapisem (dict basket_id -> koszyk)"""
+        write_jsonl_atomic(self.baskets_file, baskets.values())
     
     def get_basket(self, basket_id):
         """Pobiera konkretny koszyk"""
@@ -469,9 +567,7 @@ class BasketManager:
         if basket_id in baskets:
             del baskets[basket_id]
             
-            with open(self.baskets_file, 'w', encoding='utf-8') as f:
-                for basket in baskets.values():
-                    f.write(json.dumps(basket, ensure_ascii=False) + '\n')
+            write_jsonl_atomic(self.baskets_file, baskets.values())
             
             return True
         
@@ -0,0 +1,325 @@
+"""
+Optymalizacja wielu koszyków naraz - np. po nocnym odświeżeniu cen
+
+Pojedyncze BasketManager.optimize_basket dla każdego koszyka czyta plik koszyków,
+normalizuje wszystkie ceny, buduje indeks cen i czyta pliki zamienników od nowa.
+Tutaj ceny, konfiguracje sklepów, grupy zamienników i katalog produktów są
+wczytywane i przygotowane raz (SharedOptimizationData), trafiają do procesów
+roboczych raz na partię (worker rozpakowuje je tylko przy nowej partii), a pula
+procesów (spawn) jest jedna na proces i współdzielona przez kolejne partie.
+Na końcu plik koszyków jest przepisywany jednym zapisem.
+
+Użycie:
+    python optimization_batch.py
+    python optimization_batch.py --baskets basket_1700000000 basket_1700000100 --workers 4
+    python optimization_batch.py --time-budget-ms 5000 --no-save
+"""
+import argparse
+import atexit
+import itertools
+import os
+import pickle
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from optimization_engine import normalize_prices, record_optimization_metrics
+
+
+class SharedOptimizationData:
+    """Dane wspólne dla wszystkich koszyków w partii - liczone raz"""
+
+    def __init__(self, products_data, prices_data, shop_configs, substitute_groups):
+        self.products_data = products_data
+        self.prices_data = prices_data
+        self.shop_configs = shop_configs
+        self.substitute_groups = substitute_groups
+
+        self.product_names = {
+            product['id']: product.get('name') for product in products_data if isinstance(product, dict)
+        }
+        self.normalized_prices = normalize_prices(prices_data)
+        self.prices_by_product = {}
+        for price_data in self.normalized_prices.values():
+            self.prices_by_product.setdefault(price_data['product_id'], []).append(price_data)
+
+        # produkt -> pierwsza grupa z nim (jak SubstituteManager.get_substitutes_for_product)
+        self._products_by_id = {}
+        for product in products_data:
+            if isinstance(product, dict):
+                self._products_by_id.setdefault(product.get('id'), product)
+        self._group_of_product = {}
+        for group in substitute_groups.values():
+            for product_id in group.get('product_ids', []):
+                self._group_of_product.setdefault(product_id, group)
+        self._substitutes = {}
+
+    @classmethod
+    def load(cls):
+        """Wczytaj wszystko z plików danych"""
+        from utils.data_utils import load_products, get_latest_prices
+        from shop_config import shop_config
+        try:
+            from substitute_manager import substitute_manager
+            substitute_groups = substitute_manager.load_substitute_groups()
+        except ImportError:
+            substitute_groups = {}
+        return cls(load_products(), get_latest_prices(), shop_config.load_shop_configs(), substitute_groups)
+
+    def substitutes_for_product(self, product_id):
+        """Ten sam wynik co SubstituteManager.get_substitutes_for_product - bez czytania plików"""
+        info = self._substitutes.get(product_id)
+        if info is not None:
+            return info
+
+        group = self._group_of_product.get(product_id)
+        if group is None:
+            info = {'group_id': None, 'substitutes': [], 'settings': {}}
+        else:
+            substitutes = []
+            for pid in group['product_ids']:
+                product = self._products_by_id.get(pid) if pid != product_id else None
+                if product:
+                    priority_map = group['priority_map']
+                    substitutes.append(dict(product, priority=priority_map.get(pid, priority_map.get(str(pid), 99))))
+            substitutes.sort(key=lambda x: x['priority'])
+            info = {'group_id': group['group_id'], 'substitutes': substitutes, 'settings': group['settings']}
+
+        self._substitutes[product_id] = info
+        return info
+
+
+# Stan procesu roboczego - dane wspólne ostatniej partii
+_worker_shared = None
+_worker_shared_token = None
+
+
+def _use_shared(shared_ref):
+    """Dane wspólne zadania - rozpakuj tylko gdy to nowa partia"""
+    global _worker_shared, _worker_shared_token
+    token, payload = shared_ref
+    if token != _worker_shared_token:
+        _worker_shared = pickle.loads(payload)
+        _worker_shared_token = token
+    return _worker_shared
+
+
+def _pool_optimize_task(shared_ref, basket, time_budget_ms=None):
+    """Zadanie puli - koszyk i referencja (token, dane) do danych wspólnych partii"""
+    return _optimize_task(basket, time_budget_ms, shared=_use_shared(shared_ref))
+
+
+def _optimize_task(basket, time_budget_ms=None, shared=None):
+    """Optymalizacja jednego koszyka (w workerze albo w tym procesie)"""
+    from basket_manager import basket_manager
+
+    started = time.monotonic()
+    try:
+        result = basket_manager.optimize_loaded_basket(
+            basket, shared.products_data, shared.prices_data, shared.shop_configs,
+            default_time_budget_ms=time_budget_ms, shared_data=shared, persist=False
+        )
+    except Exception as e:
+        result = {'success': False, 'error': f'Błąd optymalizacji: {str(e)}', 'error_type': 'optimization_error'}
+
+    updates = None
+    if result.get('success'):
+        updates = {
+            'last_optimization': basket.get('last_optimization'),
+            'optimization_settings': basket.get('optimization_settings'),
+            'last_plan': basket.get('last_plan'),
+        }
+    return basket['basket_id'], result, updates, time.monotonic() - started
+
+
+def _default_workers():
+    return max(1, min(4, (os.cpu_count() or 2) - 1))
+
+
+# ----------------------------------------------------------------------
+# Pula procesów - jedna na proces, współdzielona przez kolejne partie
+# ----------------------------------------------------------------------
+
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+_batch_tokens = itertools.count(1)
+
+
+def _acquire_pool(workers):
+    """Pula tworzona przy pierwszej partii i podmieniana tylko gdy potrzeba więcej procesów"""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers < workers:
+            from optimization_jobs import pool_context
+            if _pool is not None:
+                _pool.shutdown(wait=False)  # stara pula kończy zadania trwających partii
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=pool_context())
+            _pool_workers = workers
+        return _pool
+
+
+def _discard_pool(pool):
+    """Zepsuta pula (proces roboczy padł) - następna partia utworzy nową"""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if pool is _pool:
+            _pool, _pool_workers = None, 0
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_pool():
+    """Zamknij współdzieloną pulę (przy wyjściu z procesu)"""
+    global _pool, _pool_workers
+    with _pool_lock:
+        pool, _pool, _pool_workers = _pool, None, 0
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+atexit.register(shutdown_pool)
+
+
+def optimize_baskets(basket_ids=None, workers=None, time_budget_ms=None, shared=None, save=True, on_result=None):
+    """
+    Optymalizuj wszystkie (albo wybrane) koszyki
+
+    Args:
+        basket_ids: lista id koszyków; None = wszystkie
+        workers: liczba procesów; 0/1 = w tym procesie
+        time_budget_ms: budżet czasu dla koszyków bez własnego time_budget_ms
+        shared: SharedOptimizationData; None = wczytaj z plików
+        save: zapisz last_optimization, plan i poprawione ustawienia (jeden zapis pliku koszyków)
+        on_result: funkcja(basket_id, result) po każdym skończonym koszyku
+
+    Returns:
+        dict: {'success', 'results': {basket_id: wynik}, 'summary': {...}} albo {'success': False, 'error'}
+    """
+    from basket_manager import basket_manager
+
+    started = time.monotonic()
+    baskets = basket_manager.load_baskets()
+    if basket_ids:
+        missing = [basket_id for basket_id in basket_ids if basket_id not in baskets]
+        if missing:
+            return {'success': False, 'error': f"Nie znaleziono koszyków: {', '.join(missing)}"}
+        selected = [baskets[basket_id] for basket_id in basket_ids]
+    else:
+        selected = list(baskets.values())
+
+    if not selected:
+        return {'success': False, 'error': 'Brak koszyków do optymalizacji'}
+
+    if shared is None:
+        shared = SharedOptimizationData.load()
+    prepared_at = time.monotonic()
+
+    order = [basket['basket_id'] for basket in selected]
+    workers = _default_workers() if workers is None else max(0, int(workers))
+    workers = min(workers, len(selected))
+    # Największe koszyki najpierw - równiejsze obciążenie workerów
+    selected.sort(key=lambda basket: len(basket.get('basket_items', {})), reverse=True)
+
+    results, updates, durations = {}, {}, {}
+
+    def collect(task_result):
+        basket_id, result, basket_updates, duration = task_result
+        results[basket_id] = result
+        durations[basket_id] = duration
+        record_optimization_metrics(result)  # wynik z workera - metryki w tym procesie
+        if basket_updates:
+            updates[basket_id] = basket_updates
+        if on_result:
+            on_result(basket_id, result)
+
+    pool = None
+    if workers > 1:
+        try:
+            pool = _acquire_pool(workers)
+        except (OSError, ImportError, NotImplementedError) as e:
+            print(f"⚠️ Pula procesów niedostępna ({e}) - optymalizacja w tym procesie")
+
+    if pool is not None:
+        shared_ref = (next(_batch_tokens), pickle.dumps(shared, protocol=pickle.HIGHEST_PROTOCOL))
+        futures = []
+        try:
+            futures = [pool.submit(_pool_optimize_task, shared_ref, basket, time_budget_ms) for basket in selected]
+            for future in as_completed(futures):
+                collect(future.result())
+        except BrokenProcessPool:
+            _discard_pool(pool)
+            raise
+        except BaseException:
+            # Pula zostaje dla następnych partii - anuluj tylko zadania tej
+            for future in futures:
+                future.cancel()
+            raise
+    else:
+        workers = 1
+        for basket in selected:
+            collect(_optimize_task(basket, time_budget_ms, shared=shared))
+
+    # Jeden zapis pliku koszyków - na świeżo wczytanych koszykach, żeby nie
+    # nadpisać zmian zrobionych w trakcie partii (zmieniamy tylko pola wyniku)
+    saved = 0
+    if save and updates:
+        current = basket_manager.load_baskets()
+        for basket_id, basket_updates in updates.items():
+            if basket_id in current:
+                current[basket_id].update(basket_updates)
+                saved += 1
+        basket_manager.save_baskets(current)
+
+    return {
+        'success': True,
+        'results': {basket_id: results[basket_id] for basket_id in order},
+        'summary': {
+            'baskets': len(selected),
+            'succeeded': sum(1 for result in results.values() if result.get('success')),
+            'failed': sum(1 for result in results.values() if not result.get('success')),
+            'saved': saved,
+            'workers': workers,
+            'prices': len(shared.normalized_prices),
+            'prepare_ms': int((prepared_at - started) * 1000),
+            'elapsed_ms': int((time.monotonic() - started) * 1000),
+            'basket_ms': {basket_id: int(seconds * 1000) for basket_id, seconds in durations.items()},
+        }
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Optymalizacja wielu koszyków ze wspólnym przygotowaniem danych')
+    parser.add_argument('--baskets', nargs='+', help='id koszyków (domyślnie wszystkie)')
+    parser.add_argument('--workers', type=int, default=None, help='procesy robocze (0/1 = bez puli)')
+    parser.add_argument('--time-budget-ms', type=int, default=None,
+                        help='budżet czasu dla koszyków bez własnego ustawienia')
+    parser.add_argument('--no-save', action='store_true', help='nie zapisuj wyników w pliku koszyków')
+    args = parser.parse_args(argv)
+
+    def report(basket_id, result):
+        if result.get('success'):
+            best = result['best_option']
+            shops = best.get('shops_count', len(best.get('shops_summary', {})))
+            print(f"   ✅ {basket_id}: {best['total_cost']:.2f} PLN, sklepy: {shops}"
+                  f"{' (cache)' if result.get('from_cache') else ''}")
+        else:
+            print(f"   ❌ {basket_id}: {result.get('error', 'Nieznany błąd')}")
+
+    print("🛒 OPTYMALIZACJA PARTII KOSZYKÓW")
+    outcome = optimize_baskets(args.baskets, workers=args.workers, time_budget_ms=args.time_budget_ms,
+                               save=not args.no_save, on_result=report)
+    if not outcome['success']:
+        print(f"❌ {outcome['error']}")
+        return 1
+
+    summary = outcome['summary']
+    print(f"📊 Koszyki: {summary['baskets']} (ok: {summary['succeeded']}, błędy: {summary['failed']}), "
+          f"workerzy: {summary['workers']}, zapisano: {summary['saved']}")
+    print(f"⏱️ Przygotowanie danych: {summary['prepare_ms']} ms, razem: {summary['elapsed_ms']} ms")
+    return 0 if not summary['failed'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
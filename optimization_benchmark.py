@@ -0,0 +1,414 @@
+"""
+Benchmark silnika optymalizacji koszyków
+
+Generuje syntetyczne katalogi (produkty, sklepy, rozrzut cen, rzadkie pokrycie,
+grupy zamienników, progi darmowej dostawy) i uruchamia na nich każdą strategię
+OptimizationEngine ze stałym ziarnem. Raportuje czas, szczyt pamięci, liczbę
+ocenionych kombinacji i stratę do najlepszego znanego rozwiązania.
+Każde uruchomienie dopisuje rekord do pliku trendu (JSONL) - do porównywania commitów.
+
+Użycie:
+    python optimization_benchmark.py
+    python optimization_benchmark.py --scenario medium large --repeat 3 --compare
+    python optimization_benchmark.py --strategies shop_subsets genetic --time-budget-ms 2000
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+from optimization_engine import OptimizationEngine, _BudgetExhausted
+from optimization_trace import OptimizationTrace
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_TREND_FILE = os.path.join(REPO_DIR, 'logs', 'optimization_benchmark.jsonl')
+
+# Parametry katalogów - coverage to szansa że sklep ma dany produkt
+SCENARIOS = {
+    'tiny': {'products': 12, 'shops': 5, 'basket_size': 6, 'max_shops': 3,
+             'price_dispersion': 0.15, 'coverage': 0.7, 'substitute_groups': 1, 'threshold_share': 0.5},
+    'medium': {'products': 40, 'shops': 12, 'basket_size': 12, 'max_shops': 3,
+               'price_dispersion': 0.25, 'coverage': 0.6, 'substitute_groups': 3, 'threshold_share': 0.5},
+    'sparse': {'products': 60, 'shops': 25, 'basket_size': 15, 'max_shops': 4,
+               'price_dispersion': 0.3, 'coverage': 0.25, 'substitute_groups': 4, 'threshold_share': 0.6},
+    'large': {'products': 120, 'shops': 30, 'basket_size': 25, 'max_shops': 4,
+              'price_dispersion': 0.25, 'coverage': 0.5, 'substitute_groups': 6, 'threshold_share': 0.5},
+}
+
+# Strategie: nazwa -> metoda silnika (None = cały optimize_basket)
+STRATEGIES = {
+    'exhaustive': '_exhaustive_search_with_shop_filter',
+    'smart_sampling': '_smart_sampling_with_shop_filter',
+    'genetic': '_genetic_algorithm_with_shop_limit',
+    'local_search': '_local_search_with_shop_limit',
+    'shop_subsets': '_shop_subset_search',
+    'parallel': '_parallel_search_with_shop_limit',
+    'pipeline': None,
+}
+
+# Strategie dające wynik dokładny - ich wynik jest "najlepszym znanym" bez zastrzeżeń
+EXACT_STRATEGIES = ('exhaustive', 'shop_subsets')
+
+
+def generate_catalog(products=40, shops=12, basket_size=12, max_shops=3, price_dispersion=0.25,
+                     coverage=0.6, substitute_groups=3, group_size=3, threshold_share=0.5, seed=0):
+    """
+    Syntetyczny katalog w formatach plików data/ (produkty, ceny, sklepy, zamienniki, koszyk)
+
+    Każdy sklep ma swój poziom cen (tańsze/droższe sklepy), a każda oferta
+    losowy rozrzut wokół ceny bazowej produktu. Produkty grupy zamienników mają
+    zbliżone ceny bazowe; część grupy trafia do koszyka, reszta jest zamiennikami spoza niego.
+    """
+    rng = random.Random(seed)
+    now = datetime(2025, 1, 1).isoformat()
+
+    product_list = []
+    base_price = {}
+    for product_id in range(1, products + 1):
+        base_price[product_id] = round(math.exp(rng.uniform(math.log(5), math.log(150))), 2)
+        product_list.append({'id': product_id, 'name': f'Produkt {product_id}', 'substitute_group': None})
+
+    groups = []
+    free_ids = list(base_price)
+    rng.shuffle(free_ids)
+    for index in range(substitute_groups):
+        members = free_ids[index * group_size:(index + 1) * group_size]
+        if len(members) < 2:
+            break
+        group_id = f'group_bench_{index + 1}'
+        anchor = base_price[members[0]]
+        for product_id in members:
+            base_price[product_id] = round(anchor * rng.uniform(0.9, 1.15), 2)
+            product_list[product_id - 1]['substitute_group'] = group_id
+        groups.append({
+            'group_id': group_id,
+            'name': f'Grupa {index + 1}',
+            'created': now,
+            'updated': now,
+            'product_ids': members,
+            'priority_map': {str(product_id): 1 for product_id in members},
+            'settings': {'max_price_increase_percent': 20.0, 'min_quantity_ratio': 0.8,
+                         'max_quantity_ratio': 1.5, 'allow_automatic_substitution': True}
+        })
+
+    shop_ids = [f'shop{index + 1:02d}' for index in range(shops)]
+    shop_configs = {}
+    shop_level = {}
+    for shop_id in shop_ids:
+        shop_level[shop_id] = rng.uniform(0.9, 1.1)
+        has_threshold = rng.random() < threshold_share
+        shop_configs[shop_id] = {
+            'shop_id': shop_id,
+            'name': shop_id,
+            'delivery_cost': rng.choice([0, 8.99, 11.99, 14.99, 19.99]),
+            'delivery_free_from': rng.choice([99.0, 149.0, 199.0, 299.0]) if has_threshold else None,
+            'currency': 'PLN'
+        }
+
+    prices = {}
+    for product_id, price in base_price.items():
+        stocked = [shop_id for shop_id in shop_ids if rng.random() < coverage] or [rng.choice(shop_ids)]
+        for shop_id in stocked:
+            offer_price = price * shop_level[shop_id] * max(0.3, 1 + rng.gauss(0, price_dispersion))
+            prices[f'{product_id}-{shop_id}'] = {
+                'product_id': product_id,
+                'shop_id': shop_id,
+                'price': f'{offer_price:.2f}',
+                'currency': 'PLN',
+                'created': '2025-01-01 00:00:00'
+            }
+
+    # Koszyk: po dwa produkty z części grup (łączenie ilości), reszta losowo
+    basket_ids = []
+    for group in groups[:max(1, len(groups) // 2)]:
+        basket_ids.extend(group['product_ids'][:2])
+    remaining = [product_id for product_id in base_price if product_id not in basket_ids]
+    rng.shuffle(remaining)
+    basket_ids = (basket_ids + remaining)[:basket_size]
+
+    basket = {
+        'basket_id': f'bench_{seed}',
+        'name': 'Benchmark',
+        'basket_items': {
+            str(product_id): {
+                'product_id': product_id,
+                'product_name': f'Produkt {product_id}',
+                'requested_quantity': rng.choice([1, 1, 1, 2, 3]),
+                'substitute_settings': {'allow_substitutes': True, 'max_price_increase_percent': 20.0}
+            }
+            for product_id in basket_ids
+        }
+    }
+
+    return {
+        'products': product_list,
+        'prices': prices,
+        'shop_configs': shop_configs,
+        'substitute_groups': groups,
+        'basket': basket,
+        'max_shops': max_shops,
+    }
+
+
+@contextmanager
+def synthetic_data_dir(catalog):
+    """
+    Katalog roboczy z syntetycznym data/ - moduły czytają ścieżki względne,
+    więc zamienniki i produkty pochodzą z katalogu, a prawdziwe dane zostają nietknięte
+    """
+    previous = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='price-benchmark-') as workdir:
+        os.makedirs(os.path.join(workdir, 'data'))
+        for filename, records in (('products.txt', catalog['products']),
+                                  ('substitutes.txt', catalog['substitute_groups'])):
+            with open(os.path.join(workdir, 'data', filename), 'w', encoding='utf-8') as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        os.chdir(workdir)
+        try:
+            yield workdir
+        finally:
+            os.chdir(previous)
+
+
+def _prepare(engine, catalog):
+    """Kroki 1-3b optimize_basket - wspólne przygotowanie ofert dla pojedynczych strategii"""
+    normalized_prices = engine._normalize_prices(catalog['prices'])
+    grouped_needs = engine._group_substitute_products_with_combining(catalog['basket'])
+    expanded_offers, _ = engine._expand_offers_with_substitutes(grouped_needs, normalized_prices)
+    need_keys = [need_key for need_key, offers in expanded_offers.items() if offers]
+    expanded_offers = engine._advanced_preprocessing(expanded_offers, need_keys, catalog['shop_configs'],
+                                                     grouped_needs)
+    return expanded_offers, need_keys, grouped_needs
+
+
+def _skip_reason(strategy, engine, expanded_offers, need_keys):
+    """Strategie, których nie da się sensownie uruchomić na tym katalogu"""
+    if strategy == 'exhaustive':
+        total = 1
+        for need_key in need_keys:
+            total *= len(expanded_offers[need_key])
+        if total > engine.MAX_COMBINATIONS:
+            return f'{total:.2e} kombinacji > max_combinations'
+    elif strategy == 'shop_subsets':
+        shops_count = len({offer.shop for need_key in need_keys for offer in expanded_offers[need_key]})
+        if engine._count_shop_subsets(shops_count) > engine.MAX_SHOP_SUBSETS:
+            return 'za dużo podzbiorów sklepów'
+    elif strategy == 'parallel' and engine.parallel_workers < 2:
+        return 'parallel_workers < 2'
+    return None
+
+
+def run_strategy(strategy, catalog, settings):
+    """
+    Jedno uruchomienie strategii na świeżym silniku
+
+    Returns:
+        dict: status, czasy, liczniki i wynik (koszt, sklepy, wynik wg priorytetu)
+    """
+    engine = OptimizationEngine(settings, OptimizationTrace())
+    started = time.perf_counter()
+
+    if STRATEGIES[strategy] is None:
+        optimization = engine.optimize_basket(catalog['basket'], catalog['products'],
+                                              catalog['prices'], catalog['shop_configs'])
+        result = optimization.get('best_option') if optimization.get('success') else None
+        prep_ms = 0.0
+        budget_exhausted = bool(engine.stats.get('budget_exhausted'))
+    else:
+        expanded_offers, need_keys, grouped_needs = _prepare(engine, catalog)
+        prep_ms = (time.perf_counter() - started) * 1000
+        reason = _skip_reason(strategy, engine, expanded_offers, need_keys)
+        if reason:
+            return {'status': 'skipped', 'reason': reason}
+
+        if engine.time_budget_ms:
+            engine.deadline = time.monotonic() + engine.time_budget_ms / 1000.0
+        budget_exhausted = False
+        try:
+            result = getattr(engine, STRATEGIES[strategy])(
+                expanded_offers, need_keys, grouped_needs, catalog['shop_configs']
+            )
+        except _BudgetExhausted:
+            result = engine.incumbent
+            budget_exhausted = True
+
+    wall_ms = (time.perf_counter() - started) * 1000
+    if not result:
+        return {'status': 'no_solution', 'wall_ms': round(wall_ms, 2)}
+
+    return {
+        'status': 'ok',
+        'wall_ms': round(wall_ms, 2),
+        'prep_ms': round(prep_ms, 2),
+        'combinations_evaluated': engine.stats['combinations_evaluated'],
+        'combinations_scored': engine.stats['combinations_scored'],
+        'total_cost': round(result['total_cost'], 2),
+        'shops_count': result['shops_count'],
+        'score': round(engine._calculate_priority_score(result), 4),
+        'exact': bool(engine.stats.get('exact_solution')) or (strategy == 'exhaustive' and engine.pruning_lossless),
+        'budget_exhausted': budget_exhausted,
+    }
+
+
+def _peak_memory_kb(strategy, catalog, settings):
+    """Szczyt alokacji Pythona (osobny przebieg - tracemalloc spowalnia pomiar czasu)"""
+    tracemalloc.start()
+    try:
+        run_strategy(strategy, catalog, settings)
+        return round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+    finally:
+        tracemalloc.stop()
+
+
+def run_scenario(name, params, strategies, seed=0, repeat=1, time_budget_ms=0, workers=2,
+                 priority='lowest_total_cost', max_combinations=20000, measure_memory=True):
+    """Wszystkie strategie na jednym katalogu + strata do najlepszego znanego wyniku"""
+    catalog = generate_catalog(seed=seed, **params)
+    settings = {
+        'max_shops': catalog['max_shops'],
+        'priority': priority,
+        'random_seed': seed,
+        'max_combinations': max_combinations,
+        'suggest_quantities': False,
+        'show_logs': False,
+        'time_budget_ms': time_budget_ms,
+        'parallel_workers': workers,
+    }
+
+    results = {}
+    with synthetic_data_dir(catalog):
+        for strategy in strategies:
+            runs = [run_strategy(strategy, catalog, settings) for _ in range(max(1, repeat))]
+            record = runs[0]
+            if record['status'] == 'ok':
+                record['wall_ms'] = round(statistics.median(run['wall_ms'] for run in runs), 2)
+                if measure_memory:
+                    record['peak_kb'] = _peak_memory_kb(strategy, catalog, settings)
+            results[strategy] = record
+            print(f"   {_format_row(strategy, record)}")
+
+    solved = {strategy: record for strategy, record in results.items() if record['status'] == 'ok'}
+    best_score = min((record['score'] for record in solved.values()), default=None)
+    for record in solved.values():
+        record['gap_percent'] = round((record['score'] - best_score) / best_score * 100, 3) if best_score else 0.0
+
+    return {
+        'params': params,
+        'seed': seed,
+        'priority': priority,
+        'time_budget_ms': time_budget_ms,
+        'max_combinations': max_combinations,
+        'best_known_score': best_score,
+        'best_known_exact': any(solved.get(strategy, {}).get('exact') for strategy in EXACT_STRATEGIES),
+        'strategies': results,
+    }
+
+
+def _format_row(strategy, record):
+    if record['status'] != 'ok':
+        return f"{strategy:<15} {record['status']}" + (f" ({record['reason']})" if record.get('reason') else '')
+    return (f"{strategy:<15} {record['wall_ms']:>10.1f} ms  {record['combinations_scored']:>9,} ocen "
+            f"{record['combinations_evaluated']:>9,} prób  {record.get('peak_kb', 0):>9,.0f} KB  "
+            f"{record['total_cost']:>9.2f} PLN  {record['shops_count']} sklepy"
+            + ('  ⏱️' if record['budget_exhausted'] else '') + ('  ✅ dokładny' if record['exact'] else ''))
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def load_trend(path):
+    """Rekordy z pliku trendu (najstarsze pierwsze)"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def append_trend(path, record):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+def compare_with_previous(record, previous):
+    """Różnice czasu i straty względem poprzedniego rekordu (te same scenariusze)"""
+    print(f"\n📈 PORÓWNANIE z {previous.get('commit') or '?'} ({previous['timestamp']}):")
+    for name, scenario in record['scenarios'].items():
+        old_scenario = previous['scenarios'].get(name)
+        if not old_scenario or (old_scenario['params'], old_scenario.get('max_combinations')) != \
+                (scenario['params'], scenario.get('max_combinations')):
+            continue
+        for strategy, current in scenario['strategies'].items():
+            old = old_scenario['strategies'].get(strategy, {})
+            if current['status'] != 'ok' or old.get('status') != 'ok':
+                continue
+            ratio = current['wall_ms'] / old['wall_ms'] if old['wall_ms'] else float('inf')
+            marker = '🔴' if ratio > 1.2 or current['gap_percent'] > old['gap_percent'] + 0.01 else '🟢'
+            print(f"   {marker} {name}/{strategy}: czas x{ratio:.2f}, "
+                  f"strata {old['gap_percent']:.2f}% → {current['gap_percent']:.2f}%")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark strategii optymalizacji koszyków')
+    parser.add_argument('--scenario', nargs='+', default=['tiny', 'medium'], choices=sorted(SCENARIOS))
+    parser.add_argument('--strategies', nargs='+', default=list(STRATEGIES), choices=list(STRATEGIES))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=1, help='powtórzenia - raportowana mediana czasu')
+    parser.add_argument('--priority', default='lowest_total_cost',
+                        choices=['lowest_total_cost', 'balanced', 'fewest_shops'])
+    parser.add_argument('--time-budget-ms', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=2, help='procesy dla strategii parallel')
+    parser.add_argument('--max-combinations', type=int, default=20000,
+                        help='max_combinations silnika (próbkowanie robi do 5x tyle losowań)')
+    parser.add_argument('--no-memory', action='store_true', help='pomiń pomiar pamięci (tracemalloc)')
+    parser.add_argument('--output', default=DEFAULT_TREND_FILE, help='plik trendu JSONL')
+    parser.add_argument('--compare', action='store_true', help='porównaj z poprzednim rekordem z pliku trendu')
+    args = parser.parse_args(argv)
+
+    output = os.path.abspath(args.output)
+    record = {
+        'timestamp': datetime.now().isoformat(),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'scenarios': {},
+    }
+
+    for name in args.scenario:
+        print(f"\n🏁 SCENARIUSZ {name}: {SCENARIOS[name]}")
+        record['scenarios'][name] = run_scenario(
+            name, SCENARIOS[name], args.strategies, seed=args.seed, repeat=args.repeat,
+            time_budget_ms=args.time_budget_ms, workers=args.workers, priority=args.priority,
+            max_combinations=args.max_combinations, measure_memory=not args.no_memory
+        )
+        for strategy, result in record['scenarios'][name]['strategies'].items():
+            if result['status'] == 'ok' and result['gap_percent'] > 0:
+                print(f"   📉 {strategy}: strata {result['gap_percent']:.2f}% do najlepszego znanego")
+
+    previous = load_trend(output)
+    append_trend(output, record)
+    print(f"\n💾 Zapisano wyniki: {output}")
+
+    if args.compare and previous:
+        compare_with_previous(record, previous[-1])
+    return record
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,156 @@
+"""
+Cache wyników optymalizacji koszyków - LRU + TTL
+
+Klucz to hash wszystkiego od czego zależy wynik silnika:
+pozycje koszyka, zwalidowane ustawienia, grupy zamienników dotyczące koszyka,
+konfiguracje dostaw sklepów z ofertami oraz "stempel" cen - najnowsze ceny
+produktów z koszyka (i ich zamienników). Zmiana którejkolwiek istotnej ceny
+zmienia klucz, a save_price dodatkowo od razu wyrzuca wpisy z tym produktem.
+Wyniki przerwane budżetem czasu (budget_exhausted) nie trafiają do cache -
+kolejne uruchomienie może mieć więcej czasu i znaleźć lepszy plan.
+"""
+import copy
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+class OptimizationCache:
+    """Cache wyników OptimizationEngine z eviction LRU + TTL"""
+
+    def __init__(self, max_entries=64, ttl_seconds=900):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (created, product_ids, result)
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0, 'skipped_partial': 0}
+
+    # ------------------------------------------------------------------
+    # Klucz
+    # ------------------------------------------------------------------
+
+    def relevant_product_ids(self, basket, substitute_groups):
+        """Produkty z koszyka + wszystkie produkty z ich grup zamienników"""
+        product_ids = {item['product_id'] for item in basket.get('basket_items', {}).values()}
+        for group in substitute_groups.values():
+            members = group.get('product_ids', [])
+            if product_ids.intersection(members):
+                product_ids.update(members)
+        return product_ids
+
+    def make_key(self, basket, settings, products_data, prices_data, shop_configs, substitute_groups):
+        """
+        Zbuduj klucz cache.
+
+        Returns:
+            tuple: (key, relevant_product_ids)
+        """
+        product_ids = self.relevant_product_ids(basket, substitute_groups)
+
+        relevant_prices = sorted(
+            (str(price.get('product_id')), str(price.get('shop_id')), str(price.get('price')),
+             str(price.get('currency', 'PLN')), str(price.get('created', '')))
+            for price in prices_data.values()
+            if isinstance(price, dict) and price.get('product_id') in product_ids
+        )
+        shop_ids = {shop_id for _, shop_id, _, _, _ in relevant_prices}
+
+        relevant_configs = {
+            shop_id: {
+                'delivery_cost': config.get('delivery_cost'),
+                'delivery_free_from': config.get('delivery_free_from'),
+            }
+            for shop_id, config in shop_configs.items() if shop_id in shop_ids
+        }
+
+        relevant_groups = {
+            group_id: group for group_id, group in substitute_groups.items()
+            if product_ids.intersection(group.get('product_ids', []))
+        }
+
+        product_names = {
+            str(p.get('id')): p.get('name') for p in products_data
+            if isinstance(p, dict) and p.get('id') in product_ids
+        }
+
+        payload = {
+            'basket_items': basket.get('basket_items', {}),
+            'settings': settings,
+            'substitute_groups': relevant_groups,
+            'shop_configs': relevant_configs,
+            'prices': relevant_prices,
+            'product_names': product_names,
+        }
+        raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest(), product_ids
+
+    # ------------------------------------------------------------------
+    # Operacje
+    # ------------------------------------------------------------------
+
+    def get(self, key):
+        """Zwróć kopię wyniku lub None (brak / przeterminowany)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+
+            created, _, result = entry
+            if time.monotonic() - created > self.ttl_seconds:
+                del self._entries[key]
+                self.stats['misses'] += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return copy.deepcopy(result)
+
+    @staticmethod
+    def is_cacheable(result):
+        """Czy wynik jest końcowy - nie przerwany budżetem czasu"""
+        stats = result.get('optimization_stats') if isinstance(result, dict) else None
+        return not (isinstance(stats, dict) and stats.get('budget_exhausted'))
+
+    def put(self, key, product_ids, result):
+        """Zapamiętaj wynik (kopię) - najstarsze wpisy wypadają po przekroczeniu limitu"""
+        with self._lock:
+            if not self.is_cacheable(result):
+                self.stats['skipped_partial'] += 1
+                return
+            self._entries[key] = (time.monotonic(), frozenset(product_ids), copy.deepcopy(result))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_product(self, product_id):
+        """Wyrzuć wyniki zależne od cen danego produktu"""
+        with self._lock:
+            stale = [key for key, (_, product_ids, _) in self._entries.items() if product_id in product_ids]
+            for key in stale:
+                del self._entries[key]
+            self.stats['invalidations'] += len(stale)
+
+    def on_price_saved(self, price_data):
+        """Listener save_price"""
+        if isinstance(price_data, dict):
+            self.invalidate_product(price_data.get('product_id'))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Singleton instance
+optimization_cache = OptimizationCache()
+
+try:
+    from utils.data_utils import add_price_listener
+    add_price_listener(optimization_cache.on_price_saved)
+except ImportError:
+    pass
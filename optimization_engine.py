@@ -1,21 +1,124 @@
-print("🔥🔥🔥 OPTIMIZATION_ENGINE: POPRAWIONY PLIK ZAŁADOWANY! 🔥🔥🔥")
-
 """
 Silnik optymalizacji koszyków - POPRAWIONA WERSJA z działającym limitem sklepów
 Ulepszone algorytmy z wieloma strategiami optymalizacji
 """
 import copy
+import os
 from datetime import datetime
 from itertools import product as itertools_product, combinations
 import random
 import math
+import time
+from typing import NamedTuple
+from optimization_trace import DEBUG, OptimizationTrace
+from quantity_optimizer import apply_free_shipping_top_up, find_free_shipping_top_up
+from utils.metrics import metrics
+
+class OptimizationCancelled(Exception):
+    """Optymalizacja przerwana na żądanie (np. anulowane zadanie w tle)"""
+    pass
+
+class Offer(NamedTuple):
+    """
+    Oferta w silniku - niezmienna i lekka (krotka zamiast słownika z 10 kluczami).
+    shop to kod sklepu (int) z OptimizationEngine.shop_ids; słownik powstaje
+    dopiero w items_list wyniku.
+    """
+    shop: int
+    product_id: int
+    price_pln: float
+    is_substitute: bool = False
+    substitute_reason: str = ''
+    from_basket: bool = False  # oferta produktu z koszyka w grupie zamienników
+
+class _BudgetExhausted(Exception):
+    """Minął budżet czasu (time_budget_ms) - wracamy z najlepszym dotąd rozwiązaniem"""
+    pass
+
+# Metryki optymalizacji - czas całości wg wyniku, czas strategii i kroków
+OPTIMIZATION_SECONDS = metrics.histogram(
+    'optimization_duration_seconds', 'Czas optymalizacji koszyka', ('outcome',),
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+)
+STRATEGY_SECONDS = metrics.histogram(
+    'optimization_strategy_duration_seconds', 'Czas strategii w jednej optymalizacji', ('strategy',),
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+STEP_SECONDS = metrics.histogram(
+    'optimization_step_duration_seconds', 'Czas kroku optymalizacji (normalize, search, ...)', ('step',),
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+COMBINATIONS_EVALUATED = metrics.counter('optimization_combinations_evaluated_total', 'Ocenione kombinacje')
+
+def record_optimization_metrics(result):
+    """
+    Zapisz metryki optymalizacji ze stats wyniku. Silnik robi to sam w swoim procesie;
+    wołający z puli procesów przekazuje tu wyniki workerów - metrics_pid w stats
+    pilnuje, żeby ta sama optymalizacja nie liczyła się dwa razy w jednym procesie.
+    """
+    if not isinstance(result, dict) or result.get('from_cache'):
+        return
+    stats = result.get('optimization_stats')
+    if not isinstance(stats, dict) or 'outcome' not in stats or stats.get('metrics_pid') == os.getpid():
+        return
+    stats['metrics_pid'] = os.getpid()
+    
+    OPTIMIZATION_SECONDS.labels(stats['outcome']).observe(stats.get('duration_ms', 0) / 1000.0)
+    for strategy, ms in stats.get('strategy_ms', {}).items():
+        STRATEGY_SECONDS.labels(strategy).observe(ms / 1000.0)
+    for step, ms in stats.get('trace', {}).get('timers_ms', {}).items():
+        STEP_SECONDS.labels(step).observe(ms / 1000.0)
+    COMBINATIONS_EVALUATED.inc(stats.get('combinations_evaluated', 0))
+
+def normalize_prices(prices_data):
+    """Normalizuje ceny do PLN - słownik cen jak get_latest_prices()"""
+    fx_rates = {'PLN': 1.0, 'EUR': 4.30, 'USD': 4.00}
+    normalized_prices = {}
+    
+    for key, price_info in prices_data.items():
+        if price_info.get('price'):
+            currency = price_info.get('currency', 'PLN')
+            rate = fx_rates.get(currency, 1.0)
+            
+            try:
+                price_value = price_info['price']
+                
+                if isinstance(price_value, str):
+                    price_clean = price_value.strip().replace(',', '.')
+                    import re
+                    numbers = re.findall(r'\d+\.?\d*', price_clean)
+                    if numbers:
+                        price_value = float(numbers[-1])
+                    else:
+                        continue
+                elif not isinstance(price_value, (int, float)):
+                    continue
+                else:
+                    price_value = float(price_value)
+                
+                if price_value <= 0:
+                    continue
+                
+                normalized_prices[key] = {
+                    'product_id': price_info['product_id'],
+                    'shop_id': price_info['shop_id'],
+                    'price_pln': price_value * rate,
+                    'price_original': price_value,
+                    'currency': currency
+                }
+                
+            except (ValueError, TypeError):
+                continue
+    
+    return normalized_prices
 
 class OptimizationEngine:
     """Główny silnik optymalizacji koszyków - POPRAWIONA WERSJA"""
     
     def __init__(self, settings, log_func):
         self.settings = settings
-        self.log = log_func
+        # Log z poziomami (optimization_trace) - zwykła funkcja log też działa
+        self.log = OptimizationTrace.wrap(log_func)
         
         # WSZYSTKIE USTAWIENIA Z BASKET_SETTINGS
         self.priority = settings.get('priority', 'lowest_total_cost')
@@ -36,62 +139,299 @@ class OptimizationEngine:
         
         # KONFIGURACJA ALGORYTMU
         self.MAX_COMBINATIONS = settings.get('max_combinations', 200000)
+        self.MAX_SHOP_SUBSETS = settings.get('max_shop_subsets', 50000)
+        self.max_offers_per_need = int(settings.get('max_offers_per_need') or 0)
+        self.MAX_DP_STATES = 20000  # powyżej - przycinanie DP dostawy (wynik już nie gwarantowanie dokładny)
+        self.min_shops_required = None  # dokładne minimalne pokrycie - liczone raz, używane do przycinania
+        
+        # Kody sklepów dla ofert (Offer.shop) i indeks cen po produkcie
+        self.shop_ids = []
+        self.shop_codes = {}
+        self.product_names = {}
+        self._prices_by_product = None
+        self.shared_data = None  # optimization_batch.SharedOptimizationData - dane wspólne dla wielu koszyków
+        self.random_seed = settings.get('random_seed', 42)
+        self.rng = random.Random(self.random_seed)  # własny RNG - bez globalnego random.seed
+        self.parallel_workers = int(settings.get('parallel_workers') or 0)
+        self._parallel_search_tried = False
         
         # NOWE: Statystyki wydajności
         self.stats = {
             'combinations_evaluated': 0,
             'combinations_filtered_by_shops': 0,
             'combinations_within_limit': 0,
+            'combinations_scored': 0,  # pełne wyliczenia wyniku (koszt + dostawa) - wspólna miara pracy strategii
             'optimization_strategies_used': []
         }
         
+        # Hooki dla zadań w tle - postęp i anulowanie
+        self.progress_callback = None
+        self.cancel_check = None
+        self.progress_interval = 0.25  # sekundy między raportami postępu
+        self._last_progress_report = 0.0
+        self._current_strategy = None
+        self._strategy_started = None
+        self.strategy_seconds = {}  # strategia -> czas (do stats['strategy_ms'] i metryk)
+        self._best_score_so_far = None
+        
+        # Tryb "anytime" - budżet czasu i wspólne najlepsze rozwiązanie wszystkich strategii
+        self.time_budget_ms = int(settings.get('time_budget_ms') or 0)
+        self.deadline = None
+        self.incumbent = None
+        self.incumbent_score = float('inf')
+        self.cost_lower_bound = None
+        self.pruning_lossless = True  # przycinanie ofert nie usunęło niczego, co mogłoby dać lepszy wynik
+        
         self.log(f"🎯 SILNIK OPTYMALIZACJI - POPRAWIONA WERSJA:")
         self.log(f"   Priority: {self.priority}")
         self.log(f"   Max shops: {self.max_shops} ⚠️ BĘDZIE EGZEKWOWANY!")
         self.log(f"   Max combinations: {self.MAX_COMBINATIONS}")
+        self.log(f"   Parallel workers: {self.parallel_workers or 'wyłączone'}")
+        self.log(f"   Time budget: {str(self.time_budget_ms) + ' ms' if self.time_budget_ms else 'brak'}")
         self.log(f"   Allow substitutes: {self.allow_substitutes}")
         self.log(f"   Max price increase: {self.max_price_increase_percent}%")
         self.log(f"   Prefer original: {self.prefer_original}")
         self.log(f"   Suggest quantities: {self.suggest_quantities}")
         self.log(f"   Consider free shipping: {self.consider_free_shipping}")
     
+    def set_job_hooks(self, progress_callback=None, cancel_check=None):
+        """
+        Ustaw hooki zadania w tle
+        
+        Args:
+            progress_callback: funkcja(dict) z postępem (strategia, najlepszy wynik, liczniki)
+            cancel_check: funkcja() -> bool, True = przerwij optymalizację
+        """
+        self.progress_callback = progress_callback
+        self.cancel_check = cancel_check
+    
+    def set_shared_data(self, shared_data):
+        """
+        Użyj danych przygotowanych raz dla wielu koszyków (optimization_batch):
+        znormalizowane ceny z indeksem po produkcie, nazwy produktów i zamienniki
+        zamiast liczenia ich od nowa (i czytania plików zamienników) w każdym koszyku
+        """
+        self.shared_data = shared_data
+    
+    def _checkpoint(self, strategy=None, score=None, force=False):
+        """
+        Punkt kontrolny w pętlach - budżet czasu, postęp i anulowanie.
+        Tani gdy nie ma hooków ani budżetu; raporty co progress_interval sekund.
+        """
+        if strategy and strategy != self._current_strategy:
+            self._switch_strategy(strategy)
+        if score is not None and (self._best_score_so_far is None or score < self._best_score_so_far):
+            self._best_score_so_far = score
+        
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            raise _BudgetExhausted()
+        
+        if not self.progress_callback and not self.cancel_check:
+            return
+        
+        now = time.monotonic()
+        if not force and not strategy and now - self._last_progress_report < self.progress_interval:
+            return
+        self._last_progress_report = now
+        
+        if self.cancel_check and self.cancel_check():
+            raise OptimizationCancelled("Optymalizacja anulowana")
+        
+        if self.progress_callback:
+            try:
+                self.progress_callback({
+                    'strategy': self._current_strategy,
+                    'best_score': self._best_score_so_far,
+                    'combinations_evaluated': self.stats['combinations_evaluated'],
+                    'combinations_within_limit': self.stats['combinations_within_limit'],
+                    'time_budget_ms': self.time_budget_ms or None,
+                })
+            except Exception:
+                pass  # postęp nie może zepsuć optymalizacji
+    
+    def _switch_strategy(self, strategy):
+        """Zmień bieżącą strategię - czas poprzedniej dolicz do strategy_seconds"""
+        now = time.perf_counter()
+        if self._current_strategy is not None and self._strategy_started is not None:
+            self.strategy_seconds[self._current_strategy] = (
+                self.strategy_seconds.get(self._current_strategy, 0.0) + now - self._strategy_started
+            )
+        self._current_strategy = strategy
+        self._strategy_started = now
+    
+    def _update_incumbent(self, result, score=None):
+        """Zgłoś rozwiązanie (w limicie sklepów) - zapamiętujemy najlepsze ze wszystkich strategii"""
+        if result is None or result.get('error_type'):
+            return
+        if score is None:
+            score = self._calculate_priority_score(result)
+        if score < self.incumbent_score:
+            self.incumbent = result
+            self.incumbent_score = score
+        self._checkpoint(score=score)
+    
+    def _time_left(self):
+        """Czy zostało trochę budżetu czasu (zawsze True bez budżetu)"""
+        return self.deadline is None or time.monotonic() < self.deadline
+    
+    def _cost_lower_bound(self, expanded_offers, need_keys, grouped_needs):
+        """
+        Dolne ograniczenie kosztu: najtańsza oferta dla każdej potrzeby, bez dostawy.
+        Żadne rozwiązanie nie może być tańsze - z tego liczymy lukę jakości.
+        """
+        bound = 0.0
+        for need_key in need_keys:
+            quantity = self._need_quantity(grouped_needs, need_key)
+            bound += min(offer.price_pln for offer in expanded_offers[need_key]) * quantity
+        return bound
+    
+    def _shop_code(self, shop_id):
+        """Kod sklepu (int) - każdy shop_id dostaje swój numer przy pierwszej ofercie"""
+        code = self.shop_codes.get(shop_id)
+        if code is None:
+            code = self.shop_codes[shop_id] = len(self.shop_ids)
+            self.shop_ids.append(shop_id)
+        return code
+    
+    def _shop_config(self, shop_configs, shop):
+        """Konfiguracja dostawy sklepu po kodzie"""
+        return shop_configs.get(self.shop_ids[shop], {})
+    
+    def _shop_names(self, shops):
+        return sorted(str(self.shop_ids[shop]) for shop in shops)
+    
+    def _product_prices(self, normalized_prices, product_id):
+        """Ceny produktu - indeks budowany raz zamiast przeglądania wszystkich cen dla każdej potrzeby"""
+        if self._prices_by_product is None:
+            self._prices_by_product = {}
+            for price_data in normalized_prices.values():
+                self._prices_by_product.setdefault(price_data['product_id'], []).append(price_data)
+        return self._prices_by_product.get(product_id, [])
+    
+    def _need_quantity(self, grouped_needs, need_key):
+        """Ilość potrzeby (dla grup zamienników - łączna) - jak w _calculate_combination_result"""
+        need = grouped_needs[int(need_key.split('_')[1])]
+        return need['total_quantity'] if need['type'] == 'substitute_group' else need['quantity']
+    
+    def _record_anytime_stats(self, best_combination, started_at, budget_exhausted):
+        """Dopisz do statystyk czas, wyczerpanie budżetu i szacunek luki do optimum"""
+        self.stats['elapsed_ms'] = int((time.monotonic() - started_at) * 1000)
+        self.stats['time_budget_ms'] = self.time_budget_ms or None
+        self.stats['budget_exhausted'] = budget_exhausted
+        
+        if self.cost_lower_bound is None or not best_combination or best_combination.get('error_type'):
+            return
+        
+        total_cost = best_combination['total_cost']
+        gap = (total_cost - self.cost_lower_bound) / total_cost * 100 if total_cost > 0 else 0.0
+        self.stats['cost_lower_bound'] = round(self.cost_lower_bound, 2)
+        self.stats['optimality_gap_percent'] = round(max(0.0, gap), 2)
+        self.log(f"📐 Dolne ograniczenie kosztu: {self.cost_lower_bound:.2f} PLN, luka do optimum ≤ {gap:.1f}%")
+    
     def optimize_basket(self, basket, products_data, prices_data, shop_configs):
         """GŁÓWNA FUNKCJA OPTYMALIZACJI - POPRAWIONA"""
-        
+        started = time.perf_counter()
+        result = None
+        outcome = 'error'
+        try:
+            result = self._optimize_basket(basket, products_data, prices_data, shop_configs)
+            if not result.get('success'):
+                outcome = 'no_solution'
+            else:
+                outcome = 'budget_exhausted' if self.stats.get('budget_exhausted') else 'success'
+            return result
+        except OptimizationCancelled:
+            outcome = 'cancelled'
+            raise
+        finally:
+            self._switch_strategy(None)
+            self.stats['strategy_ms'] = {
+                strategy: round(seconds * 1000, 2) for strategy, seconds in self.strategy_seconds.items()
+            }
+            self.stats['outcome'] = outcome
+            self.stats['duration_ms'] = round((time.perf_counter() - started) * 1000, 2)
+            if isinstance(result, dict):
+                result.setdefault('optimization_stats', self.stats)
+            record_optimization_metrics({'optimization_stats': self.stats})
+    
+    def _optimize_basket(self, basket, products_data, prices_data, shop_configs):
         self.log("🚀 ROZPOCZĘCIE OPTYMALIZACJI - POPRAWIONY SILNIK")
         
+        started_at = time.monotonic()
+        if self.time_budget_ms:
+            self.deadline = started_at + self.time_budget_ms / 1000.0
+        
         # KROK 1: Normalizuj ceny
+        self._checkpoint(strategy='preprocessing')
         self.log("💰 KROK 1: NORMALIZACJA CEN")
-        normalized_prices = self._normalize_prices(prices_data)
+        if self.shared_data is not None:
+            self.product_names = self.shared_data.product_names
+            normalized_prices = self.shared_data.normalized_prices
+            self._prices_by_product = self.shared_data.prices_by_product
+            self.log(f"♻️ Ceny znormalizowane wcześniej (dane wspólne): {len(normalized_prices)}")
+        else:
+            self.product_names = {
+                product['id']: product.get('name') for product in (products_data or []) if isinstance(product, dict)
+            }
+            with self.log.timer('normalize'):
+                normalized_prices = self._normalize_prices(prices_data)
+        self.log.count('prices', len(normalized_prices))
         
         # KROK 2: Grupuj produkty zamienne (ŁĄCZ ILOŚCI!)
         self.log("🔗 KROK 2: GRUPOWANIE ZAMIENNIKÓW Z ŁĄCZENIEM ILOŚCI")
-        grouped_needs = self._group_substitute_products_with_combining(basket)
+        with self.log.timer('grouping'):
+            grouped_needs = self._group_substitute_products_with_combining(basket)
         
         if not grouped_needs:
-            self.log("❌ BŁĄD: Brak potrzeb po grupowaniu")
+            self.log.error("❌ BŁĄD: Brak potrzeb po grupowaniu")
             return {'success': False, 'error': 'Brak potrzeb po grupowaniu'}
+        self.log.count('needs', len(grouped_needs))
         
         # KROK 3: Rozszerz oferty o zamienniki
         self.log("🔄 KROK 3: ROZSZERZANIE OFERT O ZAMIENNIKI")
-        expanded_offers, products_without_offers = self._expand_offers_with_substitutes(
-            grouped_needs, normalized_prices
-        )
+        with self.log.timer('expand_offers'):
+            expanded_offers, products_without_offers = self._expand_offers_with_substitutes(
+                grouped_needs, normalized_prices
+            )
+        
+        # KROK 3b: Przytnij zdominowane oferty - mniejsza przestrzeń dla każdej strategii
+        self.log("✂️ KROK 3b: PRZYCINANIE ZDOMINOWANYCH OFERT")
+        need_keys_with_offers = [need_key for need_key, offers in expanded_offers.items() if offers]
+        with self.log.timer('preprocessing'):
+            expanded_offers = self._advanced_preprocessing(expanded_offers, need_keys_with_offers, shop_configs,
+                                                           grouped_needs)
         
         # KROK 4: ULEPSZONE ALGORYTMY Z EGZEKWOWANIEM LIMITU SKLEPÓW
         self.log("🧮 KROK 4: ALGORYTMY Z LIMITEM SKLEPÓW")
-        best_combination = self._optimization_with_shop_limit_enforcement(
-            expanded_offers, grouped_needs, shop_configs
-        )
+        budget_exhausted = False
+        try:
+            with self.log.timer('search'):
+                best_combination = self._optimization_with_shop_limit_enforcement(
+                    expanded_offers, grouped_needs, shop_configs
+                )
+        except _BudgetExhausted:
+            budget_exhausted = True
+            self.log(f"⏱️ Budżet czasu {self.time_budget_ms} ms wyczerpany - zwracam najlepsze znalezione rozwiązanie")
+            best_combination = self.incumbent
         
         if not best_combination:
-            self.log("❌ BŁĄD: Nie znaleziono kombinacji w limicie sklepów")
+            self.log.error("❌ BŁĄD: Nie znaleziono kombinacji w limicie sklepów")
             return self._create_no_offers_result(basket['basket_id'], grouped_needs, products_without_offers)
         
+        # KROK 4b: Heurystyki nie gwarantują najlepszego przydziału w swoich sklepach
+        if not best_combination.get('error_type') and not self.stats.get('exact_solution') and self._time_left():
+            need_keys = [need_key for need_key, offers in expanded_offers.items() if offers]
+            with self.log.timer('reassignment'):
+                best_combination = self._reassign_within_shops(
+                    best_combination, expanded_offers, need_keys, grouped_needs, shop_configs
+                )
+        
         # KROK 5: Optymalizuj ilości (jeśli włączone)
-        if self.suggest_quantities and self.consider_free_shipping:
+        if self.suggest_quantities and self.consider_free_shipping and self._time_left():
             self.log("📊 KROK 5: OPTYMALIZACJA ILOŚCI DLA DARMOWEJ DOSTAWY")
-            best_combination = self._optimize_quantities(best_combination, shop_configs)
+            self._switch_strategy('quantities')
+            with self.log.timer('quantities'):
+                best_combination = self._optimize_quantities(best_combination, shop_configs)
         
         # KROK 6: Dodaj produkty bez ofert
         if products_without_offers:
@@ -99,7 +439,9 @@ class OptimizationEngine:
             best_combination['products_to_complete'] = self._create_completion_section(products_without_offers)
         
         # KROK 7: Loguj statystyki
+        self._record_anytime_stats(best_combination, started_at, budget_exhausted)
         self._log_optimization_stats()
+        self.stats['trace'] = self.log.summary()
         
         self.log("✅ OPTYMALIZACJA ZAKOŃCZONA SUKCESEM!")
         return {
@@ -127,11 +469,26 @@ class OptimizationEngine:
         
         self.log(f"🔒 EGZEKWOWANIE LIMITU SKLEPÓW: maksymalnie {self.max_shops} sklepów")
         
+        self.cost_lower_bound = self._cost_lower_bound(expanded_offers, need_keys, grouped_needs)
+        
+        if self.deadline is not None:
+            # Z budżetem czasu od razu miej jakieś rozwiązanie - szybki zachłanny start
+            initial_solution = self._find_initial_solution_within_limit(expanded_offers, need_keys)
+            if initial_solution:
+                self._update_incumbent(
+                    self._calculate_combination_result(initial_solution, need_keys, grouped_needs, shop_configs)
+                )
+        
+        # Dokładne minimum sklepów - od razu wiadomo czy limit jest osiągalny
+        min_shops_required = self._calculate_minimum_shops_required(expanded_offers, need_keys)
+        
         # STRATEGIA 1: Próbuj znaleźć rozwiązania w limicie sklepów
-        self.log("🎯 STRATEGIA 1: Szukanie w limicie sklepów")
-        best_combination = self._find_solutions_within_shop_limit(
-            expanded_offers, need_keys, grouped_needs, shop_configs
-        )
+        best_combination = None
+        if min_shops_required <= self.max_shops:
+            self.log("🎯 STRATEGIA 1: Szukanie w limicie sklepów")
+            best_combination = self._find_solutions_within_shop_limit(
+                expanded_offers, need_keys, grouped_needs, shop_configs
+            )
         
         if best_combination:
             self.log(f"✅ ZNALEZIONO ROZWIĄZANIE w {best_combination['shops_count']} sklepach")
@@ -139,7 +496,6 @@ class OptimizationEngine:
         
         # STRATEGIA 2: Jeśli nie ma rozwiązań w limicie, sprawdź czy to możliwe
         self.log("⚠️ STRATEGIA 2: Analiza dostępności w limicie sklepów")
-        min_shops_required = self._calculate_minimum_shops_required(expanded_offers, need_keys)
         
         self.log(f"📊 Minimalna liczba sklepów potrzebna: {min_shops_required}")
         self.log(f"📊 Limit ustawiony przez użytkownika: {self.max_shops}")
@@ -184,11 +540,280 @@ class OptimizationEngine:
                 expanded_offers, need_keys, grouped_needs, shop_configs
             )
         else:
+            shops_count = len({offer.shop for key in need_keys for offer in expanded_offers[key]})
+            subsets_count = self._count_shop_subsets(shops_count)
+            if subsets_count <= self.MAX_SHOP_SUBSETS:
+                self.log(f"🏪 PODZBIORY SKLEPÓW: {subsets_count:,} zamiast {total_combinations:,}+ kombinacji produktów")
+                subset_result = self._shop_subset_search(expanded_offers, need_keys, grouped_needs, shop_configs)
+                if subset_result:
+                    return subset_result
+            
             self.log(f"🎯 PRÓBKOWANIE: z {total_combinations:,} możliwych kombinacji")
+            if self.parallel_workers > 1:
+                parallel_result = self._parallel_search_with_shop_limit(
+                    expanded_offers, need_keys, grouped_needs, shop_configs
+                )
+                if parallel_result:
+                    return parallel_result
             return self._smart_sampling_with_shop_filter(
                 expanded_offers, need_keys, grouped_needs, shop_configs
             )
     
+    def _count_shop_subsets(self, shops_count):
+        """Liczba podzbiorów sklepów od minimalnego pokrycia do max_shops"""
+        min_size = max(1, self.min_shops_required or 1)
+        return sum(math.comb(shops_count, size) for size in range(min_size, min(self.max_shops, shops_count) + 1))
+    
+    def _shop_subset_search(self, expanded_offers, need_keys, grouped_needs, shop_configs):
+        """
+        Przegląd podzbiorów sklepów (do max_shops) z dokładnym przydziałem w każdym.
+        
+        Dla ustalonych sklepów koszyk rozkłada się na potrzeby: liczy się najtańsza
+        oferta potrzeby w każdym sklepie i droższe oferty z tego sklepu, które mogą
+        przekroczyć próg darmowej dostawy - rozstrzyga je DP (_solve_assignment_for_shops).
+        Podzbiory bez pokrycia wszystkich potrzeb i te, których dolne ograniczenie
+        nie bije najlepszego, są pomijane. Sklepy sortowane po popularności - dobre rozwiązania wcześnie.
+        """
+        self.log(f"🏪 PODZBIORY SKLEPÓW z dokładnym przydziałem (limit {self.max_shops})")
+        self.stats['optimization_strategies_used'].append('shop_subsets')
+        self._checkpoint(strategy='shop_subsets')
+        
+        need_shop_offers = self._cheapest_offers_per_shop(expanded_offers, need_keys, grouped_needs)
+        threshold_offers = self._threshold_offers_per_shop(expanded_offers, need_keys, grouped_needs,
+                                                           shop_configs, need_shop_offers)
+        
+        shop_popularity = self._calculate_shop_popularity(expanded_offers, need_keys)
+        shops = sorted(shop_popularity, key=lambda shop: shop_popularity[shop], reverse=True)
+        coverage = {shop: 0 for shop in shops}
+        for need_idx, cheapest in enumerate(need_shop_offers):
+            for shop in cheapest:
+                coverage[shop] |= 1 << need_idx
+        full_mask = (1 << len(need_keys)) - 1
+        
+        # Mniejsze podzbiory niż dokładne minimalne pokrycie i tak nie pokryją koszyka
+        min_shops = self._calculate_minimum_shops_required(expanded_offers, need_keys)
+        
+        best_result, best_score = None, float('inf')
+        subset_stats = {'evaluated': 0, 'pruned_coverage': 0, 'pruned_bound': 0, 'dp_solved': 0}
+        # Po stratnym przycinaniu (limit rang) optimum mogło wypaść z ofert - wynik nie jest dokładny
+        exact = self.pruning_lossless
+        
+        def try_subset(subset):
+            nonlocal best_result, best_score, exact
+            items_bound = sum(min(cheapest[shop][0] for shop in subset if shop in cheapest)
+                              for cheapest in need_shop_offers)
+            if self._calculate_priority_score({'shops_count': min_shops, 'total_cost': items_bound}) >= best_score:
+                subset_stats['pruned_bound'] += 1
+                return
+            
+            combination, subset_exact = self._solve_assignment_for_shops(
+                subset, need_shop_offers, shop_configs, subset_stats, threshold_offers)
+            exact = exact and subset_exact
+            result = self._calculate_combination_result(combination, need_keys, grouped_needs, shop_configs)
+            subset_stats['evaluated'] += 1
+            score = self._calculate_priority_score(result)
+            if score < best_score:
+                best_result, best_score = result, score
+                self._update_incumbent(result, score)
+        
+        # Pokrycie zachłanne jako pierwszy kandydat - od razu dobre ograniczenie do przycinania
+        greedy_shops = self._greedy_set_cover([set(cheapest) for cheapest in need_shop_offers])
+        if len(greedy_shops) <= self.max_shops and self._covers(greedy_shops, coverage, full_mask):
+            try_subset(tuple(shop for shop in shops if shop in greedy_shops))
+        
+        for size in range(min_shops, min(self.max_shops, len(shops)) + 1):
+            for subset in combinations(shops, size):
+                self._checkpoint()
+                if not self._covers(subset, coverage, full_mask):
+                    subset_stats['pruned_coverage'] += 1
+                    continue
+                try_subset(subset)
+        
+        self.stats['shop_subsets'] = subset_stats
+        self.stats['exact_solution'] = exact and best_result is not None
+        self.log(f"📊 Podzbiory: ocenione {subset_stats['evaluated']:,}, bez pokrycia {subset_stats['pruned_coverage']:,}, "
+                 f"odcięte ograniczeniem {subset_stats['pruned_bound']:,}, DP dostawy {subset_stats['dp_solved']:,}")
+        
+        if best_result is None:
+            self.log("❌ Żaden podzbiór sklepów w limicie nie pokrywa koszyka")
+            return None
+        
+        if exact:
+            self.log(f"✅ Rozwiązanie DOKŁADNE: {best_score:.2f} w {best_result['shops_count']} sklepach")
+            if self.priority == 'lowest_total_cost':
+                self.cost_lower_bound = best_result['total_cost']
+        return best_result
+    
+    def _cheapest_offers_per_shop(self, expanded_offers, need_keys, grouped_needs):
+        """Najtańsza oferta każdej potrzeby w każdym sklepie: [{shop: (koszt pozycji, oferta)}]"""
+        need_shop_offers = []
+        for need_key in need_keys:
+            quantity = self._need_quantity(grouped_needs, need_key)
+            cheapest = {}
+            for offer in expanded_offers[need_key]:
+                cost = offer.price_pln * quantity
+                current = cheapest.get(offer.shop)
+                if current is None or cost < current[0]:
+                    cheapest[offer.shop] = (cost, offer)
+            need_shop_offers.append(cheapest)
+        return need_shop_offers
+    
+    def _threshold_offers_per_shop(self, expanded_offers, need_keys, grouped_needs, shop_configs, need_shop_offers):
+        """
+        Droższe oferty potrzeby w tym samym sklepie, które mogą się opłacić: sklep ma próg
+        darmowej dostawy, a dopłata do najtańszej oferty jest mniejsza niż koszt dostawy
+        (więcej niż dostawę przekroczenie progu nie zwróci). [{shop: [(koszt pozycji, oferta)]}]
+        """
+        threshold_offers = []
+        for need_key, cheapest in zip(need_keys, need_shop_offers):
+            quantity = self._need_quantity(grouped_needs, need_key)
+            pricier = {}
+            for offer in expanded_offers[need_key]:
+                config = self._shop_config(shop_configs, offer.shop)
+                if not config.get('delivery_free_from') or not config.get('delivery_cost'):
+                    continue
+                cost = offer.price_pln * quantity
+                if cheapest[offer.shop][0] < cost < cheapest[offer.shop][0] + float(config['delivery_cost']):
+                    pricier.setdefault(offer.shop, []).append((cost, offer))
+            threshold_offers.append(pricier)
+        return threshold_offers
+    
+    def _reassign_within_shops(self, result, expanded_offers, need_keys, grouped_needs, shop_configs):
+        """
+        Dokładny przydział potrzeb do sklepów wybranych przez heurystykę (próbkowanie,
+        GA, local search). DP dostawy z _solve_assignment_for_shops przenosi produkty
+        między tymi sklepami tak, żeby przekroczyć progi darmowej dostawy.
+        """
+        shops = tuple(self.shop_codes[shop_id] for shop_id in result['shops_summary'])
+        need_shop_offers = self._cheapest_offers_per_shop(expanded_offers, need_keys, grouped_needs)
+        if not all(any(shop in cheapest for shop in shops) for cheapest in need_shop_offers):
+            return result
+        
+        threshold_offers = self._threshold_offers_per_shop(expanded_offers, need_keys, grouped_needs,
+                                                           shop_configs, need_shop_offers)
+        combination, _ = self._solve_assignment_for_shops(shops, need_shop_offers, shop_configs, {'dp_solved': 0},
+                                                          threshold_offers)
+        candidate = self._calculate_combination_result(combination, need_keys, grouped_needs, shop_configs)
+        
+        savings = self._calculate_priority_score(result) - self._calculate_priority_score(candidate)
+        if savings <= 0.005:
+            return result
+        self.log(f"🔀 Przydział w wybranych sklepach poprawiony o {savings:.2f} (progi darmowej dostawy)")
+        self.stats['reassignment_savings'] = round(savings, 2)
+        return candidate
+    
+    def _covers(self, subset, coverage, full_mask):
+        mask = 0
+        for shop in subset:
+            mask |= coverage[shop]
+        return mask == full_mask
+    
+    def _solve_assignment_for_shops(self, subset, need_shop_offers, shop_configs, subset_stats,
+                                    threshold_offers=None):
+        """
+        Najtańszy przydział potrzeb do ofert ze sklepów z podzbioru, z kosztami dostawy.
+        
+        Bez kosztów dostawy wystarczy najtańsza oferta każdej potrzeby. W przeciwnym
+        razie DP po potrzebach: stan = suma w każdym sklepie w groszach, obcięta do
+        progu darmowej dostawy (dla sklepów bez progu tylko "używany/nieużywany").
+        Kandydaci w sklepie to najtańsza oferta i oferty z threshold_offers (droższe,
+        ale mogące przekroczyć próg). Stany zdominowane (droższe i nie lepsze
+        w żadnym sklepie) są usuwane.
+        
+        Returns:
+            tuple: (oferta dla każdej potrzeby, czy wynik dokładny)
+        """
+        delivery, caps = [], []
+        for shop in subset:
+            config = self._shop_config(shop_configs, shop)
+            free_from = float(config.get('delivery_free_from')) if config.get('delivery_free_from') else None
+            delivery.append(float(config.get('delivery_cost', 0)) if config.get('delivery_cost') else 0.0)
+            caps.append(int(round(free_from * 100)) if free_from else 1)
+        has_threshold = [caps[j] > 1 for j in range(len(subset))]
+        
+        options = []
+        for need_idx, cheapest in enumerate(need_shop_offers):
+            pricier = threshold_offers[need_idx] if threshold_offers else {}
+            need_options = []
+            for j, shop in enumerate(subset):
+                if shop in cheapest:
+                    need_options.append((j, cheapest[shop][0], cheapest[shop][1]))
+                    need_options.extend((j, cost, offer) for cost, offer in pricier.get(shop, ()))
+            options.append(need_options)
+        
+        def shipping(key):
+            return sum(delivery[j] for j, value in enumerate(key)
+                       if value and not (has_threshold[j] and value >= caps[j]))
+        
+        def add(key, j, cost):
+            values = list(key)
+            values[j] = min(caps[j], values[j] + max(1, int(round(cost * 100))))
+            return tuple(values)
+        
+        # Szybka ścieżka - najtańsze oferty i tak nie płacą za dostawę
+        cheapest_choice = [min(need_options, key=lambda option: option[1]) for need_options in options]
+        key = (0,) * len(subset)
+        for j, cost, _ in cheapest_choice:
+            key = add(key, j, cost)
+        if shipping(key) == 0:
+            return [offer for _, _, offer in cheapest_choice], True
+        
+        subset_stats['dp_solved'] += 1
+        exact = True
+        layers = []
+        states = {(0,) * len(subset): (0.0, None, None)}
+        for need_options in options:
+            next_states = {}
+            for key, (cost, _, _) in states.items():
+                for j, option_cost, offer in need_options:
+                    next_key = add(key, j, option_cost)
+                    next_cost = cost + option_cost
+                    current = next_states.get(next_key)
+                    if current is None or next_cost < current[0]:
+                        next_states[next_key] = (next_cost, key, (j, offer))
+            
+            if len(next_states) > 512:
+                next_states = self._prune_dominated_states(next_states, caps, has_threshold, delivery)
+            if len(next_states) > self.MAX_DP_STATES:
+                kept = sorted(next_states.items(), key=lambda item: item[1][0] + shipping(item[0]))[:self.MAX_DP_STATES]
+                next_states = dict(kept)
+                exact = False
+            
+            layers.append(next_states)
+            states = next_states
+        
+        key = min(states, key=lambda state_key: states[state_key][0] + shipping(state_key))
+        assignment = []
+        for layer in reversed(layers):
+            _, previous_key, (_, offer) = layer[key]
+            assignment.append(offer)
+            key = previous_key
+        assignment.reverse()
+        return assignment, exact
+    
+    def _prune_dominated_states(self, states, caps, has_threshold, delivery):
+        """
+        Usuń stany DP zdominowane: A dominuje B gdy A jest nie droższy, a w każdym
+        sklepie dowolne przyszłe dokupienie da w A dostawę nie droższą niż w B.
+        """
+        def shop_dominates(a, b, j):
+            if a == b or not delivery[j]:
+                return True
+            if has_threshold[j]:
+                return a >= caps[j] or (b > 0 and a >= b)
+            return a == 0
+        
+        kept = []
+        for key, value in sorted(states.items(), key=lambda item: item[1][0]):
+            dominated = False
+            for kept_key, _ in kept:
+                if all(shop_dominates(kept_key[j], key[j], j) for j in range(len(key))):
+                    dominated = True
+                    break
+            if not dominated:
+                kept.append((key, value))
+        return dict(kept)
+    
     def _exhaustive_search_with_shop_filter(self, expanded_offers, need_keys, grouped_needs, shop_configs):
         """Pełne przeszukiwanie z filtrowaniem po sklepach"""
         
@@ -200,10 +825,13 @@ class OptimizationEngine:
         valid_combinations = []
         shops_distribution = {}
         
+        self._checkpoint(strategy='exhaustive')
         for combo in all_combinations:
             self.stats['combinations_evaluated'] += 1
+            if not self.stats['combinations_evaluated'] & 1023:
+                self._checkpoint()
             
-            unique_shops = set(offer['shop_id'] for offer in combo)
+            unique_shops = set(offer.shop for offer in combo)
             shop_count = len(unique_shops)
             shops_distribution[shop_count] = shops_distribution.get(shop_count, 0) + 1
             
@@ -219,7 +847,7 @@ class OptimizationEngine:
         for shops_count in sorted(shops_distribution.keys()):
             count = shops_distribution[shops_count]
             status = "✅" if shops_count <= self.max_shops else "🚫"
-            self.log(f"   {status} {shops_count} sklepów: {count:,} kombinacji")
+            self.log.debug("   %s %d sklepów: %s kombinacji", status, shops_count, f"{count:,}")
         
         self.log(f"✅ KOMBINACJE W LIMICIE: {len(valid_combinations):,}")
         self.log(f"🚫 ODRZUCONE: {self.stats['combinations_filtered_by_shops']:,}")
@@ -235,6 +863,7 @@ class OptimizationEngine:
         
         self.log(f"🎲 PRÓBKOWANIE z limitem {self.max_shops} sklepów")
         self.stats['optimization_strategies_used'].append('smart_sampling')
+        self._checkpoint(strategy='smart_sampling')
         
         # STRATEGIA A: Próbkowanie najbliższe optymalnemu
         valid_combinations = []
@@ -242,25 +871,34 @@ class OptimizationEngine:
         
         # 1. Najlepsze oferty z każdej potrzeby
         best_offers_combo = [offers[0] for offers in offer_lists if offers]
-        if best_offers_combo and len(set(offer['shop_id'] for offer in best_offers_combo)) <= self.max_shops:
+        seen_sampled = set()  # klucze (id ofert) kombinacji losowanych - zamiast O(n) "combo in list"
+        if best_offers_combo and len(set(offer.shop for offer in best_offers_combo)) <= self.max_shops:
             valid_combinations.append(best_offers_combo)
+            seen_sampled.add(tuple(map(id, best_offers_combo)))
             self.log("✅ Dodano kombinację z najlepszych ofert")
         
         # 2. Kombinacje skupione wokół popularnych sklepów
         shop_popularity = self._calculate_shop_popularity(expanded_offers, need_keys)
         popular_shops = sorted(shop_popularity.keys(), key=lambda x: shop_popularity[x], reverse=True)
         
+        # Z budżetem czasu oceniamy od razu - najlepsze dotąd rozwiązanie rośnie w trakcie
+        anytime = self.deadline is not None
+        evaluated_upto = 0
+        
         for shop_combination in combinations(popular_shops, min(self.max_shops, len(popular_shops))):
             limited_combinations = self._generate_combinations_for_shops(
                 expanded_offers, need_keys, shop_combination
             )
             valid_combinations.extend(limited_combinations[:100])  # Ogranicz ilość
+            if anytime:
+                self._evaluate_into_incumbent(valid_combinations[evaluated_upto:], need_keys, grouped_needs, shop_configs)
+                evaluated_upto = len(valid_combinations)
+            self._checkpoint()
             
             if len(valid_combinations) >= self.MAX_COMBINATIONS:
                 break
         
         # 3. Losowe próbkowanie z filtrowaniem
-        random.seed(42)
         attempts = 0
         max_attempts = self.MAX_COMBINATIONS * 5
         
@@ -269,13 +907,15 @@ class OptimizationEngine:
             for offers in offer_lists:
                 if offers:
                     # Ważone losowanie - większe prawdopodobieństwo dla tańszych
-                    weights = [1/max(0.01, offer['price_pln']) for offer in offers]
-                    combo.append(random.choices(offers, weights=weights)[0])
+                    weights = [1/max(0.01, offer.price_pln) for offer in offers]
+                    combo.append(self.rng.choices(offers, weights=weights)[0])
             
             if combo:
-                unique_shops = set(offer['shop_id'] for offer in combo)
+                unique_shops = set(offer.shop for offer in combo)
                 if len(unique_shops) <= self.max_shops:
-                    if combo not in valid_combinations:
+                    combo_key = tuple(map(id, combo))
+                    if combo_key not in seen_sampled:
+                        seen_sampled.add(combo_key)
                         valid_combinations.append(combo)
                         self.stats['combinations_within_limit'] += 1
                 else:
@@ -283,6 +923,8 @@ class OptimizationEngine:
             
             attempts += 1
             self.stats['combinations_evaluated'] += 1
+            if not attempts & 1023:
+                self._checkpoint()
         
         self.log(f"🎯 Wygenerowano {len(valid_combinations):,} kombinacji w limicie")
         self.log(f"📊 Próby: {attempts:,} z {max_attempts:,}")
@@ -291,69 +933,148 @@ class OptimizationEngine:
             self.log("❌ BRAK KOMBINACJI W LIMICIE PO PRÓBKOWANIU")
             return None
         
+        if anytime:
+            self._evaluate_combinations(valid_combinations[evaluated_upto:], need_keys, grouped_needs, shop_configs)
+            return self.incumbent
+        
         return self._evaluate_combinations(valid_combinations, need_keys, grouped_needs, shop_configs)
     
+    def _evaluate_into_incumbent(self, combinations, need_keys, grouped_needs, shop_configs):
+        """Oceń kombinacje bez logowania - tylko aktualizacja najlepszego rozwiązania"""
+        for combo in combinations:
+            result = self._calculate_combination_result(combo, need_keys, grouped_needs, shop_configs)
+            self._update_incumbent(result)
+    
     def _calculate_minimum_shops_required(self, expanded_offers, need_keys):
-        """Oblicza minimalną liczbę sklepów potrzebną do realizacji koszyka"""
+        """Oblicza minimalną liczbę sklepów potrzebną do realizacji koszyka (dokładnie)"""
+        
+        if self.min_shops_required is not None:
+            return self.min_shops_required
         
         # Dla każdej potrzeby znajdź dostępne sklepy
         shops_per_need = []
         for need_key in need_keys:
             offers = expanded_offers[need_key]
-            available_shops = set(offer['shop_id'] for offer in offers)
+            available_shops = set(offer.shop for offer in offers)
             shops_per_need.append(available_shops)
         
-        # Algorytm zachłanny: znajdź minimalny zestaw sklepów
-        min_shops = self._greedy_set_cover(shops_per_need)
+        # Bez dokładnego wyniku (limit węzłów) tylko ograniczenie dolne - pokrycie może być za duże
+        min_shops, lower_bound = self._exact_set_cover(shops_per_need)
+        exact = lower_bound == len(min_shops)
+        self.min_shops_required = lower_bound
+        self.stats['min_shops_required'] = self.min_shops_required
+        self.stats['min_shops_exact'] = exact
         
-        self.log(f"📊 Analiza pokrycia sklepów:")
+        if exact:
+            self.log(f"📊 Analiza pokrycia sklepów: minimum {len(min_shops)} (dokładnie): {self._shop_names(min_shops)}")
+        else:
+            self.log(f"📊 Analiza pokrycia sklepów: minimum {lower_bound}-{len(min_shops)} (limit węzłów): {self._shop_names(min_shops)}")
         for i, shops in enumerate(shops_per_need):
-            self.log(f"   Potrzeba {i}: {len(shops)} sklepów {list(shops)[:3]}...")
+            if self.log.enabled(DEBUG):
+                self.log.debug("   Potrzeba %d: %d sklepów %s...", i, len(shops), self._shop_names(shops)[:3])
         
-        return len(min_shops)
+        return self.min_shops_required
     
     def _greedy_set_cover(self, shops_per_need):
         """Algorytm zachłanny dla problemu pokrycia zbiorów"""
         
-        all_needs = set(range(len(shops_per_need)))
-        covered_needs = set()
+        coverage = self._shop_coverage_masks(shops_per_need)
+        uncovered = (1 << len(shops_per_need)) - 1
         selected_shops = set()
         
-        while covered_needs != all_needs:
-            best_shop = None
-            best_coverage = 0
-            
-            # Znajdź sklep który pokrywa najwięcej niepokrytych potrzeb
-            all_shops = set()
-            for shops in shops_per_need:
-                all_shops.update(shops)
-            
-            for shop in all_shops:
-                if shop in selected_shops:
-                    continue
-                
-                # Ile nowych potrzeb pokryje ten sklep?
-                new_coverage = 0
-                for need_idx, shops in enumerate(shops_per_need):
-                    if need_idx not in covered_needs and shop in shops:
-                        new_coverage += 1
-                
-                if new_coverage > best_coverage:
-                    best_coverage = new_coverage
-                    best_shop = shop
-            
-            if best_shop:
-                selected_shops.add(best_shop)
-                # Oznacz pokryte potrzeby
-                for need_idx, shops in enumerate(shops_per_need):
-                    if best_shop in shops:
-                        covered_needs.add(need_idx)
-            else:
-                # Nie można pokryć - błąd w danych
-                break
+        while uncovered:
+            # Sklep który pokrywa najwięcej niepokrytych potrzeb
+            best_shop = max(coverage, key=lambda shop: bin(coverage[shop] & uncovered).count('1'), default=None)
+            if best_shop is None or not coverage[best_shop] & uncovered:
+                break  # Nie można pokryć - błąd w danych
+            selected_shops.add(best_shop)
+            uncovered &= ~coverage[best_shop]
         
         return selected_shops
     
+    def _shop_coverage_masks(self, shops_per_need):
+        """{shop: maska bitowa potrzeb które sklep pokrywa}"""
+        coverage = {}
+        for need_idx, shops in enumerate(shops_per_need):
+            for shop in shops:
+                coverage[shop] = coverage.get(shop, 0) | (1 << need_idx)
+        return coverage
+    
+    def _exact_set_cover(self, shops_per_need, max_nodes=200000):
+        """
+        Dokładne minimalne pokrycie potrzeb sklepami - branch and bound na maskach bitowych.
+        
+        Start od rozwiązania zachłannego. Gałęzie po najtrudniejszej potrzebie
+        (najmniej sklepów), ograniczenie dolne: max z ceil(niepokryte / największe
+        pokrycie) i liczby potrzeb bez wspólnego sklepu. Sklepy pokrywające
+        podzbiór innego są pomijane.
+        
+        Returns:
+            tuple: (zbiór sklepów, dolne ograniczenie liczby sklepów) - ograniczenie równe
+            rozmiarowi zbioru gdy wynik dokładny; po przekroczeniu max_nodes najlepsze
+            znalezione pokrycie i ograniczenie z korzenia
+        """
+        best = self._greedy_set_cover(shops_per_need)
+        full_mask = (1 << len(shops_per_need)) - 1
+        coverage = self._shop_coverage_masks(shops_per_need)
+        
+        # Usuń sklepy zdominowane (pokrywają podzbiór potrzeb innego sklepu)
+        shops = sorted(coverage, key=lambda shop: (-bin(coverage[shop]).count('1'), str(shop)))
+        kept = []
+        for shop in shops:
+            if not any(coverage[shop] & ~coverage[other] == 0 for other in kept):
+                kept.append(shop)
+        
+        if not shops_per_need or any(not shops for shops in shops_per_need):
+            return best, len(best)  # brak potrzeb albo potrzeba bez sklepów - zachłanny wystarczy
+        
+        shops_for_need = [[shop for shop in kept if coverage[shop] >> need_idx & 1]
+                          for need_idx in range(len(shops_per_need))]
+        
+        def lower_bound(uncovered):
+            max_cover = max(bin(coverage[shop] & uncovered).count('1') for shop in kept)
+            bound = -(-bin(uncovered).count('1') // max_cover)
+            # Potrzeby parami bez wspólnego sklepu - każda wymaga innego sklepu
+            independent, remaining = 0, uncovered
+            while remaining:
+                need_idx = (remaining & -remaining).bit_length() - 1
+                independent += 1
+                for shop in shops_for_need[need_idx]:
+                    remaining &= ~coverage[shop]
+                remaining &= ~(1 << need_idx)
+            return max(bound, independent)
+        
+        best_size = len(best)
+        best_set = list(best)
+        nodes = 0
+        
+        def search(uncovered, chosen):
+            nonlocal best_size, best_set, nodes
+            nodes += 1
+            if nodes > max_nodes:
+                return
+            if not uncovered:
+                if len(chosen) < best_size:
+                    best_size, best_set = len(chosen), list(chosen)
+                return
+            if len(chosen) + lower_bound(uncovered) >= best_size:
+                return
+            
+            # Potrzeba z najmniejszą liczbą sklepów - najmniejsze rozgałęzienie
+            need_idx = min(
+                (idx for idx in range(len(shops_for_need)) if uncovered >> idx & 1),
+                key=lambda idx: len(shops_for_need[idx])
+            )
+            for shop in sorted(shops_for_need[need_idx], key=lambda shop: -bin(coverage[shop] & uncovered).count('1')):
+                chosen.append(shop)
+                search(uncovered & ~coverage[shop], chosen)
+                chosen.pop()
+        
+        search(full_mask, [])
+        if nodes <= max_nodes:
+            return set(best_set), best_size
+        return set(best_set), min(best_size, lower_bound(full_mask))
+    
     def _calculate_shop_popularity(self, expanded_offers, need_keys):
         """Oblicza popularność sklepów (ile potrzeb może zaspokoić)"""
         
@@ -362,7 +1083,7 @@ class OptimizationEngine:
         for need_key in need_keys:
             offers = expanded_offers[need_key]
             for offer in offers:
-                shop_id = offer['shop_id']
+                shop_id = offer.shop
                 shop_popularity[shop_id] = shop_popularity.get(shop_id, 0) + 1
         
         return shop_popularity
@@ -376,7 +1097,7 @@ class OptimizationEngine:
         for need_key in need_keys:
             offers = expanded_offers[need_key]
             # Filtruj oferty tylko z wybranych sklepów
-            filtered_offers = [offer for offer in offers if offer['shop_id'] in shop_combination]
+            filtered_offers = [offer for offer in offers if offer.shop in shop_combination]
             
             if not filtered_offers:
                 # Ta potrzeba nie może być zaspokojona przez te sklepy
@@ -398,6 +1119,13 @@ class OptimizationEngine:
         self.log("🔥 ALGORYTMY ZAAWANSOWANE - ostatnia szansa")
         self.stats['optimization_strategies_used'].append('advanced_algorithms')
         
+        if self.parallel_workers > 1 and not self._parallel_search_tried:
+            parallel_result = self._parallel_search_with_shop_limit(
+                expanded_offers, need_keys, grouped_needs, shop_configs
+            )
+            if parallel_result:
+                return parallel_result
+        
         # ALGORYTM 1: Genetyczny z limitem sklepów
         genetic_result = self._genetic_algorithm_with_shop_limit(
             expanded_offers, need_keys, grouped_needs, shop_configs
@@ -419,10 +1147,58 @@ class OptimizationEngine:
         self.log("❌ Wszystkie zaawansowane algorytmy zawiodły")
         return None
     
+    def _parallel_search_with_shop_limit(self, expanded_offers, need_keys, grouped_needs, shop_configs):
+        """Równoległe próbkowanie + GA wyspowy + multi-start local search (optimization_parallel)"""
+        
+        self._parallel_search_tried = True
+        try:
+            from optimization_parallel import CompactProblem, parallel_search
+        except ImportError as e:
+            self.log(f"⚠️ Równoległe przeszukiwanie niedostępne: {e}")
+            return None
+        
+        self.log(f"🧵 RÓWNOLEGŁE PRZESZUKIWANIE: {self.parallel_workers} procesów")
+        self.stats['optimization_strategies_used'].append('parallel_search')
+        self._checkpoint(strategy='parallel_search')
+        
+        problem = CompactProblem(expanded_offers, need_keys, grouped_needs, shop_configs,
+                                 self.shop_ids, self.max_shops, self.priority)
+        
+        def to_result(choice):
+            combination = [expanded_offers[need_key][c] for need_key, c in zip(need_keys, choice)]
+            return self._calculate_combination_result(combination, need_keys, grouped_needs, shop_configs)
+        
+        def on_improvement(choice, score):
+            self._update_incumbent(to_result(choice))
+        
+        time_limit = max(0.0, self.deadline - time.monotonic()) if self.deadline is not None else None
+        try:
+            search = parallel_search(
+                problem, self.parallel_workers, seed=self.rng.getrandbits(63),
+                time_limit=time_limit, checkpoint=self._checkpoint, on_improvement=on_improvement,
+                samples=self.MAX_COMBINATIONS
+            )
+        except (OSError, NotImplementedError, RuntimeError) as e:
+            # BrokenProcessPool to RuntimeError - wracamy do wersji jednoprocesowej
+            self.log(f"⚠️ Pula procesów niedostępna ({e}) - przeszukiwanie jednoprocesowe")
+            return None
+        
+        self.stats['combinations_evaluated'] += search['evaluated']
+        self.stats['combinations_within_limit'] += search['within_limit']
+        
+        if not search['best']:
+            self.log("❌ Równoległe przeszukiwanie nie znalazło rozwiązania w limicie")
+            return None
+        
+        best_result = to_result(search['best'][1])
+        self.log(f"🏆 Równolegle: {search['evaluated']:,} ocen, najlepszy wynik {search['best'][0]:.2f}")
+        return best_result
+    
     def _genetic_algorithm_with_shop_limit(self, expanded_offers, need_keys, grouped_needs, shop_configs):
         """Uproszczony algorytm genetyczny z limitem sklepów"""
         
         self.log("🧬 ALGORYTM GENETYCZNY z limitem sklepów")
+        self._checkpoint(strategy='genetic')
         
         # Parametry algorytmu
         population_size = 100
@@ -438,11 +1214,11 @@ class OptimizationEngine:
             individual = []
             for offers in offer_lists:
                 if offers:
-                    individual.append(random.choice(offers))
+                    individual.append(self.rng.choice(offers))
             
             # Sprawdź limit sklepów
             if individual:
-                unique_shops = set(offer['shop_id'] for offer in individual)
+                unique_shops = set(offer.shop for offer in individual)
                 if len(unique_shops) <= self.max_shops:
                     population.append(individual)
             
@@ -465,24 +1241,25 @@ class OptimizationEngine:
             
             # Sortuj po fitness
             fitness_scores.sort(key=lambda x: x[1], reverse=True)
+            self._update_incumbent(fitness_scores[0][2])
             
             # Nowa populacja - najlepsi + potomkowie
             new_population = [ind for ind, _, _ in fitness_scores[:population_size//2]]
             
             # Krzyżowanie i mutacja
             while len(new_population) < population_size:
-                parent1 = random.choice(fitness_scores[:population_size//4])[0]
-                parent2 = random.choice(fitness_scores[:population_size//4])[0]
+                parent1 = self.rng.choice(fitness_scores[:population_size//4])[0]
+                parent2 = self.rng.choice(fitness_scores[:population_size//4])[0]
                 
                 child = self._crossover_with_shop_limit(parent1, parent2, need_keys, offer_lists)
-                if child and random.random() < mutation_rate:
+                if child and self.rng.random() < mutation_rate:
                     child = self._mutate_with_shop_limit(child, need_keys, offer_lists)
                 
                 if child:
                     new_population.append(child)
                 else:
                     # Jeśli nie udało się stworzyć potomka, weź losowego z populacji
-                    new_population.append(random.choice(population))
+                    new_population.append(self.rng.choice(population))
             
             population = new_population
         
@@ -498,13 +1275,13 @@ class OptimizationEngine:
         child = []
         for i in range(len(parent1)):
             # Losowo wybierz gen od jednego z rodziców
-            if random.random() < 0.5:
+            if self.rng.random() < 0.5:
                 child.append(parent1[i])
             else:
                 child.append(parent2[i])
         
         # Sprawdź limit sklepów
-        unique_shops = set(offer['shop_id'] for offer in child)
+        unique_shops = set(offer.shop for offer in child)
         if len(unique_shops) <= self.max_shops:
             return child
         
@@ -517,14 +1294,14 @@ class OptimizationEngine:
         mutant = individual.copy()
         
         # Zmutuj losowy gen
-        mutation_point = random.randint(0, len(mutant) - 1)
+        mutation_point = self.rng.randint(0, len(mutant) - 1)
         available_offers = offer_lists[mutation_point]
         
         if available_offers:
-            mutant[mutation_point] = random.choice(available_offers)
+            mutant[mutation_point] = self.rng.choice(available_offers)
         
         # Sprawdź limit sklepów
-        unique_shops = set(offer['shop_id'] for offer in mutant)
+        unique_shops = set(offer.shop for offer in mutant)
         if len(unique_shops) <= self.max_shops:
             return mutant
         
@@ -537,7 +1314,7 @@ class OptimizationEngine:
         # Znajdź sklepy i ich częstość
         shop_usage = {}
         for offer in individual:
-            shop_id = offer['shop_id']
+            shop_id = offer.shop
             shop_usage[shop_id] = shop_usage.get(shop_id, 0) + 1
         
         # Jeśli limit nie jest przekroczony, zwróć bez zmian
@@ -550,11 +1327,11 @@ class OptimizationEngine:
         # Napraw osobnika
         repaired = []
         for i, offer in enumerate(individual):
-            if offer['shop_id'] in shops_to_keep:
+            if offer.shop in shops_to_keep:
                 repaired.append(offer)
             else:
                 # Znajdź zamiennik z dozwolonych sklepów
-                alternative_offers = [o for o in offer_lists[i] if o['shop_id'] in shops_to_keep]
+                alternative_offers = [o for o in offer_lists[i] if o.shop in shops_to_keep]
                 if alternative_offers:
                     repaired.append(alternative_offers[0])  # Najlepszy z dozwolonych
                 else:
@@ -567,6 +1344,7 @@ class OptimizationEngine:
         """Przeszukiwanie lokalne z limitem sklepów"""
         
         self.log("🔍 PRZESZUKIWANIE LOKALNE z limitem sklepów")
+        self._checkpoint(strategy='local_search')
         
         # Znajdź rozwiązanie początkowe
         current_solution = self._find_initial_solution_within_limit(expanded_offers, need_keys)
@@ -577,6 +1355,7 @@ class OptimizationEngine:
         
         current_result = self._calculate_combination_result(current_solution, need_keys, grouped_needs, shop_configs)
         current_score = self._calculate_priority_score(current_result)
+        self._update_incumbent(current_result, current_score)
         
         self.log(f"🎯 Rozwiązanie początkowe: {current_score:.2f}")
         
@@ -585,6 +1364,8 @@ class OptimizationEngine:
         no_improvement_count = 0
         
         for iteration in range(max_iterations):
+            self._checkpoint()
+            
             # Generuj sąsiadów
             neighbors = self._generate_neighbors_within_shop_limit(
                 current_solution, expanded_offers, need_keys
@@ -608,8 +1389,9 @@ class OptimizationEngine:
                 current_solution = best_neighbor
                 current_result = best_neighbor_result
                 current_score = best_neighbor_score
+                self._update_incumbent(current_result, current_score)
                 no_improvement_count = 0
-                self.log(f"🔥 Iteracja {iteration}: poprawa do {current_score:.2f}")
+                self.log.debug("🔥 Iteracja %d: poprawa do %.2f", iteration, current_score)
             else:
                 no_improvement_count += 1
                 
@@ -628,7 +1410,7 @@ class OptimizationEngine:
         best_solution = [offers[0] for offers in offer_lists if offers]
         
         if best_solution:
-            unique_shops = set(offer['shop_id'] for offer in best_solution)
+            unique_shops = set(offer.shop for offer in best_solution)
             if len(unique_shops) <= self.max_shops:
                 return best_solution
         
@@ -646,7 +1428,7 @@ class OptimizationEngine:
             
             # Najpierw spróbuj oferty z już używanych sklepów
             for offer in offers:
-                if offer['shop_id'] in used_shops:
+                if offer.shop in used_shops:
                     best_offer = offer
                     break
             
@@ -655,7 +1437,7 @@ class OptimizationEngine:
                 for offer in offers:
                     if len(used_shops) < self.max_shops:
                         best_offer = offer
-                        used_shops.add(offer['shop_id'])
+                        used_shops.add(offer.shop)
                         break
             
             if best_offer:
@@ -674,7 +1456,7 @@ class OptimizationEngine:
         """Generuje sąsiadów w limicie sklepów"""
         
         neighbors = []
-        current_shops = set(offer['shop_id'] for offer in solution)
+        current_shops = set(offer.shop for offer in solution)
         
         # Dla każdej pozycji w rozwiązaniu
         for i, current_offer in enumerate(solution):
@@ -689,7 +1471,7 @@ class OptimizationEngine:
                 new_solution = solution.copy()
                 new_solution[i] = alternative_offer
                 
-                new_shops = set(offer['shop_id'] for offer in new_solution)
+                new_shops = set(offer.shop for offer in new_solution)
                 
                 if len(new_shops) <= self.max_shops:
                     neighbors.append(new_solution)
@@ -720,7 +1502,10 @@ class OptimizationEngine:
             
             return individual_products
         
-        groups = substitute_manager.load_substitute_groups()
+        if self.shared_data is not None:
+            groups = self.shared_data.substitute_groups
+        else:
+            groups = substitute_manager.load_substitute_groups()
         basket_items = basket.get('basket_items', {})
         
         # Mapowanie: product_id -> group_id
@@ -760,11 +1545,11 @@ class OptimizationEngine:
                 if len(group_products) > 1:
                     # ŁĄCZENIE ILOŚCI!
                     self.log(f"   🔗 GRUPA {group_id}: ŁĄCZĘ {len(group_products)} produktów")
-                    product_names = [p['product_name'] for p in group_products]
-                    quantities = [f"{p['product_id']}({p['quantity']}szt)" for p in group_products]
-                    
-                    self.log(f"      📦 Produkty: {', '.join(product_names)}")
-                    self.log(f"      🔢 Ilości: {', '.join(quantities)} = {total_quantity} szt ŁĄCZNIE")
+                    if self.log.enabled(DEBUG):
+                        product_names = [p['product_name'] for p in group_products]
+                        quantities = [f"{p['product_id']}({p['quantity']}szt)" for p in group_products]
+                        self.log.debug("      📦 Produkty: %s", ', '.join(product_names))
+                        self.log.debug("      🔢 Ilości: %s = %d szt ŁĄCZNIE", ', '.join(quantities), total_quantity)
                     
                     # Wybierz najrestrykcyjniejsze ustawienia
                     group_settings = self._merge_substitute_settings([p['substitute_settings'] for p in group_products])
@@ -779,7 +1564,7 @@ class OptimizationEngine:
                     })
                     
                     used_groups.add(group_id)
-                    self.log(f"      ✅ POŁĄCZONO w grupę o łącznej ilości {total_quantity}")
+                    self.log.debug("      ✅ POŁĄCZONO w grupę o łącznej ilości %d", total_quantity)
                     
                 else:
                     # Pojedynczy produkt z grupy
@@ -792,7 +1577,7 @@ class OptimizationEngine:
                         'has_substitutes': True,
                         'group_id': group_id
                     })
-                    self.log(f"   📦 Produkt {product_id}: pojedynczy ze skupiny {group_id} ({quantity} szt)")
+                    self.log.debug("   📦 Produkt %s: pojedynczy ze skupiny %s (%s szt)", product_id, group_id, quantity)
                     
             elif not group_id or not self.allow_substitutes:
                 # Produkt bez grupy lub wyłączone zamienniki
@@ -806,7 +1591,7 @@ class OptimizationEngine:
                     'group_id': None
                 })
                 reason = "bez zamienników" if not group_id else "zamienniki wyłączone"
-                self.log(f"   📦 Produkt {product_id}: pojedynczy {reason} ({quantity} szt)")
+                self.log.debug("   📦 Produkt %s: pojedynczy %s (%s szt)", product_id, reason, quantity)
         
         all_needs = grouped_needs + individual_products
         
@@ -836,18 +1621,18 @@ class OptimizationEngine:
             need_key = f"need_{need_index}"
             expanded_offers[need_key] = []
             
-            self.log(f"\n   🔍 NEED #{need_index} ({need_key}):")
-            self.log(f"      📦 Typ: {need['type']}")
+            self.log.debug("\n   🔍 NEED #%d (%s):", need_index, need_key)
+            self.log.debug("      📦 Typ: %s", need['type'])
             
             if need['type'] == 'substitute_group':
                 # Obsługa grupy zamienników
-                self.log(f"   🔗 GRUPA {need['group_id']}: {need['total_quantity']} szt łącznie")
+                self.log.debug("   🔗 GRUPA %s: %s szt łącznie", need['group_id'], need['total_quantity'])
                 
                 group_settings = need['substitute_settings']
                 group_allow_substitutes = group_settings.get('allow_substitutes', True) and self.allow_substitutes
                 
                 if not group_allow_substitutes:
-                    self.log(f"      ❌ Zamienniki wyłączone dla tej grupy")
+                    self.log.debug("      ❌ Zamienniki wyłączone dla tej grupy")
                     original_offers = self._get_group_original_offers(need, normalized_prices)
                     expanded_offers[need_key] = original_offers
                     if not original_offers:
@@ -871,11 +1656,11 @@ class OptimizationEngine:
                                         and self.allow_substitutes 
                                         and need['has_substitutes'])
                 
-                self.log(f"   📦 PRODUKT {product_id}: {quantity} szt")
+                self.log.debug("   📦 PRODUKT %s: %s szt", product_id, quantity)
                 
                 if not item_allow_substitutes:
                     reason = "wyłączone" if not item_settings.get('allow_substitutes', True) else "brak grupy"
-                    self.log(f"      ❌ Zamienniki {reason} dla tego produktu")
+                    self.log.debug("      ❌ Zamienniki %s dla tego produktu", reason)
                     
                     original_offers = self._get_individual_original_offers(need, normalized_prices)
                     expanded_offers[need_key] = original_offers
@@ -918,12 +1703,12 @@ class OptimizationEngine:
         # Znajdź najlepszą cenę oryginału dla porównania
         original_best_price = None
         if original_offers:
-            original_best_price = min(offer['price_pln'] for offer in original_offers)
+            original_best_price = min(offer.price_pln for offer in original_offers)
         
         # Dodaj zamienniki jeśli są dostępne
         try:
             from substitute_manager import substitute_manager
-            substitute_info = substitute_manager.get_substitutes_for_product(product_id)
+            substitute_info = self._substitutes_for_product(substitute_manager, product_id)
             
             if substitute_info['substitutes']:
                 for substitute in substitute_info['substitutes'][:self.max_substitutes_per_product]:
@@ -937,7 +1722,7 @@ class OptimizationEngine:
             pass  # Brak substitute_manager
         
         # Sortuj według ceny
-        offers.sort(key=lambda x: x['price_pln'])
+        offers.sort(key=lambda x: x.price_pln)
         
         return offers
     
@@ -953,7 +1738,7 @@ class OptimizationEngine:
         # Znajdź najlepszą cenę w grupie
         group_best_price = None
         if original_offers:
-            group_best_price = min(offer['price_pln'] for offer in original_offers)
+            group_best_price = min(offer.price_pln for offer in original_offers)
         
         # Dodaj zamienniki spoza koszyka
         try:
@@ -961,7 +1746,7 @@ class OptimizationEngine:
             
             # Dla pierwszego produktu z grupy znajdź zamienniki
             first_product = need['products_in_basket'][0]
-            substitute_info = substitute_manager.get_substitutes_for_product(first_product['product_id'])
+            substitute_info = self._substitutes_for_product(substitute_manager, first_product['product_id'])
             
             group_settings = need['substitute_settings']
             max_price_increase = group_settings.get('max_price_increase_percent', self.max_price_increase_percent)
@@ -980,18 +1765,24 @@ class OptimizationEngine:
             pass
         
         # Sortuj według ceny
-        offers.sort(key=lambda x: x['price_pln'])
+        offers.sort(key=lambda x: x.price_pln)
         
         return offers
     
+    def _substitutes_for_product(self, substitute_manager, product_id):
+        """Zamienniki produktu - z danych wspólnych (bez czytania plików) albo z substitute_manager"""
+        if self.shared_data is not None:
+            return self.shared_data.substitutes_for_product(product_id)
+        return substitute_manager.get_substitutes_for_product(product_id)
+    
     def _get_substitute_offers(self, substitute_id, normalized_prices, original_id, 
                              original_best_price, max_price_increase, quantity):
         """Pobiera oferty dla konkretnego zamiennika"""
         
         offers = []
         
-        for key, price_data in normalized_prices.items():
-            if price_data['product_id'] == substitute_id and price_data.get('price_pln'):
+        for price_data in self._product_prices(normalized_prices, substitute_id):
+            if price_data.get('price_pln'):
                 substitute_price = price_data['price_pln']
                 
                 # Sprawdź limit wzrostu ceny
@@ -1011,19 +1802,13 @@ class OptimizationEngine:
                 else:
                     reason = "Oryginał niedostępny"
                 
-                offer = {
-                    'product_id': substitute_id,
-                    'shop_id': price_data['shop_id'],
-                    'price_pln': substitute_price,
-                    'price_original': price_data['price_original'],
-                    'currency': price_data['currency'],
-                    'is_substitute': True,
-                    'original_product_id': original_id,
-                    'substitute_product_id': substitute_id,
-                    'substitute_reason': reason,
-                    'quantity': quantity
-                }
-                offers.append(offer)
+                offers.append(Offer(
+                    shop=self._shop_code(price_data['shop_id']),
+                    product_id=substitute_id,
+                    price_pln=substitute_price,
+                    is_substitute=True,
+                    substitute_reason=reason
+                ))
         
         return offers
     
@@ -1032,23 +1817,16 @@ class OptimizationEngine:
         offers = []
         product_id = need['product_id']
         
-        for key, price_data in normalized_prices.items():
-            if price_data['product_id'] == product_id and price_data.get('price_pln'):
-                offer = {
-                    'product_id': product_id,
-                    'shop_id': price_data['shop_id'],
-                    'price_pln': price_data['price_pln'],
-                    'price_original': price_data['price_original'],
-                    'currency': price_data['currency'],
-                    'is_substitute': False,
-                    'original_product_id': product_id,
-                    'substitute_reason': '',
-                    'individual_quantity': need['quantity']
-                }
-                offers.append(offer)
+        for price_data in self._product_prices(normalized_prices, product_id):
+            if price_data.get('price_pln'):
+                offers.append(Offer(
+                    shop=self._shop_code(price_data['shop_id']),
+                    product_id=product_id,
+                    price_pln=price_data['price_pln']
+                ))
         
         # Sortuj według ceny
-        offers.sort(key=lambda x: x['price_pln'])
+        offers.sort(key=lambda x: x.price_pln)
         return offers
     
     def _get_group_original_offers(self, need, normalized_prices):
@@ -1058,25 +1836,17 @@ class OptimizationEngine:
         for product_info in need['products_in_basket']:
             product_id = product_info['product_id']
             
-            for key, price_data in normalized_prices.items():
-                if price_data['product_id'] == product_id and price_data.get('price_pln'):
-                    offer = {
-                        'product_id': product_id,
-                        'shop_id': price_data['shop_id'],
-                        'price_pln': price_data['price_pln'],
-                        'price_original': price_data['price_original'],
-                        'currency': price_data['currency'],
-                        'is_substitute': False,
-                        'original_group': need['group_id'],
-                        'substitute_reason': '',
-                        'group_quantity': need['total_quantity'],
-                        'from_basket': True,
-                        'basket_product_id': product_id
-                    }
-                    offers.append(offer)
+            for price_data in self._product_prices(normalized_prices, product_id):
+                if price_data.get('price_pln'):
+                    offers.append(Offer(
+                        shop=self._shop_code(price_data['shop_id']),
+                        product_id=product_id,
+                        price_pln=price_data['price_pln'],
+                        from_basket=True
+                    ))
         
         # Sortuj według ceny
-        offers.sort(key=lambda x: x['price_pln'])
+        offers.sort(key=lambda x: x.price_pln)
         return offers
     
     def _get_original_offers_only(self, grouped_needs, normalized_prices):
@@ -1108,7 +1878,7 @@ class OptimizationEngine:
         # Grupuj według liczby sklepów dla lepszego logowania
         by_shops = {}
         for combo in combinations:
-            shop_count = len(set(offer['shop_id'] for offer in combo))
+            shop_count = len(set(offer.shop for offer in combo))
             if shop_count not in by_shops:
                 by_shops[shop_count] = []
             by_shops[shop_count].append(combo)
@@ -1116,7 +1886,7 @@ class OptimizationEngine:
         evaluated = 0
         for shop_count in sorted(by_shops.keys()):
             combos = by_shops[shop_count]
-            self.log(f"   🏪 Oceniam {len(combos)} kombinacji z {shop_count} sklepami")
+            self.log.debug("   🏪 Oceniam %d kombinacji z %d sklepami", len(combos), shop_count)
             
             for combo in combos:
                 # Przelicz kombinację
@@ -1125,11 +1895,15 @@ class OptimizationEngine:
                 # Oblicz wynik według priorytetu
                 score = self._calculate_priority_score(result)
                 evaluated += 1
+                if not evaluated & 255:
+                    self._checkpoint()
                 
                 if score < best_score:
                     best_score = score
                     best_combination = result
-                    self.log(f"      ⭐ Nowa najlepsza (#{evaluated}): {score:.2f}, {result['shops_count']} sklepów, {result['total_cost']:.2f} PLN")
+                    self._update_incumbent(result, score)
+                    self.log.debug("      ⭐ Nowa najlepsza (#%d): %.2f, %d sklepów, %.2f PLN",
+                                   evaluated, score, result['shops_count'], result['total_cost'])
         
         self.log(f"✅ NAJLEPSZA KOMBINACJA: wynik {best_score:.2f} w {best_combination['shops_count'] if best_combination else 0} sklepach")
         return best_combination
@@ -1147,44 +1921,50 @@ class OptimizationEngine:
         
         return score
     
+    def _product_name(self, product_id):
+        """Nazwa produktu z products_data; gdy silnik dostał pustą listę - z pliku jak dawniej"""
+        if product_id in self.product_names:
+            return self.product_names[product_id]
+        try:
+            from utils.data_utils import load_products
+            self.product_names.update({p['id']: p.get('name') for p in load_products()})
+        except Exception:
+            pass
+        return self.product_names.setdefault(product_id, None)
+    
     def _calculate_combination_result(self, combination, need_keys, grouped_needs, shop_configs):
         """Przelicza kombinację na format wynikowy"""
         
+        self.stats['combinations_scored'] += 1
         shops_summary = {}
         items_list = []
         
         for i, offer in enumerate(combination):
-            shop_id = offer['shop_id']
+            shop_id = self.shop_ids[offer.shop]
             need_index = int(need_keys[i].split('_')[1])
             need = grouped_needs[need_index]
             
             if need['type'] == 'substitute_group':
                 # Obsługa grupy zamienników
                 total_quantity = need['total_quantity']
-                unit_price = offer['price_pln']
+                unit_price = offer.price_pln
                 
                 # Określ nazwę produktu
-                if offer.get('from_basket'):
+                if offer.from_basket:
                     basket_product = next(
-                        (p for p in need['products_in_basket'] if p['product_id'] == offer.get('basket_product_id')),
+                        (p for p in need['products_in_basket'] if p['product_id'] == offer.product_id),
                         need['products_in_basket'][0]
                     )
                     product_name = f"{basket_product['product_name']} (grupa {len(need['products_in_basket'])} produktów)"
-                    actual_product_id = offer.get('basket_product_id', basket_product['product_id'])
+                    actual_product_id = offer.product_id
                 else:
                     # Zamiennik spoza koszyka
-                    try:
-                        from utils.data_utils import load_products
-                        all_products = load_products()
-                        substitute_product = next((p for p in all_products if p['id'] == offer['product_id']), None)
-                        if substitute_product:
-                            product_name = f"{substitute_product['name']} (zamiennik grupy)"
-                        else:
-                            product_name = f"Zamiennik {offer['product_id']} (grupa)"
-                        actual_product_id = offer['product_id']
-                    except:
-                        product_name = f"Zamiennik {offer['product_id']} (grupa)"
-                        actual_product_id = offer['product_id']
+                    substitute_name = self._product_name(offer.product_id)
+                    if substitute_name:
+                        product_name = f"{substitute_name} (zamiennik grupy)"
+                    else:
+                        product_name = f"Zamiennik {offer.product_id} (grupa)"
+                    actual_product_id = offer.product_id
                 
                 item_data = {
                     'product_id': need['products_in_basket'][0]['product_id'],  # Pierwszy z koszyka
@@ -1194,8 +1974,8 @@ class OptimizationEngine:
                     'quantity': total_quantity,
                     'unit_price_pln': unit_price,
                     'total_price_pln': unit_price * total_quantity,
-                    'is_substitute': offer.get('is_substitute', False),
-                    'substitute_reason': offer.get('substitute_reason', ''),
+                    'is_substitute': offer.is_substitute,
+                    'substitute_reason': offer.substitute_reason,
                     'quantity_optimized': False,
                     'optimization_reason': '',
                     'is_group': True,
@@ -1208,19 +1988,14 @@ class OptimizationEngine:
                 # Obsługa produktu indywidualnego
                 product_id = need['product_id']
                 quantity = need['quantity']
-                unit_price = offer['price_pln']
+                unit_price = offer.price_pln
                 
-                if offer.get('is_substitute', False):
-                    actual_product_id = offer.get('substitute_product_id', offer['product_id'])
-                    try:
-                        from utils.data_utils import load_products
-                        all_products = load_products()
-                        substitute_product = next((p for p in all_products if p['id'] == actual_product_id), None)
-                        if substitute_product:
-                            product_name = f"{substitute_product['name']} (zamiennik)"
-                        else:
-                            product_name = f"Zamiennik {actual_product_id}"
-                    except:
+                if offer.is_substitute:
+                    actual_product_id = offer.product_id
+                    substitute_name = self._product_name(actual_product_id)
+                    if substitute_name:
+                        product_name = f"{substitute_name} (zamiennik)"
+                    else:
                         product_name = f"Zamiennik {actual_product_id}"
                 else:
                     actual_product_id = product_id
@@ -1234,8 +2009,8 @@ class OptimizationEngine:
                     'quantity': quantity,
                     'unit_price_pln': unit_price,
                     'total_price_pln': unit_price * quantity,
-                    'is_substitute': offer.get('is_substitute', False),
-                    'substitute_reason': offer.get('substitute_reason', ''),
+                    'is_substitute': offer.is_substitute,
+                    'substitute_reason': offer.substitute_reason,
                     'quantity_optimized': False,
                     'optimization_reason': '',
                     'is_group': False
@@ -1344,40 +2119,28 @@ class OptimizationEngine:
                 effective_threshold = min(self.min_savings_threshold, missing_amount * 2)
                 
                 if potential_savings >= effective_threshold:
-                    best_optimization = self._find_best_quantity_increase(shop_summary['items'], missing_amount)
+                    # Najtańsze dokupienie po wszystkich produktach sklepu (DP po groszach)
+                    with self.log.timer('top_up_dp'):
+                        top_up = find_free_shipping_top_up(
+                            shop_summary['items'], missing_amount, self.max_quantity_multiplier
+                        )
                     
-                    if best_optimization:
-                        item = best_optimization['item']
-                        old_quantity = item['quantity']
-                        new_quantity = best_optimization['new_quantity']
-                        additional_cost = best_optimization['additional_cost']
-                        real_savings = shipping_cost - additional_cost
+                    if top_up:
+                        real_savings = shipping_cost - top_up['additional_cost']
                         
                         if real_savings > 0:
-                            # Aplikuj optymalizację
-                            item['quantity'] = new_quantity
-                            item['total_price_pln'] = item['unit_price_pln'] * new_quantity
-                            item['quantity_optimized'] = True
-                            item['optimization_reason'] = f"Zwiększono z {old_quantity} do {new_quantity} dla darmowej dostawy (oszczędność: {real_savings:.2f} PLN)"
-                            
-                            # Przelicz koszty
-                            shop_summary['subtotal'] += additional_cost
-                            shop_summary['shipping_cost'] = 0
-                            
-                            result['total_products_cost'] += additional_cost
-                            result['total_shipping_cost'] -= shipping_cost
-                            result['total_cost'] = result['total_products_cost'] + result['total_shipping_cost']
-                            
+                            apply_free_shipping_top_up(result, shop_summary, top_up, shipping_cost)
                             total_savings += real_savings
-                            optimizations_count += 1
+                            optimizations_count += len(top_up['additions'])
                             
-                            self.log(f"      ✅ OPTYMALIZACJA: {item.get('product_name', item['product_id'])}")
-                            self.log(f"         📦 {old_quantity} → {new_quantity} sztuk (+{additional_cost:.2f} PLN)")
-                            self.log(f"         💎 Oszczędności: {real_savings:.2f} PLN")
+                            for item, units in top_up['additions']:
+                                self.log(f"      ✅ OPTYMALIZACJA: {item.get('product_name', item['product_id'])}")
+                                self.log(f"         📦 {item['quantity'] - units} → {item['quantity']} sztuk")
+                            self.log(f"         💎 Dopłata {top_up['additional_cost']:.2f} PLN, oszczędności: {real_savings:.2f} PLN")
                         else:
                             self.log(f"      ❌ Brak realnych oszczędności ({real_savings:.2f} PLN)")
                     else:
-                        self.log(f"      ❌ Nie znaleziono odpowiedniego produktu do zwiększenia")
+                        self.log(f"      ❌ Nie da się dobić do progu w limicie mnożnika ilości")
                 else:
                     self.log(f"      ❌ Za małe oszczędności ({potential_savings:.2f} < {effective_threshold:.2f} PLN)")
                     
@@ -1393,79 +2156,9 @@ class OptimizationEngine:
         
         return result
     
-    def _find_best_quantity_increase(self, shop_items, needed_amount):
-        """Znajduje najlepszy produkt do zwiększenia ilości"""
-        best_option = None
-        
-        for item in shop_items:
-            if item.get('is_group'):
-                continue  # Pomiń grupy zamienników
-            
-            unit_price = item['unit_price_pln']
-            current_qty = item['quantity']
-            
-            for additional_qty in [1, 2, 3, 5, 10]:
-                new_quantity = current_qty + additional_qty
-                additional_cost = additional_qty * unit_price
-                
-                # Sprawdź limit mnożnika
-                if new_quantity > current_qty * self.max_quantity_multiplier:
-                    continue
-                
-                if additional_cost >= needed_amount:
-                    efficiency = needed_amount / additional_cost
-                    
-                    if not best_option or efficiency > best_option['efficiency']:
-                        best_option = {
-                            'item': item,
-                            'new_quantity': new_quantity,
-                            'additional_cost': additional_cost,
-                            'efficiency': efficiency,
-                            'additional_qty': additional_qty
-                        }
-        
-        return best_option
-    
     def _normalize_prices(self, prices_data):
         """Normalizuje ceny do PLN"""
-        fx_rates = {'PLN': 1.0, 'EUR': 4.30, 'USD': 4.00}
-        normalized_prices = {}
-        
-        for key, price_info in prices_data.items():
-            if price_info.get('price'):
-                currency = price_info.get('currency', 'PLN')
-                rate = fx_rates.get(currency, 1.0)
-                
-                try:
-                    price_value = price_info['price']
-                    
-                    if isinstance(price_value, str):
-                        price_clean = price_value.strip().replace(',', '.')
-                        import re
-                        numbers = re.findall(r'\d+\.?\d*', price_clean)
-                        if numbers:
-                            price_value = float(numbers[-1])
-                        else:
-                            continue
-                    elif not isinstance(price_value, (int, float)):
-                        continue
-                    else:
-                        price_value = float(price_value)
-                    
-                    if price_value <= 0:
-                        continue
-                    
-                    normalized_prices[key] = {
-                        'product_id': price_info['product_id'],
-                        'shop_id': price_info['shop_id'],
-                        'price_pln': price_value * rate,
-                        'price_original': price_value,
-                        'currency': currency
-                    }
-                    
-                except (ValueError, TypeError):
-                    continue
-        
+        normalized_prices = normalize_prices(prices_data)
         self.log(f"💰 Znormalizowano {len(normalized_prices)} cen z {len(prices_data)} dostępnych")
         return normalized_prices
     
@@ -1548,6 +2241,11 @@ class OptimizationEngine:
             
             if acceptance_rate < 10:
                 self.log(f"   ⚠️ UWAGA: Niski wskaźnik akceptacji - rozważ zwiększenie limitu sklepów")
+        
+        self.log(f"   ⏱️ Czas: {self.stats.get('elapsed_ms', 0)} ms"
+                 + (f" (budżet {self.time_budget_ms} ms{', wyczerpany' if self.stats.get('budget_exhausted') else ''})" if self.time_budget_ms else ""))
+        if self.log.timers:
+            self.log("   ⏱️ Kroki: %s", ', '.join(f"{name} {seconds * 1000:.1f} ms" for name, seconds in self.log.timers.items()))
     
     # NOWE: Funkcje pomocnicze dla zaawansowanych algorytmów
     
@@ -1568,7 +2266,7 @@ class OptimizationEngine:
         complexity = self._estimate_complexity(expanded_offers, need_keys)
         num_needs = len(need_keys)
         num_shops = len(set(
-            offer['shop_id'] 
+            offer.shop 
             for offers in expanded_offers.values() 
             for offer in offers
         ))
@@ -1593,37 +2291,133 @@ class OptimizationEngine:
             self.log("   🔍 WYBRANO: Przeszukiwanie lokalne")
             return "local_search"
     
-    def _advanced_preprocessing(self, expanded_offers, need_keys):
-        """Zaawansowane przetwarzanie wstępne ofert"""
+    def _advanced_preprocessing(self, expanded_offers, need_keys, shop_configs, grouped_needs):
+        """
+        Przycinanie ofert przed przeszukiwaniem:
+        1. najtańsza oferta na (potrzeba, sklep, oryginał/zamiennik); zamiennik zostaje
+           tylko gdy jest tańszy od oryginału w tym samym sklepie. W sklepach z progiem
+           darmowej dostawy zostają też droższe oferty, które mogą przekroczyć próg
+        2. sklepy zdominowane - inny sklep ma wszystkie ich potrzeby nie drożej,
+           a jego dostawa na pewno nie wyjdzie drożej
+        3. limit rang - max_offers_per_need najtańszych ofert na potrzebę (0 = bez limitu);
+           stratny - gdy coś utnie, strategie dokładne przestają nimi być (pruning_lossless)
+        """
+        before = self._search_space_stats(expanded_offers, need_keys)
         
-        # Usuń zdominowane oferty
         for need_key in need_keys:
-            offers = expanded_offers[need_key]
-            if len(offers) > 10:  # Tylko dla dużych zbiorów
-                filtered_offers = self._remove_dominated_offers(offers)
-                expanded_offers[need_key] = filtered_offers
-                
-                removed_count = len(offers) - len(filtered_offers)
-                if removed_count > 0:
-                    self.log(f"   🗑️ Usunięto {removed_count} zdominowanych ofert dla {need_key}")
+            expanded_offers[need_key] = self._remove_dominated_offers(
+                expanded_offers[need_key], self._need_quantity(grouped_needs, need_key), shop_configs)
+        
+        dominated_shops = self._find_dominated_shops(expanded_offers, need_keys, shop_configs)
+        if dominated_shops:
+            self.log(f"   🗑️ Sklepy zdominowane (usunięte): {', '.join(self._shop_names(dominated_shops))}")
+            for need_key in need_keys:
+                remaining = [offer for offer in expanded_offers[need_key] if offer.shop not in dominated_shops]
+                if remaining:  # potrzeba nigdy nie zostaje bez ofert
+                    expanded_offers[need_key] = remaining
+        
+        if self.max_offers_per_need:
+            for need_key in need_keys:
+                if len(expanded_offers[need_key]) > self.max_offers_per_need:
+                    expanded_offers[need_key] = expanded_offers[need_key][:self.max_offers_per_need]
+                    self.pruning_lossless = False
+        
+        # Listy ofert są od tej pory tylko czytane - krotki są zwartsze i chronią przed modyfikacją
+        for need_key in need_keys:
+            expanded_offers[need_key] = tuple(expanded_offers[need_key])
+        
+        after = self._search_space_stats(expanded_offers, need_keys)
+        self.stats['preprocessing'] = {
+            'offers_before': before['offers'],
+            'offers_after': after['offers'],
+            'search_space_log10_before': before['log10_space'],
+            'search_space_log10_after': after['log10_space'],
+            'dominated_shops': len(dominated_shops),
+            'lossless': self.pruning_lossless,
+        }
+        self.log(f"   📉 Oferty: {before['offers']:,} → {after['offers']:,}")
+        self.log(f"   📉 Przestrzeń kombinacji: ~10^{before['log10_space']} → ~10^{after['log10_space']}")
         
         return expanded_offers
     
-    def _remove_dominated_offers(self, offers):
-        """Usuwa oferty zdominowane (droższe w tym samym sklepie)"""
+    def _search_space_stats(self, expanded_offers, need_keys):
+        counts = [len(expanded_offers[need_key]) for need_key in need_keys]
+        return {
+            'offers': sum(counts),
+            'log10_space': round(sum(math.log10(count) for count in counts if count), 1),
+        }
+    
+    def _remove_dominated_offers(self, offers, quantity, shop_configs):
+        """
+        Usuwa oferty zdominowane - droższe w tym samym sklepie.
+        Oryginał i zamiennik liczone osobno: zamiennik zostaje tylko gdy jest tańszy
+        od oryginału w tym sklepie (przy równej cenie wygrywa oryginał).
+        Wyjątek: w sklepie z progiem darmowej dostawy droższa oferta może przekroczyć
+        próg - zostaje, gdy dopłata do najtańszej w sklepie jest mniejsza niż koszt
+        dostawy (jak w _threshold_offers_per_shop; jedna oferta na cenę).
+        Kolejność (po cenie) zostaje zachowana.
+        """
+        cheapest = {}
+        for offer in offers:
+            key = (offer.shop, offer.is_substitute)
+            current = cheapest.get(key)
+            if current is None or offer.price_pln < current.price_pln:
+                cheapest[key] = offer
         
-        # Grupuj według sklepu
-        by_shop = {}
+        kept, threshold_prices = [], set()
         for offer in offers:
-            shop_id = offer['shop_id']
-            if shop_id not in by_shop:
-                by_shop[shop_id] = []
-            by_shop[shop_id].append(offer)
-        
-        # Dla każdego sklepu pozostaw tylko najtańszą ofertę
-        filtered_offers = []
-        for shop_id, shop_offers in by_shop.items():
-            best_offer = min(shop_offers, key=lambda x: x['price_pln'])
-            filtered_offers.append(best_offer)
-        
-        return filtered_offers
\ No newline at end of file
+            key = (offer.shop, offer.is_substitute)
+            dominated = cheapest[key] is not offer
+            if not dominated and key[1]:
+                original = cheapest.get((offer.shop, False))
+                dominated = original is not None and original.price_pln <= offer.price_pln
+            if dominated:
+                config = self._shop_config(shop_configs, offer.shop)
+                if not config.get('delivery_free_from') or not config.get('delivery_cost'):
+                    continue
+                shop_cheapest = min(cheapest[shop_key].price_pln for shop_key in ((offer.shop, False), (offer.shop, True))
+                                    if shop_key in cheapest)
+                if (offer.price_pln - shop_cheapest) * quantity >= float(config['delivery_cost']):
+                    continue
+                if (key, offer.price_pln) in threshold_prices:
+                    continue
+                threshold_prices.add((key, offer.price_pln))
+            kept.append(offer)
+        return kept
+    
+    def _find_dominated_shops(self, expanded_offers, need_keys, shop_configs):
+        """
+        Sklep Y jest zdominowany przez X gdy X ma każdą potrzebę Y nie drożej, a przeniesienie
+        całych zakupów z Y do X nie podnosi dostawy: X dostarcza za darmo, albo Y zawsze
+        płaci za dostawę (brak progu) i jego koszt dostawy jest nie mniejszy.
+        """
+        best_price = {}  # shop_id -> {need_key: najtańsza cena}
+        for need_key in need_keys:
+            for offer in expanded_offers[need_key]:
+                prices = best_price.setdefault(offer.shop, {})
+                if need_key not in prices or offer.price_pln < prices[need_key]:
+                    prices[need_key] = offer.price_pln
+        
+        def delivery_terms(shop):
+            config = self._shop_config(shop_configs, shop)
+            cost = float(config.get('delivery_cost', 0)) if config.get('delivery_cost') else 0.0
+            free_from = float(config.get('delivery_free_from')) if config.get('delivery_free_from') else None
+            return cost, free_from
+        
+        dominated = set()
+        shops = sorted(best_price, key=lambda shop: (-len(best_price[shop]), str(shop)))
+        for y in shops:
+            y_cost, y_free_from = delivery_terms(y)
+            for x in shops:
+                if x == y or x in dominated:
+                    continue
+                x_cost, _ = delivery_terms(x)
+                if not (x_cost == 0 or (y_free_from is None and x_cost <= y_cost)):
+                    continue
+                x_prices = best_price[x]
+                # Zdominowany nie dominuje dalej - przy identycznych sklepach zostaje jeden
+                if all(need_key in x_prices and x_prices[need_key] <= price
+                       for need_key, price in best_price[y].items()):
+                    dominated.add(y)
+                    break
+        return dominated
@@ -0,0 +1,315 @@
+"""
+Zadania optymalizacji koszyków w tle
+
+Duże koszyki (próbkowanie + GA + local search) potrafią liczyć się dziesiątki
+sekund - zamiast blokować request Flask'a, optymalizacja idzie do puli procesów
+(CPU-bound, omija GIL). Każde zadanie ma id, postęp na żywo (strategia,
+najlepszy wynik, liczba ocenionych kombinacji) i da się je anulować.
+Wynik ma ten sam kształt co BasketManager.optimize_basket.
+"""
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+
+# Stan procesu roboczego - ustawiany przez _init_worker
+_worker_progress_queue = None
+_worker_cancel_flags = None
+
+# Sygnał końca dla wątku nasłuchującego postępu
+_STOP_LISTENER = None
+
+
+def pool_context():
+    """
+    Kontekst multiprocessing dla pul optymalizacji - spawn, nie domyślny fork:
+    fork wielowątkowego procesu Flask'a kopiuje blokady trzymane przez inne wątki
+    (logging, sync, cache) i proces roboczy potrafi się na nich zakleszczyć.
+    """
+    return multiprocessing.get_context('spawn')
+
+
+def _init_worker(progress_queue, cancel_flags):
+    """Initializer puli - kolejka postępu i flagi anulowania współdzielone z rodzicem"""
+    global _worker_progress_queue, _worker_cancel_flags
+    _worker_progress_queue = progress_queue
+    _worker_cancel_flags = cancel_flags
+
+
+def _run_optimization_job(job_id, slot, basket_id, products_data, prices_data, shop_configs, time_budget_ms=None):
+    """Funkcja wykonywana w procesie roboczym"""
+    from basket_manager import basket_manager
+
+    def report(progress):
+        try:
+            _worker_progress_queue.put_nowait((job_id, 'progress', progress))
+        except Exception:
+            pass  # pełna kolejka - pomiń ten raport
+
+    def should_cancel():
+        return bool(_worker_cancel_flags[slot])
+
+    _worker_progress_queue.put((job_id, 'started', None))
+    return basket_manager.optimize_basket(
+        basket_id, products_data, prices_data, shop_configs,
+        progress_callback=report, cancel_check=should_cancel,
+        default_time_budget_ms=time_budget_ms
+    )
+
+
+class OptimizationJobManager:
+    """Kolejka zadań optymalizacji oparta o pulę procesów"""
+
+    def __init__(self, max_workers=None, max_jobs=64, job_ttl_seconds=3600):
+        self.max_workers = max_workers or max(1, min(4, (os.cpu_count() or 2) - 1))
+        self.max_jobs = max_jobs  # jednocześnie aktywnych (kolejka + w trakcie)
+        self.job_ttl_seconds = job_ttl_seconds
+
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._executor = None
+        self._progress_queue = None
+        self._cancel_flags = None
+        self._free_slots = list(range(max_jobs))
+        self._listener = None
+        self.use_processes = True
+
+    # ------------------------------------------------------------------
+    # Pula
+    # ------------------------------------------------------------------
+
+    def _ensure_executor(self):
+        """Leniwie utwórz pulę (procesy, a gdy się nie da - wątki)"""
+        if self._executor is not None:
+            return
+
+        try:
+            context = pool_context()
+            self._progress_queue = context.Queue(maxsize=10000)
+            self._cancel_flags = context.Array('b', self.max_jobs, lock=False)
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers, mp_context=context,
+                initializer=_init_worker, initargs=(self._progress_queue, self._cancel_flags)
+            )
+            self.use_processes = True
+        except (OSError, ImportError, NotImplementedError) as e:
+            print(f"⚠️ Pula procesów niedostępna ({e}) - optymalizacja w wątkach")
+            self._progress_queue = queue.Queue(maxsize=10000)
+            self._cancel_flags = bytearray(self.max_jobs)
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix='optimization-job',
+                initializer=_init_worker, initargs=(self._progress_queue, self._cancel_flags)
+            )
+            self.use_processes = False
+
+        self._listener = threading.Thread(target=self._listen_progress, daemon=True,
+                                          name='optimization-job-progress')
+        self._listener.start()
+
+    def _listen_progress(self):
+        """Wątek przenoszący raporty z procesów roboczych do rekordów zadań"""
+        progress_queue = self._progress_queue
+        while True:
+            try:
+                item = progress_queue.get()
+            except (EOFError, OSError):
+                return
+            except Exception:
+                continue
+            if item is _STOP_LISTENER:
+                return
+            try:
+                job_id, kind, payload = item
+            except (TypeError, ValueError):
+                continue
+
+            with self._changed:
+                job = self._jobs.get(job_id)
+                if not job or job['status'] in ('completed', 'failed', 'cancelled'):
+                    continue
+                if kind == 'started':
+                    job['status'] = 'running'
+                    job['started_at'] = datetime.now().isoformat()
+                elif kind == 'progress':
+                    job['progress'].update(payload or {})
+                job['version'] += 1
+                self._changed.notify_all()
+
+    # ------------------------------------------------------------------
+    # API
+    # ------------------------------------------------------------------
+
+    def submit(self, basket_id, products_data, prices_data, shop_configs, time_budget_ms=None):
+        """
+        Zleć optymalizację koszyka
+
+        time_budget_ms - budżet czasu gdy koszyk nie ma własnego (zadania w tle mogą liczyć dłużej)
+
+        Returns:
+            dict: {'success': True, 'job_id': ...} lub {'success': False, 'error': ...}
+        """
+        with self._changed:
+            self._ensure_executor()
+            self._cleanup_finished()
+
+            if not self._free_slots:
+                return {'success': False, 'error': 'Za dużo zadań optymalizacji w kolejce - spróbuj za chwilę'}
+
+            job_id = uuid.uuid4().hex
+            slot = self._free_slots.pop()
+            self._cancel_flags[slot] = 0
+            job = {
+                'job_id': job_id,
+                'basket_id': basket_id,
+                'status': 'queued',
+                'progress': {},
+                'created_at': datetime.now().isoformat(),
+                'started_at': None,
+                'finished_at': None,
+                'result': None,
+                'error': None,
+                'version': 0,
+                '_slot': slot,
+                '_finished': None,
+                '_future': None,
+            }
+            self._jobs[job_id] = job
+
+        try:
+            future = self._executor.submit(
+                _run_optimization_job, job_id, slot, basket_id, products_data, prices_data, shop_configs,
+                time_budget_ms
+            )
+        except Exception as e:
+            self._finish(job_id, status='failed', error=f'Nie można uruchomić zadania: {str(e)}')
+            return {'success': False, 'error': str(e)}
+
+        with self._lock:
+            job['_future'] = future
+        future.add_done_callback(lambda f: self._on_done(job_id, f))
+        return {'success': True, 'job_id': job_id}
+
+    def _on_done(self, job_id, future):
+        if future.cancelled():
+            self._finish(job_id, status='cancelled')
+            return
+
+        error = future.exception()
+        if error is not None:
+            self._finish(job_id, status='failed', error=str(error))
+            return
+
+        result = future.result()
+        from optimization_engine import record_optimization_metrics
+        record_optimization_metrics(result)  # wynik z procesu roboczego - metryki w tym procesie
+        if result.get('error_type') == 'cancelled':
+            self._finish(job_id, status='cancelled', result=result)
+        elif result.get('success'):
+            self._finish(job_id, status='completed', result=result)
+        else:
+            self._finish(job_id, status='failed', result=result, error=result.get('error'))
+
+    def _finish(self, job_id, status, result=None, error=None):
+        with self._changed:
+            job = self._jobs.get(job_id)
+            if not job or job['_finished'] is not None:
+                return
+            job['status'] = status
+            job['result'] = result
+            job['error'] = error
+            job['finished_at'] = datetime.now().isoformat()
+            job['_finished'] = time.monotonic()
+            job['version'] += 1
+            self._free_slots.append(job['_slot'])
+            self._changed.notify_all()
+
+    def _cleanup_finished(self):
+        """Usuń stare zakończone zadania (wołane pod blokadą)"""
+        now = time.monotonic()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job['_finished'] is not None and now - job['_finished'] > self.job_ttl_seconds]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def cancel(self, job_id):
+        """Anuluj zadanie - z kolejki od razu, w trakcie przy najbliższym punkcie kontrolnym silnika"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job:
+                return {'success': False, 'error': 'Zadanie nie istnieje'}
+            if job['_finished'] is not None:
+                return {'success': False, 'error': f'Zadanie już zakończone ({job["status"]})'}
+            self._cancel_flags[job['_slot']] = 1
+            future = job['_future']
+
+        if future is not None and future.cancel():
+            self._finish(job_id, status='cancelled')
+        return {'success': True, 'job_id': job_id}
+
+    def get_job(self, job_id, include_result=True):
+        """Publiczny widok zadania (bez pól wewnętrznych) albo None"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job:
+                return None
+            return self._public_view(job, include_result)
+
+    def _public_view(self, job, include_result):
+        view = {key: value for key, value in job.items() if not key.startswith('_') and key != 'result'}
+        view['progress'] = dict(job['progress'])
+        view['done'] = job['_finished'] is not None
+        if include_result:
+            view['result'] = job['result']
+        return view
+
+    def wait_for_update(self, job_id, last_version, timeout=15.0):
+        """
+        Czekaj aż zadanie się zmieni (dla SSE)
+
+        Returns:
+            dict|None: widok zadania (bez wyniku) - None gdy zadanie nie istnieje
+        """
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            while True:
+                job = self._jobs.get(job_id)
+                if not job:
+                    return None
+                remaining = deadline - time.monotonic()
+                if job['version'] != last_version or remaining <= 0:
+                    return self._public_view(job, include_result=False)
+                self._changed.wait(remaining)
+
+    def list_jobs(self, basket_id=None):
+        with self._lock:
+            return [self._public_view(job, include_result=False) for job in self._jobs.values()
+                    if basket_id is None or job['basket_id'] == basket_id]
+
+    def shutdown(self):
+        """Anuluj zadania, zamknij pulę i zatrzymaj wątek nasłuchujący postępu"""
+        if self._executor is None:
+            return
+        with self._lock:
+            for job in self._jobs.values():
+                if job['_finished'] is None:
+                    self._cancel_flags[job['_slot']] = 1
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+
+        try:
+            self._progress_queue.put(_STOP_LISTENER, timeout=1.0)
+        except Exception:
+            pass  # kolejka zamknięta / pełna - wątek i tak jest daemon
+        if self._listener is not None:
+            self._listener.join(timeout=2.0)
+            self._listener = None
+        self._progress_queue = None
+
+
+# Singleton instance
+optimization_jobs = OptimizationJobManager()
@@ -0,0 +1,470 @@
+"""
+Równoległe przeszukiwanie dla dużych koszyków - próbkowanie, GA wyspowy i local search
+
+Oferty są kompaktowane do płaskich tablic (koszt pozycji, kod sklepu, waga
+losowania), serializowane raz na uruchomienie i rozpakowywane w procesie
+roboczym tylko przy pierwszym zadaniu danego uruchomienia.
+Zadania przesyłają tylko krotki indeksów ofert, nie słowniki.
+Każde zadanie ma własny strumień random.Random z ziarnem od rodzica,
+więc wynik jest powtarzalny dla danego random_seed i liczby workerów.
+Pula procesów jest jedna na proces i żyje między optymalizacjami; anulowanie
+trafia do zadań przez współdzieloną tablicę flag (slot na uruchomienie).
+"""
+import atexit
+import itertools
+import math
+import pickle
+import random
+import threading
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+MAX_CONCURRENT_RUNS = 32  # sloty flag anulowania w jednej puli
+
+
+class CompactProblem:
+    """Problem w postaci tablic - oferta to indeks w ramach potrzeby"""
+
+    def __init__(self, expanded_offers, need_keys, grouped_needs, shop_configs, shop_ids, max_shops, priority):
+        self.max_shops = max_shops
+        self.priority = priority
+        self.offsets = array('i', [0])
+        self.offer_shop = array('i')
+        self.offer_cost = array('d')     # cena jednostkowa * ilość potrzeby
+        self.offer_weight = array('d')   # waga losowania - tańsze częściej
+
+        # Offer.shop to już kod sklepu z silnika - shop_ids[kod] -> shop_id
+        for need_key in need_keys:
+            need = grouped_needs[int(need_key.split('_')[1])]
+            quantity = need['total_quantity'] if need['type'] == 'substitute_group' else need['quantity']
+            for offer in expanded_offers[need_key]:
+                self.offer_shop.append(offer.shop)
+                self.offer_cost.append(offer.price_pln * quantity)
+                self.offer_weight.append(1 / max(0.01, offer.price_pln))
+            self.offsets.append(len(self.offer_shop))
+
+        # Dostawa - ta sama semantyka co _calculate_combination_result (0 = brak progu)
+        self.shop_delivery = array('d', [0.0] * len(shop_ids))
+        self.shop_free_from = array('d', [0.0] * len(shop_ids))
+        for code, shop_id in enumerate(shop_ids):
+            config = shop_configs.get(shop_id, {})
+            self.shop_delivery[code] = float(config.get('delivery_cost', 0)) if config.get('delivery_cost') else 0.0
+            self.shop_free_from[code] = float(config.get('delivery_free_from')) if config.get('delivery_free_from') else 0.0
+
+        self.needs_count = len(need_keys)
+        self.shops_count = len(shop_ids)
+
+    def offer_range(self, need_idx):
+        return range(self.offsets[need_idx], self.offsets[need_idx + 1])
+
+    def shops_of(self, choice):
+        offsets, offer_shop = self.offsets, self.offer_shop
+        return {offer_shop[offsets[i] + c] for i, c in enumerate(choice)}
+
+    def evaluate(self, choice):
+        """(wynik wg priorytetu, koszt całkowity, liczba sklepów) - jak _calculate_priority_score"""
+        offsets, offer_shop, offer_cost = self.offsets, self.offer_shop, self.offer_cost
+        subtotals = {}
+        for i, c in enumerate(choice):
+            j = offsets[i] + c
+            shop = offer_shop[j]
+            subtotals[shop] = subtotals.get(shop, 0.0) + offer_cost[j]
+
+        total = 0.0
+        for shop, subtotal in subtotals.items():
+            total += subtotal
+            free_from = self.shop_free_from[shop]
+            if not (free_from and subtotal >= free_from):
+                total += self.shop_delivery[shop]
+
+        shops = len(subtotals)
+        if self.priority == 'fewest_shops':
+            score = shops * 1000 + total
+        elif self.priority == 'balanced':
+            score = total + (shops - 1) * 15
+        else:
+            score = total
+        return score, total, shops
+
+    def cheapest_in_shops(self, need_idx, allowed_shops):
+        """Indeks najtańszej oferty potrzeby w dozwolonych sklepach (None gdy brak)"""
+        best, best_cost = None, None
+        base = self.offsets[need_idx]
+        for j in self.offer_range(need_idx):
+            if self.offer_shop[j] in allowed_shops and (best_cost is None or self.offer_cost[j] < best_cost):
+                best, best_cost = j - base, self.offer_cost[j]
+        return best
+
+
+# ----------------------------------------------------------------------
+# Procesy robocze
+# ----------------------------------------------------------------------
+
+_problem = None
+_problem_token = None
+_cum_weights = None
+_cancel_flags = None
+_cancel_slot = None
+
+
+def _init_worker(cancel_flags):
+    """Initializer puli - flagi anulowania współdzielone z rodzicem"""
+    global _cancel_flags
+    _cancel_flags = cancel_flags
+
+
+def _use_problem(problem_ref, slot):
+    """Ustaw problem zadania - rozpakuj tylko gdy to nowe uruchomienie"""
+    global _problem, _problem_token, _cum_weights, _cancel_slot
+    _cancel_slot = slot
+    token, payload = problem_ref
+    if token == _problem_token:
+        return
+    problem = pickle.loads(payload)
+    cum_weights = []
+    for need_idx in range(problem.needs_count):
+        total, cumulative = 0.0, []
+        for j in problem.offer_range(need_idx):
+            total += problem.offer_weight[j]
+            cumulative.append(total)
+        cum_weights.append(cumulative)
+    _problem, _problem_token, _cum_weights = problem, token, cum_weights
+
+
+def _deadline(time_limit):
+    return time.monotonic() + time_limit if time_limit is not None else None
+
+
+def _expired(deadline):
+    """Koniec czasu albo rodzic anulował uruchomienie"""
+    if _cancel_slot is not None and _cancel_flags is not None and _cancel_flags[_cancel_slot]:
+        return True
+    return deadline is not None and time.monotonic() >= deadline
+
+
+def _random_choice(rng):
+    """Ważone losowanie oferty dla każdej potrzeby (bez pilnowania limitu)"""
+    return tuple(
+        rng.choices(range(len(cumulative)), cum_weights=cumulative)[0]
+        for cumulative in _cum_weights
+    )
+
+
+def _repair(choice, rng):
+    """Zostaw max_shops najczęściej używanych sklepów, resztę przenieś do najtańszych w nich ofert"""
+    problem = _problem
+    usage = {}
+    for i, c in enumerate(choice):
+        shop = problem.offer_shop[problem.offsets[i] + c]
+        usage[shop] = usage.get(shop, 0) + 1
+    if len(usage) <= problem.max_shops:
+        return choice
+
+    # Remisy losowo - inaczej każda naprawa ciągnie do tych samych sklepów
+    keep = set(sorted(usage, key=lambda shop: (usage[shop], rng.random()), reverse=True)[:problem.max_shops])
+    repaired = list(choice)
+    for i, c in enumerate(choice):
+        if problem.offer_shop[problem.offsets[i] + c] not in keep:
+            alternative = problem.cheapest_in_shops(i, keep)
+            if alternative is None:
+                return None
+            repaired[i] = alternative
+    return tuple(repaired)
+
+
+def _random_feasible(rng, attempts=20):
+    for _ in range(attempts):
+        choice = _repair(_random_choice(rng), rng)
+        if choice is not None:
+            return choice
+    return None
+
+
+def _sample_task(problem_ref, slot, seed, samples, time_limit):
+    """Ważone próbkowanie - zwraca najlepszą kombinację w limicie sklepów"""
+    _use_problem(problem_ref, slot)
+    rng = random.Random(seed)
+    deadline = _deadline(time_limit)
+    best = None
+    evaluated = within_limit = 0
+
+    for n in range(samples):
+        if not n & 255 and _expired(deadline):
+            break
+        choice = _random_choice(rng)
+        evaluated += 1
+        if len(_problem.shops_of(choice)) > _problem.max_shops:
+            choice = _repair(choice, rng)  # zamiast odrzucać - przenieś do najczęstszych sklepów
+            if choice is None:
+                continue
+        else:
+            within_limit += 1
+        score = _problem.evaluate(choice)[0]
+        if best is None or score < best[0]:
+            best = (score, choice)
+
+    return {'best': best, 'evaluated': evaluated, 'within_limit': within_limit}
+
+
+def _evolve_task(problem_ref, slot, seed, population, population_size, generations, mutation_rate, time_limit):
+    """Kilka pokoleń GA jednej wyspy - populacja wraca do rodzica na migrację"""
+    _use_problem(problem_ref, slot)
+    rng = random.Random(seed)
+    deadline = _deadline(time_limit)
+    evaluated = 0
+
+    population = [choice for choice in population if choice is not None]
+    while len(population) < population_size:
+        choice = _random_feasible(rng)
+        if choice is None:
+            break
+        population.append(choice)
+    if not population:
+        return {'population': [], 'best': None, 'evaluated': 0}
+
+    scores = {}
+
+    def score_of(choice):
+        nonlocal evaluated
+        score = scores.get(choice)
+        if score is None:
+            score = scores[choice] = _problem.evaluate(choice)[0]
+            evaluated += 1
+        return score
+
+    for _ in range(generations):
+        population.sort(key=score_of)
+        if _expired(deadline):
+            break
+
+        elite = population[:max(1, population_size // 2)]
+        parents = population[:max(1, population_size // 4)]
+        next_population = list(elite)
+        while len(next_population) < population_size:
+            parent1, parent2 = rng.choice(parents), rng.choice(parents)
+            child = tuple(a if rng.random() < 0.5 else b for a, b in zip(parent1, parent2))
+            if rng.random() < mutation_rate:
+                point = rng.randrange(len(child))
+                size = _problem.offsets[point + 1] - _problem.offsets[point]
+                child = child[:point] + (rng.randrange(size),) + child[point + 1:]
+            child = _repair(child, rng)
+            next_population.append(child if child is not None else rng.choice(population))
+        population = next_population
+
+    population.sort(key=score_of)
+    return {'population': population, 'best': (score_of(population[0]), population[0]), 'evaluated': evaluated}
+
+
+def _local_search_task(problem_ref, slot, seed, start, max_iterations, time_limit):
+    """Hill climbing (zmiana jednej oferty) z punktu startowego lub losowego"""
+    _use_problem(problem_ref, slot)
+    rng = random.Random(seed)
+    deadline = _deadline(time_limit)
+    problem = _problem
+
+    current = start if start is not None else _random_feasible(rng)
+    if current is None:
+        return {'best': None, 'evaluated': 0}
+    current_score = problem.evaluate(current)[0]
+    evaluated = 1
+
+    for _ in range(max_iterations):
+        if _expired(deadline):
+            break
+        shops = problem.shops_of(current)
+        best_neighbor, best_score = None, current_score
+
+        for i in rng.sample(range(problem.needs_count), problem.needs_count):
+            base = problem.offsets[i]
+            for j in problem.offer_range(i):
+                c = j - base
+                if c == current[i]:
+                    continue
+                if problem.offer_shop[j] not in shops and len(shops) >= problem.max_shops:
+                    # Nowy sklep tylko gdy zamiana zwalnia stary
+                    neighbor = current[:i] + (c,) + current[i + 1:]
+                    if len(problem.shops_of(neighbor)) > problem.max_shops:
+                        continue
+                else:
+                    neighbor = current[:i] + (c,) + current[i + 1:]
+                score = problem.evaluate(neighbor)[0]
+                evaluated += 1
+                if score < best_score:
+                    best_neighbor, best_score = neighbor, score
+
+        if best_neighbor is None:
+            break  # optimum lokalne
+        current, current_score = best_neighbor, best_score
+
+    return {'best': (current_score, current), 'evaluated': evaluated}
+
+
+# ----------------------------------------------------------------------
+# Pula procesów (proces rodzica) - jedna na proces, współdzielona przez optymalizacje
+# ----------------------------------------------------------------------
+
+_pool = None
+_pool_workers = 0
+_pool_flags = None
+_pool_free_slots = []
+_pool_lock = threading.Lock()
+_run_tokens = itertools.count(1)
+
+
+def _acquire_pool(workers):
+    """
+    (pula, flagi, slot) dla jednego uruchomienia - pula tworzona przy pierwszym użyciu
+    i podmieniana tylko gdy potrzeba więcej procesów (stara kończy swoje zadania)
+    """
+    global _pool, _pool_workers, _pool_flags, _pool_free_slots
+    with _pool_lock:
+        if _pool is None or _pool_workers < workers:
+            from optimization_jobs import pool_context
+            context = pool_context()
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool_flags = context.Array('b', MAX_CONCURRENT_RUNS, lock=False)
+            _pool_free_slots = list(range(MAX_CONCURRENT_RUNS))
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                        initializer=_init_worker, initargs=(_pool_flags,))
+            _pool_workers = workers
+        slot = _pool_free_slots.pop() if _pool_free_slots else None
+        if slot is not None:
+            _pool_flags[slot] = 0
+        return _pool, _pool_flags, slot
+
+
+def _release_slot(pool, slot):
+    with _pool_lock:
+        if slot is not None and pool is _pool:
+            _pool_free_slots.append(slot)
+
+
+def _discard_pool(pool):
+    """Zepsuta pula (proces roboczy padł) - następne uruchomienie utworzy nową"""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if pool is _pool:
+            _pool, _pool_workers = None, 0
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_pool():
+    """Zamknij współdzieloną pulę (przy wyjściu z procesu)"""
+    global _pool, _pool_workers
+    with _pool_lock:
+        pool, _pool, _pool_workers = _pool, None, 0
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+atexit.register(shutdown_pool)
+
+
+# ----------------------------------------------------------------------
+# Koordynacja (proces rodzica)
+# ----------------------------------------------------------------------
+
+def parallel_search(problem, workers, seed, time_limit=None, checkpoint=None, on_improvement=None,
+                    samples=200000, population_size=100, generations=50, migration_interval=10,
+                    migrants=5, local_search_starts=None, max_iterations=1000):
+    """
+    Próbkowanie -> GA wyspowy z migracją w pierścieniu -> multi-start local search
+
+    Args:
+        checkpoint: funkcja() wołana między rundami i w trakcie czekania na zadania
+            (może rzucić wyjątek - ustawia flagę anulowania zadań i przerywa)
+        on_improvement: funkcja(choice, score) przy każdym nowym najlepszym
+
+    Returns:
+        dict: {'best': (score, choice) | None, 'evaluated': int, 'within_limit': int}
+    """
+    rng = random.Random(seed)
+    deadline = _deadline(time_limit)
+    state = {'best': None, 'evaluated': 0, 'within_limit': 0}
+    problem_ref = (next(_run_tokens), pickle.dumps(problem, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def remaining():
+        return max(0.0, deadline - time.monotonic()) if deadline is not None else None
+
+    def absorb(result):
+        state['evaluated'] += result.get('evaluated', 0)
+        state['within_limit'] += result.get('within_limit', 0)
+        best = result.get('best')
+        if best and (state['best'] is None or best[0] < state['best'][0]):
+            state['best'] = best
+            if on_improvement:
+                on_improvement(best[1], best[0])
+
+    def step():
+        if checkpoint:
+            checkpoint()
+        return not _expired(deadline)
+
+    pool, flags, slot = _acquire_pool(workers)
+    submitted = []
+
+    def submit(task, *args):
+        future = pool.submit(task, problem_ref, slot, *args)
+        submitted.append(future)
+        return future
+
+    def gather(futures):
+        # Czekaj na rundę, ale co chwilę sprawdzaj anulowanie w rodzicu
+        pending = set(futures)
+        while pending:
+            _, pending = wait(pending, timeout=0.1)
+            if pending and checkpoint:
+                checkpoint()
+        return [future.result() for future in futures]
+
+    try:
+        # 1. Próbkowanie - każdy worker swoją część, własne ziarno
+        per_worker = max(1, samples // workers)
+        for result in gather([submit(_sample_task, rng.getrandbits(63), per_worker, remaining())
+                              for _ in range(workers)]):
+            absorb(result)
+
+        # 2. GA wyspowy - co migration_interval pokoleń najlepsi przechodzą na sąsiednią wyspę
+        islands = [[] for _ in range(workers)]
+        if state['best']:
+            islands[0].append(state['best'][1])
+        for _ in range(math.ceil(generations / migration_interval)):
+            if not step():
+                break
+            results = gather([submit(_evolve_task, rng.getrandbits(63), island, population_size,
+                                     migration_interval, 0.1, remaining())
+                              for island in islands])
+            for result in results:
+                absorb(result)
+            islands = [result['population'] for result in results]
+            if workers > 1:
+                emigrants = [island[:migrants] for island in islands]
+                for i, island in enumerate(islands):
+                    if island:
+                        island[-migrants:] = emigrants[(i - 1) % workers]
+
+        # 3. Multi-start local search - od najlepszych z wysp i z losowych punktów
+        if step():
+            starts = [island[0] for island in islands if island]
+            starts += [None] * max(0, (local_search_starts or workers) - len(starts))
+            for result in gather([submit(_local_search_task, rng.getrandbits(63), start, max_iterations,
+                                         remaining())
+                                  for start in starts]):
+                absorb(result)
+    except BrokenProcessPool:
+        _discard_pool(pool)
+        raise
+    except BaseException:
+        # Anulowanie / błąd - zadania tego uruchomienia kończą się przy najbliższym sprawdzeniu flagi
+        if slot is not None:
+            flags[slot] = 1
+            for future in submitted:
+                future.cancel()
+            wait(submitted, timeout=5.0)
+        raise
+    finally:
+        _release_slot(pool, slot)
+    return state
@@ -0,0 +1,379 @@
+"""
+Ponowna optymalizacja tylko tych koszyków, których dotyczą zmiany cen
+
+Po odświeżeniu cen nie trzeba liczyć od nowa każdego koszyka:
+- indeks odwrotny: produkt -> koszyki (także przez grupy zamienników)
+  i (produkt, sklep) -> koszyki, których zapisany plan kupuje tę ofertę
+- kanał zmian z save_price: zmiana ceny oferty (stara, nowa) - ta sama cena
+  zapisana ponownie (typowe przy odświeżaniu) jest pomijana od razu
+- przed pełnym przeliczeniem test ograniczeń na zapisanym planie (basket['last_plan']):
+  * zmiana oferty z planu - plan nieaktualny, liczymy od nowa
+  * nowa oferta (sklep bez ceny wcześniej) - liczymy od nowa
+  * podwyżka oferty spoza planu - plan dalej najlepszy, pomijamy
+  * obniżka oferty spoza planu - dolne ograniczenie kosztu każdego planu z tą
+    ofertą (najtańsze ceny potrzeb bez dostawy); gdy nie schodzi poniżej kosztu
+    zapisanego planu - pomijamy
+Koszyki do przeliczenia idą przez optimization_batch (wspólne dane, jeden zapis).
+Zmiany koszyków, których nie udało się przeliczyć (błąd partii albo koszyka), wracają
+do kolejki - do MAX_REFRESH_ATTEMPTS prób.
+"""
+import threading
+import time
+
+from optimization_engine import normalize_prices
+
+PLAN_COST_EPSILON = 0.005
+MAX_REFRESH_ATTEMPTS = 3
+
+
+def basket_signature(basket):
+    """Pozycje koszyka (produkt, ilość) - plan jest ważny tylko dla tych samych pozycji"""
+    return sorted(
+        [item['product_id'], item.get('requested_quantity', 1)]
+        for item in basket.get('basket_items', {}).values()
+    )
+
+
+def compact_plan(result, basket, settings):
+    """Zwięzły zapis najlepszej opcji do koszyka - wystarczy do testów ograniczeń"""
+    best_option = result['best_option']
+    return {
+        'total_cost': round(best_option['total_cost'], 2),
+        'priority': settings.get('priority', 'lowest_total_cost'),
+        'allow_substitutes': settings.get('substitute_settings', {}).get('allow_substitutes', True),
+        'items_signature': basket_signature(basket),
+        'offers': sorted({
+            (item['actual_product_id'], item['shop_id'], round(item['unit_price_pln'], 2), bool(item.get('is_substitute')))
+            for item in best_option.get('items_list', [])
+        }),
+        'missing_products': sorted(p.get('product_id') for p in best_option.get('products_to_complete', [])
+                                   if isinstance(p, dict) and p.get('product_id') is not None),
+        'optimized_at': result.get('optimized_at'),
+    }
+
+
+def _price_pln(price_data):
+    normalized = normalize_prices({'price': price_data})
+    return normalized['price']['price_pln'] if normalized else None
+
+
+class BasketPriceIndex:
+    """Indeks odwrotny cen -> koszyki, budowany z koszyków i ich zapisanych planów"""
+
+    def __init__(self):
+        self.product_baskets = {}   # product_id -> {basket_id}
+        self.offer_baskets = {}     # (product_id, shop_id) -> {basket_id} - oferty z zapisanych planów
+        self.needs = {}             # basket_id -> [(ilość, frozenset produktów)]
+
+    def rebuild(self, baskets, substitute_groups):
+        self.product_baskets, self.offer_baskets, self.needs = {}, {}, {}
+        group_of_product = {}
+        for group in substitute_groups.values():
+            for product_id in group.get('product_ids', []):
+                group_of_product.setdefault(product_id, group)
+
+        for basket_id, basket in baskets.items():
+            plan = basket.get('last_plan') or {}
+            allow_substitutes = plan.get('allow_substitutes', True)
+
+            # potrzeby jak w silniku: produkty z jednej grupy łączą ilości
+            needs = {}
+            for item in basket.get('basket_items', {}).values():
+                product_id = item['product_id']
+                group = group_of_product.get(product_id) if allow_substitutes else None
+                key = group['group_id'] if group else product_id
+                members = frozenset(group['product_ids']) if group else frozenset([product_id])
+                quantity, _ = needs.get(key, (0, members))
+                needs[key] = (quantity + item.get('requested_quantity', 1), members)
+            self.needs[basket_id] = list(needs.values())
+
+            for _, members in needs.values():
+                for product_id in members:
+                    self.product_baskets.setdefault(product_id, set()).add(basket_id)
+            for product_id, shop_id, _, _ in plan.get('offers', []):
+                self.offer_baskets.setdefault((product_id, shop_id), set()).add(basket_id)
+
+    def affected_baskets(self, changes):
+        """basket_id -> lista zmian ((product_id, shop_id), stara, nowa) dotyczących koszyka"""
+        affected = {}
+        for offer, (old_price, new_price) in changes.items():
+            baskets = self.product_baskets.get(offer[0], set()) | self.offer_baskets.get(offer, set())
+            for basket_id in baskets:
+                affected.setdefault(basket_id, []).append((offer, old_price, new_price))
+        return affected
+
+    def cost_lower_bound(self, basket_id, product_prices, forced_product=None, forced_price=None):
+        """
+        Dolne ograniczenie kosztu planu (bez dostawy i limitu sklepów):
+        każda potrzeba po najtańszej cenie spośród swoich produktów.
+        forced_product - potrzeba z tym produktem kupiona po forced_price.
+        None gdy któraś potrzeba nie ma żadnej ceny.
+        """
+        bound = 0.0
+        for quantity, members in self.needs.get(basket_id, []):
+            if forced_product in members:
+                bound += forced_price * quantity
+                continue
+            prices = [price for product_id in members for price in product_prices.get(product_id, {}).values()]
+            if not prices:
+                return None
+            bound += min(prices) * quantity
+        return bound
+
+
+class OptimizationRefreshScheduler:
+    """Kanał zmian cen (listener save_price) + przeliczanie dotkniętych koszyków"""
+
+    def __init__(self, interval_seconds=60, quiet_seconds=30):
+        self.interval_seconds = interval_seconds
+        self.quiet_seconds = quiet_seconds  # odświeżanie cen zapisuje serię - czekamy aż ucichnie
+        self.index = BasketPriceIndex()
+        self._lock = threading.Lock()
+        self._product_prices = None  # product_id -> {shop_id: cena PLN}; None = kanał nieaktywny
+        self._pending = {}           # (product_id, shop_id) -> (cena przed pierwszą zmianą, nowa cena)
+        self._attempts = {}          # (product_id, shop_id) -> nieudane przeliczenia zmiany
+        self._last_change = 0.0
+        self._thread = None
+        self._stop = threading.Event()
+        self.stats = {'prices_seen': 0, 'prices_unchanged': 0, 'refreshes': 0, 'baskets_checked': 0,
+                      'baskets_reoptimized': 0, 'baskets_skipped': 0, 'changes_requeued': 0,
+                      'changes_dropped': 0}
+        self.last_refresh = None
+
+    # ------------------------------------------------------------------
+    # Kanał zmian
+    # ------------------------------------------------------------------
+
+    def activate(self, latest_prices=None):
+        """Zapamiętaj bieżące ceny jako punkt odniesienia i zacznij zbierać zmiany"""
+        if latest_prices is None:
+            from utils.data_utils import get_latest_prices
+            latest_prices = get_latest_prices()
+        product_prices = {}
+        for price_data in normalize_prices(latest_prices).values():
+            product_prices.setdefault(price_data['product_id'], {})[price_data['shop_id']] = price_data['price_pln']
+        with self._lock:
+            self._product_prices = product_prices
+            self._pending.clear()
+            self._attempts.clear()
+
+        from utils.data_utils import add_price_listener
+        add_price_listener(self.on_price_saved)
+
+    def on_price_saved(self, price_data):
+        """Listener save_price"""
+        if self._product_prices is None or not isinstance(price_data, dict):
+            return
+        new_price = _price_pln(price_data)
+        if new_price is None:
+            return
+
+        offer = (price_data.get('product_id'), price_data.get('shop_id'))
+        with self._lock:
+            self.stats['prices_seen'] += 1
+            shop_prices = self._product_prices.setdefault(offer[0], {})
+            old_price = shop_prices.get(offer[1])
+            shop_prices[offer[1]] = new_price
+            if old_price is not None and abs(old_price - new_price) < PLAN_COST_EPSILON:
+                self.stats['prices_unchanged'] += 1
+                return
+            first_old = self._pending[offer][0] if offer in self._pending else old_price
+            if first_old is not None and abs(first_old - new_price) < PLAN_COST_EPSILON:
+                self._pending.pop(offer, None)  # cena wróciła do wartości sprzed zmian
+                return
+            self._pending[offer] = (first_old, new_price)
+            self._last_change = time.monotonic()
+
+    def pending_changes(self):
+        with self._lock:
+            return len(self._pending)
+
+    def _requeue(self, changes):
+        """
+        Zmiany, których przeliczenie się nie udało, z powrotem do kolejki. Zmiana tej samej
+        oferty zebrana w trakcie przeliczania łączy się z nimi (stara cena sprzed pierwszej zmiany).
+        Po MAX_REFRESH_ATTEMPTS nieudanych próbach zmiana jest porzucana.
+        """
+        dropped = 0
+        with self._lock:
+            for offer, (first_old, new_price) in changes.items():
+                attempts = self._attempts.get(offer, 0) + 1
+                if attempts >= MAX_REFRESH_ATTEMPTS:
+                    self._attempts.pop(offer, None)
+                    dropped += 1
+                    continue
+                self._attempts[offer] = attempts
+                if offer in self._pending:
+                    new_price = self._pending[offer][1]
+                    if first_old is not None and abs(first_old - new_price) < PLAN_COST_EPSILON:
+                        self._pending.pop(offer)
+                        continue
+                self._pending[offer] = (first_old, new_price)
+            self.stats['changes_requeued'] += len(changes) - dropped
+            self.stats['changes_dropped'] += dropped
+        if dropped:
+            print(f"⚠️ Porzucono {dropped} zmian cen po {MAX_REFRESH_ATTEMPTS} nieudanych przeliczeniach")
+
+    # ------------------------------------------------------------------
+    # Testy ograniczeń
+    # ------------------------------------------------------------------
+
+    def _reoptimize_reason(self, basket_id, basket, changes, product_prices):
+        """Powód ponownej optymalizacji albo None gdy zapisany plan na pewno dalej najlepszy"""
+        plan = basket.get('last_plan')
+        if not plan:
+            return 'brak zapisanego planu'
+        if plan.get('items_signature') != basket_signature(basket):
+            return 'pozycje koszyka zmienione od ostatniej optymalizacji'
+
+        used_offers = {(product_id, shop_id): is_substitute for product_id, shop_id, _, is_substitute in plan['offers']}
+        missing = set(plan.get('missing_products', []))
+        for (product_id, shop_id), old_price, new_price in changes:
+            if (product_id, shop_id) in used_offers:
+                return f'zmiana ceny oferty z planu ({product_id} @ {shop_id})'
+            if old_price is None:
+                return f'nowa oferta ({product_id} @ {shop_id})'
+            if product_id in missing:
+                return f'cena produktu bez ofert w planie ({product_id})'
+            if new_price >= old_price:
+                continue  # podwyżka oferty spoza planu - plan się nie zmienia, inne plany nie tanieją
+            if plan.get('priority', 'lowest_total_cost') != 'lowest_total_cost':
+                return f'obniżka ceny przy priorytecie {plan.get("priority")}'
+            # limit wzrostu ceny zamiennika liczony jest od najtańszego oryginału - obniżka może go wykluczyć
+            need_members = next((members for _, members in self.index.needs.get(basket_id, [])
+                                 if product_id in members), frozenset())
+            if any(is_substitute and pid in need_members for (pid, _), is_substitute in used_offers.items()):
+                return f'obniżka przy zamienniku w planie ({product_id})'
+
+            bound = self.index.cost_lower_bound(basket_id, product_prices, product_id, new_price)
+            if bound is None or bound < plan['total_cost'] - PLAN_COST_EPSILON:
+                return f'obniżka może pobić plan ({product_id} @ {shop_id}: {old_price:.2f} -> {new_price:.2f})'
+        return None
+
+    # ------------------------------------------------------------------
+    # Przeliczanie
+    # ------------------------------------------------------------------
+
+    def refresh(self, workers=None, time_budget_ms=None):
+        """
+        Przelicz koszyki dotknięte zebranymi zmianami cen
+
+        Returns:
+            dict: {'success', 'changes', 'checked', 'reoptimized': {basket_id: powód}, 'skipped': [...],
+                  'requeued': zmiany z powrotem w kolejce, 'batch'}
+        """
+        from basket_manager import basket_manager
+        from optimization_batch import optimize_baskets
+        try:
+            from substitute_manager import substitute_manager
+            substitute_groups = substitute_manager.load_substitute_groups()
+        except ImportError:
+            substitute_groups = {}
+
+        with self._lock:
+            changes, self._pending = self._pending, {}
+            product_prices = {product_id: dict(shops) for product_id, shops in (self._product_prices or {}).items()}
+
+        try:
+            baskets = basket_manager.load_baskets()
+            self.index.rebuild(baskets, substitute_groups)
+            affected = self.index.affected_baskets(changes)
+
+            reoptimize, skipped = {}, []
+            for basket_id, basket_changes in affected.items():
+                basket = baskets.get(basket_id)
+                if not basket or not basket.get('basket_items'):
+                    continue
+                reason = self._reoptimize_reason(basket_id, basket, basket_changes, product_prices)
+                if reason:
+                    reoptimize[basket_id] = reason
+                else:
+                    skipped.append(basket_id)
+
+            batch = None
+            if reoptimize:
+                print(f"🔁 Ponowna optymalizacja {len(reoptimize)}/{len(baskets)} koszyków po {len(changes)} zmianach cen")
+                batch = optimize_baskets(list(reoptimize), workers=workers, time_budget_ms=time_budget_ms)
+        except BaseException:
+            # Partia przerwana - żadna zmiana nie została przeliczona
+            self._requeue(changes)
+            raise
+
+        # Koszyki bez nowego wyniku - ich zmiany wracają do kolejki
+        if batch is not None and not batch['success']:
+            failed = set(reoptimize)
+        else:
+            failed = {basket_id for basket_id, result in (batch or {}).get('results', {}).items()
+                      if not result.get('success')}
+        retry = {offer: changes[offer] for basket_id in failed for offer, _, _ in affected[basket_id]}
+        with self._lock:
+            for offer in changes:
+                if offer not in retry:
+                    self._attempts.pop(offer, None)
+        if retry:
+            self._requeue(retry)
+
+        with self._lock:
+            self.stats['refreshes'] += 1
+            self.stats['baskets_checked'] += len(affected)
+            self.stats['baskets_reoptimized'] += len(reoptimize)
+            self.stats['baskets_skipped'] += len(skipped)
+        self.last_refresh = {
+            'at': time.time(),
+            'changes': len(changes),
+            'checked': len(affected),
+            'reoptimized': reoptimize,
+            'skipped': skipped,
+            'requeued': len(retry),
+        }
+        return {
+            'success': batch is None or batch['success'],
+            'changes': len(changes),
+            'checked': len(affected),
+            'reoptimized': reoptimize,
+            'skipped': skipped,
+            'requeued': len(retry),
+            'batch': batch['summary'] if batch and batch.get('success') else batch,
+        }
+
+    # ------------------------------------------------------------------
+    # Wątek w tle
+    # ------------------------------------------------------------------
+
+    def start(self, latest_prices=None):
+        """Aktywuj kanał zmian i uruchom wątek przeliczający po ucichnięciu zmian"""
+        if self._thread is not None:
+            return
+        self.activate(latest_prices)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name='optimization-refresh')
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval_seconds):
+            if not self.pending_changes() or time.monotonic() - self._last_change < self.quiet_seconds:
+                continue
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"⚠️ Błąd ponownej optymalizacji koszyków: {e}")
+
+    def status(self):
+        with self._lock:
+            return {
+                'active': self._product_prices is not None,
+                'running': self._thread is not None,
+                'pending_changes': len(self._pending),
+                'stats': dict(self.stats),
+                'last_refresh': self.last_refresh,
+            }
+
+
+# Singleton instance
+optimization_refresh = OptimizationRefreshScheduler()
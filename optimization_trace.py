@@ -0,0 +1,123 @@
+"""
+Log optymalizacji z poziomami i leniwym formatowaniem
+
+Silnik loguje tysiące komunikatów (każda potrzeba, każda poprawa wyniku).
+Zamiast budować wszystkie stringi od razu:
+- wpis to krotka (czas, poziom, format, argumenty) - tekst powstaje dopiero w lines()
+- DEBUG jest zapisywany tylko przy pełnym logu (show_logs), inaczej odrzucany
+  jednym porównaniem poziomów - bez formatowania
+- bez show_logs log trzyma tylko ostatnie ring_size wpisów (bufor cykliczny) -
+  na wypadek błędu, gdy UI i tak pokazuje log
+- liczniki i czasy kroków potoku trafiają do statystyk wyniku
+"""
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+
+class OptimizationTrace:
+    """Log optymalizacji - wywoływalny jak dawna funkcja log(message)"""
+
+    def __init__(self, capture=False, ring_size=300, echo_prefix=None, sink=None):
+        """
+        Args:
+            capture: pełny log z DEBUG (show_logs) - inaczej bufor cykliczny bez DEBUG
+            ring_size: pojemność bufora gdy capture=False
+            echo_prefix: przy pełnym logu wypisuj wpisy na stdout z tym prefiksem
+            sink: funkcja(message) dostająca każdy zapisany wpis (stary styl log_func)
+        """
+        self.ring_size = ring_size
+        self.echo_prefix = echo_prefix
+        self.sink = sink
+        self.counters = {}
+        self.timers = {}
+        self.recorded = 0
+        self.set_capture(capture)
+
+    @classmethod
+    def wrap(cls, log_func):
+        """Trace dla silnika - przekazany trace albo adapter na zwykłą funkcję log"""
+        if isinstance(log_func, cls):
+            return log_func
+        return cls(capture=True, sink=log_func)
+
+    def set_capture(self, capture):
+        """Przełącz tryb - dotychczasowe wpisy zostają"""
+        self.capture = bool(capture)
+        self.level = DEBUG if self.capture else INFO
+        entries = getattr(self, '_entries', ())
+        self._entries = list(entries) if self.capture else deque(entries, maxlen=self.ring_size)
+
+    def enabled(self, level):
+        return level >= self.level
+
+    def log(self, level, message, *args):
+        if level < self.level:
+            return
+        self._entries.append((time.time(), level, message, args))
+        self.recorded += 1
+        if self.sink is not None or (self.echo_prefix and self.capture):
+            text = message % args if args else message
+            if self.sink is not None:
+                self.sink(text)
+            if self.echo_prefix and self.capture:
+                print(f"{self.echo_prefix}{text}")
+
+    def __call__(self, message, *args):
+        self.log(INFO, message, *args)
+
+    def debug(self, message, *args):
+        if self.level <= DEBUG:
+            self.log(DEBUG, message, *args)
+
+    def info(self, message, *args):
+        self.log(INFO, message, *args)
+
+    def warning(self, message, *args):
+        self.log(WARNING, message, *args)
+
+    def error(self, message, *args):
+        self.log(ERROR, message, *args)
+
+    # ------------------------------------------------------------------
+    # Liczniki i czasy kroków
+    # ------------------------------------------------------------------
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextmanager
+    def timer(self, name):
+        """Sumuje czas bloku pod nazwą (także gdy blok kończy się wyjątkiem)"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timers[name] = self.timers.get(name, 0.0) + time.perf_counter() - started
+
+    # ------------------------------------------------------------------
+    # Odczyt
+    # ------------------------------------------------------------------
+
+    def lines(self):
+        """Wpisy jako "[HH:MM:SS] tekst" - format dawnego optimization_log"""
+        result = []
+        for timestamp, level, message, args in self._entries:
+            text = message % args if args else message
+            result.append(f"[{datetime.fromtimestamp(timestamp).strftime('%H:%M:%S')}] {text}")
+        return result
+
+    def summary(self):
+        return {
+            'counters': dict(self.counters),
+            'timers_ms': {name: round(seconds * 1000, 2) for name, seconds in self.timers.items()},
+            'log_entries': self.recorded,
+            'log_dropped': self.recorded - len(self._entries),
+            'full_log': self.capture,
+        }
@@ -1,6 +1,97 @@
 """
 Moduł optymalizacji ilości dla darmowej dostawy
 """
+import math
+
+
+def find_free_shipping_top_up(items, missing_amount, max_quantity_multiplier):
+    """
+    Najtańsze dokupienie sztuk, które dobija sklep do progu darmowej dostawy
+
+    Ograniczony plecak "minimalny dodatkowy koszt >= brakująca kwota" w groszach,
+    po wszystkich pozycjach sklepu naraz: pozycja może urosnąć najwyżej do
+    quantity * max_quantity_multiplier sztuk. Osiągalne sumy to bitset (int),
+    a limity sztuk są dzielone binarnie (1, 2, 4, ...) - kilka przesunięć liczby
+    na pozycję, ułamki milisekundy nawet dla progów rzędu setek złotych.
+    Grupy zamienników (is_group) są pomijane - jak dotąd.
+
+    Returns:
+        dict | None: {'additions': [(item, dodatkowe sztuki)], 'additional_cost': PLN}
+    """
+    target = math.ceil(round(missing_amount * 100, 6))
+    if target <= 0:
+        return None
+
+    chunks = []  # (indeks pozycji, sztuki, koszt w groszach)
+    for index, item in enumerate(items):
+        if item.get('is_group'):
+            continue
+        price = math.floor(round(item['unit_price_pln'] * 100, 6))  # w dół - dobita suma groszy to na pewno próg
+        bound = int(item['quantity'] * max_quantity_multiplier) - item['quantity']
+        units = 1
+        while price > 0 and bound > 0:
+            take = min(units, bound)
+            chunks.append((index, take, take * price))
+            bound -= take
+            units *= 2
+    if not chunks:
+        return None
+
+    # Optimum jest < target + najdroższa sztuka (inaczej jedną sztukę dałoby się zdjąć),
+    # więc sumy powyżej tej granicy można obcinać
+    limit = target + max(cents // units for _, units, cents in chunks)
+    mask = (1 << limit) - 1
+    reach = 1
+    history = []
+    for _, _, cents in chunks:
+        history.append(reach)
+        reach |= (reach << cents) & mask
+
+    above = reach >> target
+    if not above:
+        return None
+    total = target + (above & -above).bit_length() - 1
+
+    # Odtwórz wybór: suma osiągalna bez kawałka - kawałek nieużyty
+    additions = {}
+    remaining = total
+    for (index, units, cents), before in zip(reversed(chunks), reversed(history)):
+        if (before >> remaining) & 1:
+            continue
+        remaining -= cents
+        additions[index] = additions.get(index, 0) + units
+
+    chosen = [(items[index], units) for index, units in sorted(additions.items())]
+    return {
+        'additions': chosen,
+        'additional_cost': sum(item['unit_price_pln'] * units for item, units in chosen),
+    }
+
+
+def apply_free_shipping_top_up(result, shop_summary, top_up, shipping_cost):
+    """
+    Dokup sztuki z find_free_shipping_top_up i przelicz koszty sklepu i wyniku
+
+    Returns:
+        float: oszczędność (koszt dostawy - dopłata)
+    """
+    real_savings = shipping_cost - top_up['additional_cost']
+    for item, units in top_up['additions']:
+        old_quantity = item['quantity']
+        item['quantity'] = old_quantity + units
+        item['total_price_pln'] = item['unit_price_pln'] * item['quantity']
+        item['quantity_optimized'] = True
+        item['optimization_reason'] = (f"Zwiększono z {old_quantity} do {item['quantity']} dla darmowej dostawy "
+                                       f"(oszczędność: {real_savings:.2f} PLN)")
+
+    shop_summary['subtotal'] += top_up['additional_cost']
+    shop_summary['shipping_cost'] = 0
+
+    result['total_products_cost'] += top_up['additional_cost']
+    result['total_shipping_cost'] -= shipping_cost
+    result['total_cost'] = result['total_products_cost'] + result['total_shipping_cost']
+    return real_savings
+
 
 class QuantityOptimizer:
     """Klasa odpowiedzialna za optymalizację ilości produktów"""
@@ -59,46 +150,28 @@ class QuantityOptimizer:
             self.log(f"      📏 Efektywny próg oszczędności: {effective_threshold:.2f} PLN")
             
             if potential_savings >= effective_threshold:
-                # Znajdź najlepszy produkt do zwiększenia ilości
-                best_optimization = self._find_best_quantity_increase(
-                    shop_summary['items'], missing_amount
+                # Najtańsze dokupienie po wszystkich produktach sklepu (DP po groszach)
+                top_up = find_free_shipping_top_up(
+                    shop_summary['items'], missing_amount, self.max_quantity_multiplier
                 )
                 
-                if best_optimization:
-                    item = best_optimization['item']
-                    old_quantity = item['quantity']
-                    new_quantity = best_optimization['new_quantity']
-                    additional_cost = best_optimization['additional_cost']
+                if top_up:
+                    real_savings = shipping_cost - top_up['additional_cost']
                     
                     # POPRAWKA: Sprawdź czy to rzeczywiście oszczędność
-                    real_savings = shipping_cost - additional_cost
-                    
                     if real_savings > 0:
-                        # Aplikuj optymalizację
-                        item['quantity'] = new_quantity
-                        item['total_price_pln'] = item['unit_price_pln'] * new_quantity
-                        item['quantity_optimized'] = True
-                        item['optimization_reason'] = f"Zwiększono z {old_quantity} do {new_quantity} dla darmowej dostawy (oszczędność: {real_savings:.2f} PLN)"
-                        
-                        # Przelicz koszty sklepu
-                        shop_summary['subtotal'] += additional_cost
-                        shop_summary['shipping_cost'] = 0  # Teraz darmowa dostawa
-                        
-                        # Przelicz koszty całkowite
-                        result['total_products_cost'] += additional_cost
-                        result['total_shipping_cost'] -= shipping_cost
-                        result['total_cost'] = result['total_products_cost'] + result['total_shipping_cost']
-                        
+                        apply_free_shipping_top_up(result, shop_summary, top_up, shipping_cost)
                         total_savings += real_savings
-                        optimizations_count += 1
+                        optimizations_count += len(top_up['additions'])
                         
-                        self.log(f"      ✅ OPTYMALIZACJA: Produkt {item.get('product_name', item['product_id'])}")
-                        self.log(f"         📦 {old_quantity} → {new_quantity} sztuk (+{additional_cost:.2f} PLN)")
-                        self.log(f"         💎 Oszczędności: {real_savings:.2f} PLN")
+                        for item, units in top_up['additions']:
+                            self.log(f"      ✅ OPTYMALIZACJA: Produkt {item.get('product_name', item['product_id'])}")
+                            self.log(f"         📦 {item['quantity'] - units} → {item['quantity']} sztuk")
+                        self.log(f"         💎 Dopłata {top_up['additional_cost']:.2f} PLN, oszczędności: {real_savings:.2f} PLN")
                     else:
                         self.log(f"      ❌ Brak realnych oszczędności ({real_savings:.2f} PLN)")
                 else:
-                    self.log(f"      ❌ Nie znaleziono odpowiedniego produktu do zwiększenia")
+                    self.log(f"      ❌ Nie da się dobić do progu w limicie mnożnika ilości")
             else:
                 self.log(f"      ❌ Za małe oszczędności ({potential_savings:.2f} < {effective_threshold:.2f} PLN)")
         
@@ -109,46 +182,3 @@ class QuantityOptimizer:
             self.log(f"📋 Brak możliwości optymalizacji ilości w tym koszyku")
         
         return result
-    
-    def _find_best_quantity_increase(self, shop_items, needed_amount):
-        """Znajduje najlepszy produkt do zwiększenia ilości"""
-        best_option = None
-        
-        self.log(f"      🔍 Szukam najlepszego produktu do zwiększenia (potrzeba: {needed_amount:.2f} PLN)")
-        
-        for item in shop_items:
-            unit_price = item['unit_price_pln']
-            current_qty = item['quantity']
-            
-            # POPRAWKA: Sprawdź różne opcje zwiększenia ilości
-            for additional_qty in [1, 2, 3, 5, 10]:  # Dodajemy różne opcje
-                new_quantity = current_qty + additional_qty
-                additional_cost = additional_qty * unit_price
-                
-                # Sprawdź limit mnożnika
-                if new_quantity > current_qty * self.max_quantity_multiplier:
-                    continue
-                
-                if additional_cost >= needed_amount:
-                    efficiency = needed_amount / additional_cost
-                    
-                    product_name = item.get('product_name', f"ID:{item['product_id']}")
-                    self.log(f"         💭 {product_name}: +{additional_qty} szt = +{additional_cost:.2f} PLN (efektywność: {efficiency:.3f})")
-                    
-                    if not best_option or efficiency > best_option['efficiency']:
-                        best_option = {
-                            'item': item,
-                            'new_quantity': new_quantity,
-                            'additional_cost': additional_cost,
-                            'efficiency': efficiency,
-                            'additional_qty': additional_qty
-                        }
-                        self.log(f"         ⭐ NOWA NAJLEPSZA OPCJA!")
-        
-        if best_option:
-            item_name = best_option['item'].get('product_name', f"ID:{best_option['item']['product_id']}")
-            self.log(f"      🎯 WYBRANO: {item_name} +{best_option['additional_qty']} szt za {best_option['additional_cost']:.2f} PLN")
-        else:
-            self.log(f"      ❌ Brak odpowiednich opcji zwiększenia ilości")
-        
-        return best_option
\ No newline at end of file
@@ -1,14 +1,19 @@
 """
 Routes związane z koszykami
 """
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, Response
 from datetime import datetime
+import json
 from utils.data_utils import load_products, get_latest_prices
 from basket_manager import basket_manager
 from shop_config import shop_config
+from optimization_jobs import optimization_jobs
 
 basket_bp = Blueprint('baskets', __name__)
 
+# Budżet czasu optymalizacji w requeście UI (gdy koszyk nie ma własnego) - przewidywalne opóźnienie
+WEB_OPTIMIZATION_TIME_BUDGET_MS = 10000
+
 @basket_bp.route('/basket')
 def basket():
     """Główna strona koszyków"""
@@ -160,6 +165,9 @@ def basket_settings(basket_id):
             
             # NOWE: max_combinations
             'max_combinations': int(request.form.get('max_combinations', 200000)),
+            'time_budget_ms': int(request.form.get('time_budget_ms', 0) or 0),
+            'parallel_workers': int(request.form.get('parallel_workers', 0) or 0),
+            'max_offers_per_need': int(request.form.get('max_offers_per_need', 0) or 0),
             
             # NOWE: WSZYSTKIE USTAWIENIA ZAMIENNIKÓW
             'substitute_settings': {
@@ -354,7 +362,8 @@ def optimize_basket(basket_id):
         basket_id, 
         products, 
         latest_prices, 
-        shop_configs_data
+        shop_configs_data,
+        default_time_budget_ms=WEB_OPTIMIZATION_TIME_BUDGET_MS
     )
     
     if result['success']:
@@ -364,6 +373,100 @@ def optimize_basket(basket_id):
         flash(f'Błąd optymalizacji: {result["error"]}')
         return redirect(url_for('baskets.basket_detail', basket_id=basket_id))
 
+@basket_bp.route('/basket/<basket_id>/optimize_async', methods=['POST'])
+def optimize_basket_async(basket_id):
+    """Zleca optymalizację w tle - zwraca job_id do śledzenia postępu"""
+    if not basket_manager.get_basket(basket_id):
+        return jsonify({'success': False, 'error': 'Koszyk nie został znaleziony'}), 404
+    
+    data = request.get_json(silent=True) or request.form
+    try:
+        time_budget_ms = int(data.get('time_budget_ms') or 0) or None
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'Nieprawidłowy time_budget_ms'}), 400
+    
+    result = optimization_jobs.submit(
+        basket_id,
+        load_products(),
+        get_latest_prices(),
+        shop_config.load_shop_configs(),
+        time_budget_ms=time_budget_ms
+    )
+    if not result['success']:
+        return jsonify(result), 503
+    
+    result['status_url'] = url_for('baskets.optimization_job_status', job_id=result['job_id'])
+    result['stream_url'] = url_for('baskets.optimization_job_stream', job_id=result['job_id'])
+    result['results_url'] = url_for('baskets.optimization_job_results', job_id=result['job_id'])
+    result['cancel_url'] = url_for('baskets.cancel_optimization_job', job_id=result['job_id'])
+    return jsonify(result), 202
+
+@basket_bp.route('/api/optimization_jobs/<job_id>')
+def optimization_job_status(job_id):
+    """Status zadania optymalizacji (polling) - wynik gdy zakończone"""
+    job = optimization_jobs.get_job(job_id)
+    if not job:
+        return jsonify({'success': False, 'error': 'Zadanie nie istnieje'}), 404
+    return jsonify({'success': True, 'job': job})
+
+@basket_bp.route('/api/optimization_jobs/<job_id>/stream')
+def optimization_job_stream(job_id):
+    """Postęp zadania jako Server-Sent Events - ostatnie zdarzenie 'done'"""
+    if not optimization_jobs.get_job(job_id, include_result=False):
+        return jsonify({'success': False, 'error': 'Zadanie nie istnieje'}), 404
+    
+    def events():
+        last_version = None
+        while True:
+            job = optimization_jobs.wait_for_update(job_id, last_version)
+            if job is None:
+                yield 'event: done\ndata: {"status": "expired"}\n\n'
+                return
+            if job['version'] == last_version:
+                yield ': keep-alive\n\n'
+                continue
+            last_version = job['version']
+            event = 'done' if job['done'] else 'progress'
+            yield f"event: {event}\ndata: {json.dumps(job, ensure_ascii=False)}\n\n"
+            if job['done']:
+                return
+    
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@basket_bp.route('/api/optimization_jobs/<job_id>/cancel', methods=['POST'])
+def cancel_optimization_job(job_id):
+    """Anuluje zadanie optymalizacji"""
+    result = optimization_jobs.cancel(job_id)
+    return jsonify(result), (200 if result['success'] else 409)
+
+@basket_bp.route('/basket/optimization_jobs/<job_id>/results')
+def optimization_job_results(job_id):
+    """Wyniki zakończonego zadania - ta sama strona co przy optymalizacji synchronicznej"""
+    job = optimization_jobs.get_job(job_id)
+    if not job:
+        flash('Zadanie optymalizacji nie istnieje lub wygasło')
+        return redirect(url_for('baskets.basket'))
+    
+    result = job.get('result')
+    if job['status'] == 'completed' and result:
+        return render_template('optimization_results.html', result=result)
+    
+    if not job['done']:
+        flash('Optymalizacja jeszcze trwa...')
+    else:
+        flash(f'Błąd optymalizacji: {job.get("error") or job["status"]}')
+    return redirect(url_for('baskets.basket_detail', basket_id=job['basket_id']))
+
+@basket_bp.route('/api/baskets/refresh', methods=['GET', 'POST'])
+def baskets_refresh():
+    """Stan ponownej optymalizacji po zmianach cen; POST - przelicz dotknięte koszyki teraz"""
+    from optimization_refresh import optimization_refresh
+    if request.method == 'POST':
+        result = optimization_refresh.refresh(time_budget_ms=WEB_OPTIMIZATION_TIME_BUDGET_MS)
+        return jsonify(result), (200 if result['success'] else 500)
+    return jsonify({'success': True, 'refresh': optimization_refresh.status()})
+
 @basket_bp.route('/add_to_basket_ajax', methods=['POST'])
 def add_to_basket_ajax():
     """AJAX endpoint do dodawania produktów - Z DEBUGOWANIEM"""
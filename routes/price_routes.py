@@ -6,16 +6,14 @@ from datetime import datetime
 import math
 import logging
 from utils.data_utils import load_prices, save_price, load_links, load_products
+from utils.price_history import price_history
+from utils.aggregates import product_names as cached_product_names, link_urls
+from utils.lazy import LazyAttribute
 
 logger = logging.getLogger(__name__)
 
-# Importuj scraper bezpiecznie
-try:
-   from price_scraper import scraper
-   SCRAPER_AVAILABLE = True
-except ImportError:
-   SCRAPER_AVAILABLE = False
-   logger.warning("price_scraper not available - some features will be disabled")
+# Scraper (requests, BeautifulSoup) importowany przy pierwszym użyciu
+scraper = LazyAttribute('price_scraper', 'scraper')
 
 # Importuj user_manager bezpiecznie
 try:
@@ -72,79 +70,65 @@ def prices():
        shop_filter = request.args.get('shop', '', type=str)
        product_filter = request.args.get('product', '', type=str)
        
-       # Załaduj wszystkie dane
-       all_prices = load_prices()
-       
-       # Filtruj tylko prawidłowe ceny
-       valid_prices = []
-       for price in all_prices:
-           if isinstance(price, dict) and 'created' in price:
-               valid_prices.append(price)
-           else:
-               logger.warning(f"Invalid price data: {price}")
-       
-       valid_prices.sort(key=lambda x: x.get('created', ''), reverse=True)
+       product_names = cached_product_names()
        
-       products = load_products()
-       product_names = {p['id']: p['name'] for p in products if isinstance(p, dict)}
-       
-       # Ładuj linki żeby mieć URL-e
-       links = load_links()
-       product_shop_urls = {}
-       for link in links:
-           if isinstance(link, dict):
-               key = f"{link.get('product_id', '')}-{link.get('shop_id', '')}"
-               product_shop_urls[key] = link.get('url', '#')
-       
-       # Wzbogać dane o nazwy produktów i ceny PLN z bezpieczną konwersją
-       for price in valid_prices:
-           if isinstance(price, dict):
-               price['product_name'] = product_names.get(price.get('product_id'), 'Nieznany produkt')
-               
-               # Użyj bezpiecznej konwersji
-               price['price_pln'] = safe_convert_to_pln(
-                   price.get('price', 0), 
-                   price.get('currency', 'PLN')
-               )
-               
-               # Dodaj URL jeśli go nie ma
-               if 'url' not in price:
-                   key = f"{price.get('product_id', '')}-{price.get('shop_id', '')}"
-                   price['url'] = product_shop_urls.get(key, '#')
-               
-               # Dodaj informacje o sync
-               if price.get('synced'):
-                   price['sync_status'] = 'synced'
-               elif price.get('temp_id'):
-                   price['sync_status'] = 'pending'
-               elif price.get('needs_sync'):
-                   price['sync_status'] = 'queued'
-               else:
-                   price['sync_status'] = 'local'
+       # Blokada czytelnika - przepisanie prices.txt nie zmieni kodów między zapytaniami
+       with price_history.reading():
+           # Filtry na kodach słownikowych magazynu historii - bez ładowania wszystkich cen
+           shop_codes = None
+           if shop_filter:
+               shop_query = shop_filter.lower()
+               shop_codes = price_history.codes_matching(
+                   'shops', lambda shop_id: isinstance(shop_id, str) and shop_query in shop_id.lower())
        
-       # Filtrowanie
-       filtered_prices = valid_prices
+           product_codes = None
+           if product_filter:
+               product_query = product_filter.lower()
+               product_codes = price_history.codes_matching(
+                   'products', lambda pid: product_query in str(product_names.get(pid, 'Nieznany produkt')).lower())
        
-       if shop_filter:
-           filtered_prices = [p for p in filtered_prices 
-                            if isinstance(p, dict) and shop_filter.lower() in p.get('shop_id', '').lower()]
+           # Strona od najnowszych - pełne rekordy tylko dla tej strony
+           start = (page - 1) * ITEMS_PER_PAGE
+           total_items, page_prices = price_history.page(start, ITEMS_PER_PAGE, shop_codes, product_codes)
+           total_pages = math.ceil(total_items / ITEMS_PER_PAGE) if total_items > 0 else 1
        
-       if product_filter:
-           filtered_prices = [p for p in filtered_prices 
-                            if isinstance(p, dict) and product_filter.lower() in p.get('product_name', '').lower()]
+           # Sprawdź czy strona nie jest za wysoka
+           if page > total_pages and total_pages > 0:
+               page = total_pages
+               start = (page - 1) * ITEMS_PER_PAGE
+               total_items, page_prices = price_history.page(start, ITEMS_PER_PAGE, shop_codes, product_codes)
        
-       # Obliczenia paginacji
-       total_items = len(filtered_prices)
-       total_pages = math.ceil(total_items / ITEMS_PER_PAGE) if total_items > 0 else 1
+           # Lista unikalnych sklepów dla filtra
+           unique_shops = price_history.shop_ids()
+       end = start + ITEMS_PER_PAGE
        
-       # Sprawdź czy strona nie jest za wysoka
-       if page > total_pages and total_pages > 0:
-           page = total_pages
+       # URL-e linków z indeksu (produkt, sklep) - bez czytania wszystkich linków
+       product_shop_urls = link_urls()
        
-       # Wyciągnij dane dla aktualnej strony
-       start = (page - 1) * ITEMS_PER_PAGE
-       end = start + ITEMS_PER_PAGE
-       page_prices = filtered_prices[start:end]
+       # Wzbogać dane strony o nazwy produktów i ceny PLN z bezpieczną konwersją
+       for price in page_prices:
+           price['product_name'] = product_names.get(price.get('product_id'), 'Nieznany produkt')
+           
+           # Użyj bezpiecznej konwersji
+           price['price_pln'] = safe_convert_to_pln(
+               price.get('price', 0), 
+               price.get('currency', 'PLN')
+           )
+           
+           # Dodaj URL jeśli go nie ma
+           if 'url' not in price:
+               key = (price.get('product_id', ''), price.get('shop_id', ''))
+               price['url'] = product_shop_urls.get(key, '#')
+           
+           # Dodaj informacje o sync
+           if price.get('synced'):
+               price['sync_status'] = 'synced'
+           elif price.get('temp_id'):
+               price['sync_status'] = 'pending'
+           elif price.get('needs_sync'):
+               price['sync_status'] = 'queued'
+           else:
+               price['sync_status'] = 'local'
        
        # Przygotuj dane dla szablonu
        pagination_data = {
@@ -160,9 +144,6 @@ def prices():
            'next_page': page + 1 if page < total_pages else None
        }
        
-       # Przygotuj listę unikalnych sklepów dla filtra
-       unique_shops = sorted(set(p.get('shop_id', '') for p in valid_prices if isinstance(p, dict) and p.get('shop_id')))
-       
        return render_template('prices.html', 
                             prices=page_prices,
                             pagination=pagination_data,
@@ -183,7 +164,7 @@ def prices():
 @price_bp.route('/fetch_prices_ajax', methods=['POST'])
 def fetch_prices_ajax():
    """AJAX endpoint - pobiera ceny po jednej - API-FIRST VERSION"""
-   if not SCRAPER_AVAILABLE:
+   if not scraper.available():
        return jsonify({
            'status': 'error',
            'error': 'Price scraper is not available'
@@ -5,7 +5,10 @@ from flask import Blueprint, render_template, request, jsonify
 from datetime import datetime
 from utils.data_utils import load_products, load_links, save_link
 from shop_config import shop_config
-from product_finder import product_finder
+from utils.lazy import LazyAttribute
+
+# Wyszukiwarka (requests, BeautifulSoup) importowana przy pierwszym użyciu
+product_finder = LazyAttribute('product_finder', 'product_finder')
 
 finder_bp = Blueprint('finder', __name__)
 
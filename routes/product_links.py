@@ -5,14 +5,13 @@ import json
 from flask import jsonify, request, render_template, redirect, url_for, flash
 from datetime import datetime
 from utils.data_utils import load_links, load_products, load_prices, save_price
+from utils.file_store import write_jsonl_atomic
 from urllib.parse import urlparse
 
-# Importuj scraper bezpiecznie
-try:
-    from price_scraper import scraper
-    SCRAPER_AVAILABLE = True
-except ImportError:
-    SCRAPER_AVAILABLE = False
+from utils.lazy import LazyAttribute
+
+# Scraper (requests, BeautifulSoup) importowany przy pierwszym użyciu
+scraper = LazyAttribute('price_scraper', 'scraper')
 
 def extract_shop_id(url):
     """Wyciąga ID sklepu z URL"""
@@ -86,7 +85,7 @@ class ProductLinksManager:
             shop_id = extract_shop_id(url)
             print(f"🔥 EXTRACTED SHOP_ID: {shop_id}")
             
-            if SCRAPER_AVAILABLE:
+            if scraper.available():
                 try:
                     # Użyj scrapera
                     page_info = scraper.scrape_page(url)
@@ -135,9 +134,7 @@ class ProductLinksManager:
                 print(f"🔥 IMPORT ERROR: {e}")
                 # Fallback - save locally the old way
                 existing_links.append(new_link)
-                with open('data/product_links.txt', 'w', encoding='utf-8') as f:
-                    for link in existing_links:
-                        f.write(json.dumps(link, ensure_ascii=False) + '\n')
+                write_jsonl_atomic('data/product_links.txt', existing_links)
                 flash(f'Link został dodany do sklepu "{shop_id}" (lokalnie)!')
             except Exception as e:
                 print(f"🔥 SYNC ERROR: {e}")
@@ -146,13 +143,11 @@ class ProductLinksManager:
                 
                 # Fallback - save locally
                 existing_links.append(new_link)
-                with open('data/product_links.txt', 'w', encoding='utf-8') as f:
-                    for link in existing_links:
-                        f.write(json.dumps(link, ensure_ascii=False) + '\n')
+                write_jsonl_atomic('data/product_links.txt', existing_links)
                 flash(f'Link został dodany do sklepu "{shop_id}" (błąd synchronizacji)!')
             
             # Jeśli scraper dostępny, spróbuj od razu pobrać cenę
-            if SCRAPER_AVAILABLE and result.get('success'):
+            if scraper.available() and result.get('success'):
                 print(f"🔥 PRÓBA POBIERANIA CENY...")
                 try:
                     page_info = scraper.scrape_page(url, shop_id)
@@ -262,9 +257,7 @@ class ProductLinksManager:
                         links[i] = updated_link
                         
                         # Zapisz lokalnie z API ID
-                        with open('data/product_links.txt', 'w', encoding='utf-8') as f:
-                            for link in links:
-                                f.write(json.dumps(link, ensure_ascii=False) + '\n')
+                        write_jsonl_atomic('data/product_links.txt', links)
                         
                         print(f"🔥 LINK UPDATE SYNCED TO API")
                         return jsonify({
@@ -279,9 +272,7 @@ class ProductLinksManager:
                         pass
                 
                 # Fallback - zapisz lokalnie
-                with open('data/product_links.txt', 'w', encoding='utf-8') as f:
-                    for link in links:
-                        f.write(json.dumps(link, ensure_ascii=False) + '\n')
+                write_jsonl_atomic('data/product_links.txt', links)
                 
                 return jsonify({
                     'success': True, 
@@ -292,9 +283,7 @@ class ProductLinksManager:
             except ImportError as e:
                 print(f"🔥 IMPORT ERROR: {e}")
                 # Zapisz zmiany lokalnie
-                with open('data/product_links.txt', 'w', encoding='utf-8') as f:
-                    for link in links:
-                        f.write(json.dumps(link, ensure_ascii=False) + '\n')
+                write_jsonl_atomic('data/product_links.txt', links)
                 
                 return jsonify({'success': True, 'message': 'Link został zaktualizowany'})
             except Exception as e:
@@ -303,9 +292,7 @@ class ProductLinksManager:
                 traceback.print_exc()
                 
                 # Zapisz zmiany lokalnie
-                with open('data/product_links.txt', 'w', encoding='utf-8') as f:
-                    for link in links:
-                        f.write(json.dumps(link, ensure_ascii=False) + '\n')
+                write_jsonl_atomic('data/product_links.txt', links)
                 
                 return jsonify({
                     'success': True, 
@@ -363,9 +350,7 @@ class ProductLinksManager:
                             print(f"🔥 API DELETE ERROR: {e}")
                 
                 # Zapisz pozostałe linki lokalnie
-                with open('data/product_links.txt', 'w', encoding='utf-8') as f:
-                    for link in remaining_links:
-                        f.write(json.dumps(link, ensure_ascii=False) + '\n')
+                write_jsonl_atomic('data/product_links.txt', remaining_links)
                 
                 # Usuń powiązane ceny
                 prices = load_prices()
@@ -375,9 +360,7 @@ class ProductLinksManager:
                     if not (price['product_id'] == product_id and price['shop_id'] == shop_id):
                         remaining_prices.append(price)
                 
-                with open('data/prices.txt', 'w', encoding='utf-8') as f:
-                    for price in remaining_prices:
-                        f.write(json.dumps(price, ensure_ascii=False) + '\n')
+                write_jsonl_atomic('data/prices.txt', remaining_prices)
                 
                 return jsonify({
                     'success': True,
@@ -387,9 +370,7 @@ class ProductLinksManager:
             except ImportError as e:
                 print(f"🔥 IMPORT ERROR: {e}")
                 # Fallback - usuń lokalnie
-                with open('data/product_links.txt', 'w', encoding='utf-8') as f:
-                    for link in remaining_links:
-                        f.write(json.dumps(link, ensure_ascii=False) + '\n')
+                write_jsonl_atomic('data/product_links.txt', remaining_links)
                 
                 return jsonify({
                     'success': True,
@@ -401,9 +382,7 @@ class ProductLinksManager:
                 traceback.print_exc()
                 
                 # Fallback - usuń lokalnie
-                with open('data/product_links.txt', 'w', encoding='utf-8') as f:
-                    for link in remaining_links:
-                        f.write(json.dumps(link, ensure_ascii=False) + '\n')
+                write_jsonl_atomic('data/product_links.txt', remaining_links)
                 
                 return jsonify({
                     'success': True,
@@ -475,9 +454,7 @@ class ProductLinksManager:
                 print(f"🔥 IMPORT ERROR: {e}")
                 # Fallback - zapisz lokalnie
                 existing_links.append(new_link)
-                with open('data/product_links.txt', 'w', encoding='utf-8') as f:
-                    for link in existing_links:
-                        f.write(json.dumps(link, ensure_ascii=False) + '\n')
+                write_jsonl_atomic('data/product_links.txt', existing_links)
                 
                 return jsonify({'success': True, 'message': 'Link został dodany'})
             except Exception as e:
@@ -487,9 +464,7 @@ class ProductLinksManager:
                 
                 # Fallback - zapisz lokalnie
                 existing_links.append(new_link)
-                with open('data/product_links.txt', 'w', encoding='utf-8') as f:
-                    for link in existing_links:
-                        f.write(json.dumps(link, ensure_ascii=False) + '\n')
+                write_jsonl_atomic('data/product_links.txt', existing_links)
                 
                 return jsonify({
                     'success': True, 
@@ -4,6 +4,8 @@ Product Management - zarządzanie produktami - NAPRAWIONY
 from flask import render_template, request, redirect, url_for, flash, jsonify
 from datetime import datetime
 from utils.data_utils import load_products, save_product, load_links, get_latest_prices
+from utils.file_store import write_jsonl_atomic
+from utils.aggregates import price_stats, link_counts
 import logging
 
 logger = logging.getLogger(__name__)
@@ -16,38 +18,26 @@ class ProductManager:
         try:
             products = load_products()
             links = load_links()
-            latest_prices = get_latest_prices()
             
             # POPRAWKA: Filtruj tylko prawidłowe produkty
             products = [p for p in products if isinstance(p, dict) and 'id' in p]
             
-            # Dodaj informacje o cenach do produktów
+            # Ceny i linki zagregowane jednym przejściem (utils.aggregates)
+            prices_by_product = price_stats()
+            links_by_product = link_counts()['by_product']
+            
             for product in products:
-                product_prices = []
-                for price_key, price_data in latest_prices.items():
-                    if isinstance(price_data, dict) and price_data.get('product_id') == product['id']:
-                        try:
-                            # POPRAWKA: Bezpieczna konwersja ceny
-                            price_val = float(price_data.get('price', 0))
-                            if price_val > 0:  # Tylko dodatnie ceny
-                                product_prices.append(price_val)
-                        except (ValueError, TypeError):
-                            continue
-                
-                # POPRAWKA: Bezpieczne obliczenie min/max cen
-                if product_prices:
-                    product['min_price'] = min(product_prices)
-                    product['max_price'] = max(product_prices)
-                    product['price_count'] = len(product_prices)
+                stats = prices_by_product.get(product['id'])
+                if stats and stats['count']:
+                    product['min_price'] = stats['min']
+                    product['max_price'] = stats['max']
+                    product['price_count'] = stats['count']
                 else:
                     product['min_price'] = None
                     product['max_price'] = None
                     product['price_count'] = 0
                 
-                # Dodaj informacje o linkach
-                product_links = [l for l in links 
-                               if isinstance(l, dict) and l.get('product_id') == product['id']]
-                product['link_count'] = len(product_links)
+                product['link_count'] = links_by_product.get(product['id'], 0)
             
             return render_template('products.html', products=products, links=links)
             
@@ -407,21 +397,14 @@ class ProductManager:
             products = [p for p in products if not (isinstance(p, dict) and p.get('id') == product_id)]
             
             # Zapisz
-            import json
-            with open('data/products.txt', 'w', encoding='utf-8') as f:
-                for product in products:
-                    if isinstance(product, dict):
-                        f.write(json.dumps(product, ensure_ascii=False) + '\n')
+            write_jsonl_atomic('data/products.txt', [p for p in products if isinstance(p, dict)])
             
             # Usuń też linki tego produktu
             try:
                 links = load_links()
                 links = [l for l in links if not (isinstance(l, dict) and l.get('product_id') == product_id)]
                 
-                with open('data/product_links.txt', 'w', encoding='utf-8') as f:
-                    for link in links:
-                        if isinstance(link, dict):
-                            f.write(json.dumps(link, ensure_ascii=False) + '\n')
+                write_jsonl_atomic('data/product_links.txt', [l for l in links if isinstance(l, dict)])
             except:
                 pass  # Nie blokuj jeśli nie ma linków
             
@@ -5,20 +5,17 @@ from flask import jsonify, request
 from datetime import datetime
 from utils.data_utils import save_price
 
-# Importuj scraper bezpiecznie
-try:
-    from price_scraper import scraper
-    SCRAPER_AVAILABLE = True
-except ImportError:
-    SCRAPER_AVAILABLE = False
-    print("WARNING: price_scraper not available - some features will be disabled")
+from utils.lazy import LazyAttribute
+
+# Scraper (requests, BeautifulSoup) importowany przy pierwszym użyciu
+scraper = LazyAttribute('price_scraper', 'scraper')
 
 class ProductPricingManager:
     """Klasa zarządzająca pobieraniem i zapisywaniem cen - API-FIRST"""
     
     def fetch_price_for_link(self):
         """API - pobiera cenę dla konkretnego linku - API-FIRST"""
-        if not SCRAPER_AVAILABLE:
+        if not scraper.available():
             return jsonify({'success': False, 'error': 'Scraper nie jest dostępny'})
         
         try:
@@ -4,6 +4,7 @@ Routes związane z produktami - główny plik
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from datetime import datetime
 from utils.data_utils import load_products, save_product, load_links, load_prices, get_latest_prices
+from utils.file_store import write_jsonl_atomic
 
 # Import modułów pomocniczych
 from .product_management import ProductManager
@@ -87,9 +88,7 @@ def delete_product():
         products = load_products()
         products = [p for p in products if p['id'] != product_id]
         
-        with open('data/products.txt', 'w', encoding='utf-8') as f:
-            for product in products:
-                f.write(json.dumps(product, ensure_ascii=False) + '\n')
+        write_jsonl_atomic('data/products.txt', products)
         
         return jsonify({'success': True, 'message': 'Product deleted locally'})
         
@@ -680,14 +679,13 @@ def get_product_substitutes(product_id):
     """API - zwraca zamienniki dla produktu"""
     try:
         from substitute_manager import substitute_manager
-        from utils.data_utils import get_latest_prices, get_product_price_range
+        from utils.aggregates import price_range_pln
         
         substitute_info = substitute_manager.get_substitutes_for_product(product_id)
         
         # Dodaj informacje o cenach dla każdego zamiennika
-        latest_prices = get_latest_prices()
         for substitute in substitute_info['substitutes']:
-            min_price, max_price = get_product_price_range(substitute['id'], latest_prices)
+            min_price, max_price = price_range_pln(substitute['id'])
             substitute['min_price'] = min_price
             substitute['max_price'] = max_price
         
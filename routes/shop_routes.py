@@ -5,6 +5,7 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash,
 from utils.data_utils import load_links
 from shop_config import shop_config
 from utils.data_utils import load_products, load_links
+from utils.aggregates import link_counts
 import logging
 
 logger = logging.getLogger(__name__)
@@ -15,23 +16,19 @@ shop_bp = Blueprint('shops', __name__)
 def shops():
     # Auto-stwórz konfiguracje dla wszystkich istniejących shop_id z linków
     try:
-        existing_links = load_links()
-        existing_shop_ids = set()
+        links_by_shop = link_counts()['by_shop']
+        existing_shop_ids = set(links_by_shop)
         
-        for link in existing_links:
-            if isinstance(link, dict) and 'shop_id' in link:
-                existing_shop_ids.add(link['shop_id'])
-        
-        # Upewnij się, że każdy shop_id ma konfigurację
-        for shop_id in existing_shop_ids:
+        # Upewnij się, że każdy shop_id ma konfigurację (plik konfiguracji czytany raz)
+        configured_shop_ids = set(shop_config.load_shop_configs())
+        for shop_id in existing_shop_ids - configured_shop_ids:
             config = shop_config.get_shop_config(shop_id)
-            if shop_id not in shop_config.load_shop_configs():
-                # API-FIRST: Najpierw spróbuj zapisać w API
-                try:
-                    from sync.sync_integration import save_shop_config_api_first
-                    save_shop_config_api_first(config)
-                except ImportError:
-                    shop_config.save_shop_config(config)
+            # API-FIRST: Najpierw spróbuj zapisać w API
+            try:
+                from sync.sync_integration import save_shop_config_api_first
+                save_shop_config_api_first(config)
+            except ImportError:
+                shop_config.save_shop_config(config)
         
         shops_list = shop_config.get_all_shops()
         
@@ -45,10 +42,8 @@ def shops():
             if isinstance(shop, dict):  # POPRAWKA: Sprawdź typ
                 shop_id = shop.get('shop_id', '')
                 
-                # Policz produkty w tym sklepie
-                products_count = len([link for link in existing_links 
-                                    if isinstance(link, dict) and link.get('shop_id') == shop_id])
-                shop['products_count'] = products_count
+                # Produkty (linki) w tym sklepie
+                shop['products_count'] = links_by_shop.get(shop_id, 0)
                 
                 # POPRAWKA: Bezpieczne sprawdzenie search_config
                 search_config = shop.get('search_config', {})
@@ -304,7 +299,7 @@ def get_products_not_in_shop(shop_id):
 def shops_stats():
     """API endpoint - zwraca statystyki sklepów"""
     try:
-        existing_links = load_links()
+        counts = link_counts()
         shops_list = shop_config.get_all_shops()
         
         # POPRAWKA: Filtruj tylko słowniki
@@ -315,15 +310,14 @@ def shops_stats():
             'shops_with_products': 0,
             'shops_with_selectors': 0,
             'shops_with_search': 0,
-            'total_products': len([link for link in existing_links if isinstance(link, dict)]),
+            'total_products': counts['total'],
             'shops_breakdown': []
         }
         
         for shop in shops_list:
             if isinstance(shop, dict):
                 shop_id = shop.get('shop_id', '')
-                products_count = len([link for link in existing_links 
-                                    if isinstance(link, dict) and link.get('shop_id') == shop_id])
+                products_count = counts['by_shop'].get(shop_id, 0)
                 
                 price_selectors = shop.get('price_selectors', [])
                 if isinstance(price_selectors, list):
@@ -2,8 +2,18 @@
 Wydzielony moduł do parsowania cen ze stron internetowych
 """
 import re
+import time
 from datetime import datetime
 
+from utils.metrics import metrics
+
+# Skuteczność parsowania per metoda (promo / regular / allegro_html / regex / none)
+PARSE_TOTAL = metrics.counter('price_parse_total', 'Parsowania ceny ze strony wg metody', ('shop', 'method'))
+PARSE_SECONDS = metrics.histogram(
+    'price_parse_duration_seconds', 'Czas parsowania ceny ze strony',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+)
+
 class PriceParser:
     """Klasa odpowiedzialna za parsowanie cen ze stron"""
     
@@ -225,6 +235,15 @@ class PriceParser:
     
     def parse_price_from_page(self, soup, shop_id, debug_info, allegro_parser=None):
         """Główna funkcja parsowania ceny ze strony"""
+        started = time.perf_counter()
+        result = self._parse_price_from_page(soup, shop_id, debug_info, allegro_parser)
+        PARSE_SECONDS.observe(time.perf_counter() - started)
+        
+        price, method = result if isinstance(result, tuple) else (result, 'unknown')
+        PARSE_TOTAL.labels(shop_id, (method or 'unknown') if price else 'none').inc()
+        return result
+    
+    def _parse_price_from_page(self, soup, shop_id, debug_info, allegro_parser=None):
         try:
             debug_info.append(f"Sklep: {shop_id}")
             
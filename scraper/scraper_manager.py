@@ -11,10 +11,17 @@ from urllib.parse import urlparse
 from scraper.price_parser import PriceParser
 from scraper.allegro_parser import AllegroParser
 from scraper.scraper_methods import ScraperMethods
+from utils.metrics import metrics
 
 # Wyłącz ostrzeżenia SSL
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+# Metryki pobierania stron - czas i wynik per sklep
+SCRAPE_SECONDS = metrics.histogram(
+    'scrape_duration_seconds', 'Czas pobrania i parsowania strony', ('shop', 'outcome'),
+    buckets=(0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0)
+)
+
 class ScraperManager:
     """Główna klasa zarządzająca scraperem"""
     
@@ -112,8 +119,24 @@ class ScraperManager:
         
         return None
     
+    @staticmethod
+    def _shop_id_from_url(url):
+        domain = urlparse(url).netloc.lower()
+        return domain.replace('www.', '').replace('m.', '').split('.')[0]
+    
     def scrape_page(self, url, shop_id=None):
         """Główna funkcja pobierania informacji ze strony"""
+        started = time.perf_counter()
+        result = self._scrape_page(url, shop_id)
+        
+        if not isinstance(result, dict) or not result.get('success'):
+            outcome = 'error'
+        else:
+            outcome = 'price' if result.get('price') else 'no_price'
+        SCRAPE_SECONDS.labels(shop_id or self._shop_id_from_url(url), outcome).observe(time.perf_counter() - started)
+        return result
+    
+    def _scrape_page(self, url, shop_id=None):
         debug_info = []
         
         try:
@@ -146,8 +169,7 @@ class ScraperManager:
             # Parsuj cenę
             debug_info.append("Szukam ceny...")
             if not shop_id:
-                domain = urlparse(url).netloc.lower()
-                shop_id = domain.replace('www.', '').replace('m.', '').split('.')[0]
+                shop_id = self._shop_id_from_url(url)
             
             price_result = self.price_parser.parse_price_from_page(
                 soup, shop_id, debug_info, self.allegro_parser
@@ -3,6 +3,7 @@ Moduł do zarządzania konfiguracją sklepów - selektory, koszty dostawy, wyszu
 """
 import json
 import os
+from utils.file_store import write_jsonl_atomic
 
 class ShopConfigManager:
     """Zarządza konfiguracją sklepów"""
@@ -276,9 +277,7 @@ class ShopConfigManager:
         configs[config_data['shop_id']] = config_data
         
         # Przepisz cały plik
-        with open(self.config_file, 'w', encoding='utf-8') as f:
-            for config in configs.values():
-                f.write(json.dumps(config, ensure_ascii=False) + '\n')
+        write_jsonl_atomic(self.config_file, configs.values())
     
     def get_shop_config(self, shop_id):
         """Pobiera konfigurację konkretnego sklepu"""
@@ -0,0 +1,117 @@
+"""
+Kontrola czasu zimnego startu aplikacji (python -X importtime)
+
+Importuje moduł aplikacji (domyślnie app) w świeżym procesie, mierzy czas importu,
+wypisuje najwolniejsze moduły z raportu -X importtime i sprawdza że ciężkie moduły
+(requests, BeautifulSoup, scraper, klient API sync'u) nie są ładowane na starcie -
+trasy importują je przy pierwszym użyciu, sync startuje w tle.
+Kod wyjścia 1 gdy przekroczono budżet albo ciężki moduł załadował się przy imporcie.
+
+Użycie:
+    python startup_check.py
+    python startup_check.py --budget-ms 300 --repeat 5
+    python startup_check.py --module optimization_batch --top 20
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BUDGET_MS = 500
+
+# Nie mogą być importowane przy starcie (z wyłączonym sync'iem - sync ładuje je w tle)
+HEAVY_MODULES = (
+    'requests', 'bs4', 'price_scraper', 'product_finder',
+    'scraper.scraper_manager', 'sync.api_client', 'sync.sync_manager',
+)
+
+_PROBE = (
+    "import sys, time\n"
+    "started = time.perf_counter()\n"
+    "import {module}\n"
+    "elapsed = (time.perf_counter() - started) * 1000\n"
+    "heavy = [name for name in {heavy!r} if name in sys.modules]\n"
+    "print('STARTUP', round(elapsed, 1), ','.join(heavy))\n"
+)
+
+
+def parse_importtime(stderr):
+    """Linie raportu -X importtime -> lista (moduł, self_us, cumulative_us)"""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3:
+            continue
+        try:
+            self_us, cumulative_us = int(parts[0]), int(parts[1])
+        except ValueError:
+            continue  # nagłówek
+        modules.append((parts[2].strip(), self_us, cumulative_us))
+    return modules
+
+
+def measure(module, env):
+    """Jeden zimny import w nowym procesie: (ms, ciężkie moduły, raport importtime)"""
+    code = _PROBE.format(module=module, heavy=HEAVY_MODULES)
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=REPO_DIR, env=env, capture_output=True, text=True
+    )
+    for line in completed.stdout.splitlines():
+        if line.startswith('STARTUP '):
+            _, elapsed, heavy = (line.split(' ', 2) + [''])[:3]
+            return float(elapsed), [name for name in heavy.split(',') if name], parse_importtime(completed.stderr)
+    errors = '\n'.join(line for line in completed.stderr.splitlines() if not line.startswith('import time:'))
+    raise RuntimeError(f"Import {module} nie powiódł się:\n{errors[-2000:]}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Kontrola czasu zimnego startu aplikacji')
+    parser.add_argument('--module', default='app', help='moduł importowany przy starcie')
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS, help='maksymalny czas importu')
+    parser.add_argument('--repeat', type=int, default=3, help='powtórzenia - porównywana mediana')
+    parser.add_argument('--top', type=int, default=10, help='ile najwolniejszych modułów wypisać')
+    parser.add_argument('--with-sync', action='store_true',
+                        help="nie wyłączaj sync'u (ENABLE_SYNC) na czas pomiaru")
+    args = parser.parse_args(argv)
+
+    env = dict(os.environ, BACKGROUND_STARTUP='true')
+    if not args.with_sync:
+        env['ENABLE_SYNC'] = 'false'
+
+    # Pierwszy przebieg rozgrzewa .pyc - nie liczymy go
+    try:
+        measure(args.module, env)
+        runs = [measure(args.module, env) for _ in range(max(1, args.repeat))]
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        return 1
+
+    median_ms = statistics.median(elapsed for elapsed, _, _ in runs)
+    heavy = sorted({name for _, loaded, _ in runs for name in loaded})
+    modules = runs[-1][2]
+
+    print(f"⏱️ import {args.module}: mediana {median_ms:.1f} ms (budżet {args.budget_ms:.0f} ms, "
+          f"przebiegi: {', '.join(f'{elapsed:.1f}' for elapsed, _, _ in runs)})")
+    print("🐢 Najwolniejsze moduły (self / cumulative ms):")
+    for name, self_us, cumulative_us in sorted(modules, key=lambda m: m[1], reverse=True)[:args.top]:
+        print(f"   {self_us / 1000:8.1f} {cumulative_us / 1000:8.1f}  {name}")
+
+    failed = False
+    if median_ms > args.budget_ms:
+        print(f"❌ Przekroczony budżet startu: {median_ms:.1f} ms > {args.budget_ms:.0f} ms")
+        failed = True
+    if heavy and not args.with_sync:
+        print(f"❌ Ciężkie moduły importowane na starcie: {', '.join(heavy)}")
+        failed = True
+    if not failed:
+        print("✅ Start w budżecie")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,162 @@
+/**
+ * Optymalizacja koszyka w tle - zadanie w puli procesów, postęp na żywo (SSE), anulowanie
+ *
+ * Formularze z atrybutem data-optimize-async wysyłają zadanie do /basket/<id>/optimize_async
+ * zamiast czekać na synchroniczne /optimize. Bez JavaScriptu (albo gdy zadania nie da się
+ * zlecić) formularz działa jak dotąd.
+ */
+
+document.addEventListener('DOMContentLoaded', function() {
+    document.querySelectorAll('form[data-optimize-async]').forEach(function(form) {
+        form.addEventListener('submit', function(e) {
+            e.preventDefault();
+            startOptimizationJob(form);
+        });
+    });
+});
+
+async function startOptimizationJob(form) {
+    const button = form.querySelector('button[type="submit"]');
+    const panel = getJobPanel(form);
+
+    if (button) button.disabled = true;
+    showJobStatus(panel, '⏳ Zlecanie optymalizacji...');
+
+    let job;
+    try {
+        const response = await fetch(form.dataset.optimizeAsync, {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: '{}'
+        });
+        job = await response.json();
+        if (!response.ok || !job.success) {
+            throw new Error(job.error || `HTTP ${response.status}`);
+        }
+    } catch (error) {
+        // Pula zajęta / niedostępna - optymalizacja w żądaniu jak bez JavaScriptu
+        console.warn('Optymalizacja w tle niedostępna:', error);
+        showJobStatus(panel, '⏳ Optymalizacja w przeglądarce...');
+        form.submit();
+        return;
+    }
+
+    addCancelButton(panel, job.cancel_url);
+    followJob(job, panel, function(finished) {
+        if (finished.status === 'completed') {
+            showJobStatus(panel, '✅ Gotowe - otwieram wyniki...');
+            window.location.href = job.results_url;
+            return;
+        }
+        if (button) button.disabled = false;
+        removeCancelButton(panel);
+        if (finished.status === 'cancelled') {
+            showJobStatus(panel, '⏹️ Optymalizacja anulowana');
+        } else {
+            const error = finished.error || (finished.result && finished.result.error) || finished.status;
+            showJobStatus(panel, '❌ Błąd optymalizacji: ' + error, true);
+        }
+    });
+}
+
+function followJob(job, panel, onDone) {
+    // SSE gdy przeglądarka wspiera, inaczej polling statusu
+    if (!window.EventSource) {
+        pollJob(job.status_url, panel, onDone);
+        return;
+    }
+
+    const source = new EventSource(job.stream_url);
+    source.addEventListener('progress', function(e) {
+        showJobProgress(panel, JSON.parse(e.data));
+    });
+    source.addEventListener('done', function(e) {
+        source.close();
+        onDone(JSON.parse(e.data));
+    });
+    source.onerror = function() {
+        // Zerwane połączenie (proxy, restart) - dokończ pollingiem
+        source.close();
+        pollJob(job.status_url, panel, onDone);
+    };
+}
+
+async function pollJob(statusUrl, panel, onDone) {
+    try {
+        const response = await fetch(statusUrl);
+        const data = await response.json();
+        if (!response.ok || !data.success) {
+            onDone({status: 'failed', error: data.error || 'Zadanie wygasło'});
+            return;
+        }
+        if (data.job.done) {
+            onDone(data.job);
+            return;
+        }
+        showJobProgress(panel, data.job);
+    } catch (error) {
+        console.warn('Błąd odczytu statusu zadania:', error);
+    }
+    setTimeout(function() { pollJob(statusUrl, panel, onDone); }, 1000);
+}
+
+// ==========================================
+// PANEL POSTĘPU
+// ==========================================
+
+function getJobPanel(form) {
+    let panel = form.nextElementSibling;
+    if (!panel || !panel.classList.contains('optimization-job-panel')) {
+        panel = document.createElement('div');
+        panel.className = 'optimization-job-panel';
+        panel.style.cssText = 'margin: 10px 0; padding: 8px 12px; background: #f8f9fa; ' +
+                              'border-left: 4px solid #28a745; border-radius: 4px; font-size: 0.9em;';
+        panel.innerHTML = '<span class="job-status"></span> <span class="job-actions"></span>';
+        form.parentNode.insertBefore(panel, form.nextSibling);
+    }
+    return panel;
+}
+
+function showJobStatus(panel, text, isError = false) {
+    panel.style.borderLeftColor = isError ? '#dc3545' : '#28a745';
+    panel.querySelector('.job-status').textContent = text;
+}
+
+function showJobProgress(panel, job) {
+    if (job.status === 'queued') {
+        showJobStatus(panel, '⏳ W kolejce...');
+        return;
+    }
+    const progress = job.progress || {};
+    const parts = ['🧮 Optymalizacja w toku'];
+    if (progress.strategy) parts.push(`strategia: ${progress.strategy}`);
+    if (progress.combinations_evaluated) parts.push(`ocenione kombinacje: ${progress.combinations_evaluated}`);
+    if (progress.best_score !== undefined && progress.best_score !== null) {
+        parts.push(`najlepszy wynik: ${Number(progress.best_score).toFixed(2)}`);
+    }
+    showJobStatus(panel, parts.join(' · '));
+}
+
+function addCancelButton(panel, cancelUrl) {
+    const actions = panel.querySelector('.job-actions');
+    actions.innerHTML = '';
+    const cancel = document.createElement('button');
+    cancel.type = 'button';
+    cancel.textContent = '⏹️ Anuluj';
+    cancel.style.cssText = 'margin-left: 10px; background: #dc3545; color: white; border: none; ' +
+                           'padding: 4px 10px; border-radius: 4px; cursor: pointer;';
+    cancel.addEventListener('click', async function() {
+        cancel.disabled = true;
+        try {
+            await fetch(cancelUrl, {method: 'POST'});
+        } catch (error) {
+            console.warn('Nie udało się anulować zadania:', error);
+            cancel.disabled = false;
+        }
+    });
+    actions.appendChild(cancel);
+}
+
+function removeCancelButton(panel) {
+    panel.querySelector('.job-actions').innerHTML = '';
+}
@@ -3,15 +3,24 @@ Moduł do zarządzania zamiennością produktów
 """
 import json
 import os
+import threading
 from datetime import datetime
 from utils.data_utils import load_products, save_product, load_prices, get_latest_prices, convert_to_pln
+from utils.file_store import write_jsonl_atomic, file_generation
 
 class SubstituteManager:
     """Zarządzanie zamiennością produktów"""
     
     def __init__(self):
         self.substitutes_file = 'data/substitutes.txt'
+        self.products_file = 'data/products.txt'
         self.ensure_data_dir()
+        
+        # Indeksy produkt -> grupa i produkt -> produkt dla wersji plików
+        # (generacje substitutes.txt i products.txt) - zamiast czytania obu plików
+        # i liniowego szukania przy każdym get_substitutes_for_product
+        self._index = None
+        self._index_lock = threading.Lock()
     
     def ensure_data_dir(self):
         """Upewnij się że folder data istnieje"""
@@ -35,14 +44,53 @@ class SubstituteManager:
         except FileNotFoundError:
             return {}
     
+    def _data_version(self):
+        return (file_generation(self.substitutes_file), file_generation(self.products_file))
+    
+    def _indexes(self):
+        """Indeksy dla bieżącej wersji plików - przebudowa tylko gdy któryś plik się zmienił"""
+        version = self._data_version()
+        index = self._index
+        if index is not None and None not in version and index['version'] == version:
+            return index
+        
+        with self._index_lock:
+            version = self._data_version()
+            return self._index_from(self.load_substitute_groups(), load_products(), version)
+    
+    def _index_from(self, groups, products, version=None):
+        """
+        Zbuduj indeksy z danych w pamięci (też po własnym zapisie - bez ponownego czytania plików).
+        Produkt w kilku grupach / zdublowany - wygrywa pierwszy, jak przy liniowym szukaniu.
+        """
+        group_of_product = {}
+        for group_id, group in groups.items():
+            for pid in group['product_ids']:
+                group_of_product.setdefault(pid, group_id)
+        
+        products_by_id = {}
+        for product in products:
+            products_by_id.setdefault(product['id'], product)
+        
+        self._index = {
+            'version': version if version is not None else self._data_version(),
+            'groups': groups,
+            'group_of_product': group_of_product,
+            'products_by_id': products_by_id,
+        }
+        return self._index
+    
+    def _priority(self, group, product_id):
+        """Priorytet produktu w grupie - po zapisie do JSON klucze priority_map są stringami"""
+        priority_map = group.get('priority_map', {})
+        return priority_map.get(product_id, priority_map.get(str(product_id), 99))
+    
     def save_substitute_group(self, group_data):
         """Zapisuje grupę zamienników do pliku"""
         groups = self.load_substitute_groups()
         groups[group_data['group_id']] = group_data
         
-        with open(self.substitutes_file, 'w', encoding='utf-8') as f:
-            for group in groups.values():
-                f.write(json.dumps(group, ensure_ascii=False) + '\n')
+        write_jsonl_atomic(self.substitutes_file, groups.values())
     
     def create_substitute_group(self, name, product_ids, priority_map=None):
         """
@@ -74,10 +122,12 @@ class SubstituteManager:
             }
         }
         
-        self.save_substitute_group(group_data)
+        groups[group_id] = group_data
+        write_jsonl_atomic(self.substitutes_file, groups.values())
         
         # Aktualizuj produkty - dodaj informację o grupie
-        self._update_products_with_group(product_ids, group_id)
+        products = self._update_products_with_group(product_ids, group_id)
+        self._index_from(groups, products)
         
         return group_id
     
@@ -91,9 +141,8 @@ class SubstituteManager:
                 product['updated'] = datetime.now().isoformat()
         
         # Przepisz plik produktów
-        with open('data/products.txt', 'w', encoding='utf-8') as f:
-            for product in products:
-                f.write(json.dumps(product, ensure_ascii=False) + '\n')
+        write_jsonl_atomic(self.products_file, products)
+        return products
     
     def get_substitutes_for_product(self, product_id):
         """
@@ -106,15 +155,11 @@ class SubstituteManager:
                 'settings': dict
             }
         """
-        groups = self.load_substitute_groups()
-        products = load_products()
+        index = self._indexes()
         
         # Znajdź grupę dla tego produktu
-        target_group = None
-        for group in groups.values():
-            if product_id in group['product_ids']:
-                target_group = group
-                break
+        group_id = index['group_of_product'].get(product_id)
+        target_group = index['groups'][group_id] if group_id is not None else None
         
         if not target_group:
             return {
@@ -127,10 +172,9 @@ class SubstituteManager:
         substitute_products = []
         for pid in target_group['product_ids']:
             if pid != product_id:
-                product = next((p for p in products if p['id'] == pid), None)
+                product = index['products_by_id'].get(pid)
                 if product:
-                    product['priority'] = target_group['priority_map'].get(pid, 99)
-                    substitute_products.append(product)
+                    substitute_products.append(dict(product, priority=self._priority(target_group, pid)))
         
         # Sortuj według priorytetu
         substitute_products.sort(key=lambda x: x['priority'])
@@ -138,7 +182,7 @@ class SubstituteManager:
         return {
             'group_id': target_group['group_id'],
             'substitutes': substitute_products,
-            'settings': target_group['settings']
+            'settings': dict(target_group['settings'])
         }
     
     def find_best_substitute_offers(self, product_id, requested_quantity, max_price_increase_percent=20.0):
@@ -244,18 +288,16 @@ class SubstituteManager:
     
     def get_all_substitute_groups(self):
         """Zwraca wszystkie grupy zamienników z dodatkowymi informacjami"""
-        groups = self.load_substitute_groups()
-        products = load_products()
+        index = self._indexes()
         
         enriched_groups = []
         
-        for group in groups.values():
+        for group in index['groups'].values():
             group_products = []
             for pid in group['product_ids']:
-                product = next((p for p in products if p['id'] == pid), None)
+                product = index['products_by_id'].get(pid)
                 if product:
-                    product['priority'] = group['priority_map'].get(pid, 99)
-                    group_products.append(product)
+                    group_products.append(dict(product, priority=self._priority(group, pid)))
             
             group_products.sort(key=lambda x: x['priority'])
             
@@ -265,7 +307,7 @@ class SubstituteManager:
                 'created': group['created'],
                 'product_count': len(group_products),
                 'products': group_products,
-                'settings': group['settings']
+                'settings': dict(group['settings'])
             })
         
         return enriched_groups
@@ -277,11 +319,11 @@ class SubstituteManager:
         
         modified = False
         
-        for group in groups.values():
+        for group in list(groups.values()):
             if product_id in group['product_ids']:
                 group['product_ids'].remove(product_id)
-                if product_id in group['priority_map']:
-                    del group['priority_map'][product_id]
+                group['priority_map'].pop(product_id, None)
+                group['priority_map'].pop(str(product_id), None)
                 group['updated'] = datetime.now().isoformat()
                 modified = True
                 
@@ -291,19 +333,16 @@ class SubstituteManager:
         
         if modified:
             # Zapisz grupy
-            with open(self.substitutes_file, 'w', encoding='utf-8') as f:
-                for group in groups.values():
-                    f.write(json.dumps(group, ensure_ascii=False) + '\n')
+            write_jsonl_atomic(self.substitutes_file, groups.values())
             
             # Usuń informację o grupie z produktu
             for product in products:
-                if product['id'] == product_id and 'substitute_group' in product:
-                    del product['substitute_group']
+                if product['id'] == product_id and product.get('substitute_group'):
+                    product['substitute_group'] = None
                     product['updated'] = datetime.now().isoformat()
             
-            with open('data/products.txt', 'w', encoding='utf-8') as f:
-                for product in products:
-                    f.write(json.dumps(product, ensure_ascii=False) + '\n')
+            write_jsonl_atomic(self.products_file, products)
+            self._index_from(groups, products)
     
     def update_group_settings(self, group_id, settings):
         """Aktualizuje ustawienia grupy zamienników"""
@@ -327,20 +366,17 @@ class SubstituteManager:
             product_ids = groups[group_id]['product_ids']
             for product in products:
                 if product['id'] in product_ids and product.get('substitute_group') == group_id:
-                    del product['substitute_group']
+                    product['substitute_group'] = None
                     product['updated'] = datetime.now().isoformat()
             
             # Usuń grupę
             del groups[group_id]
             
             # Zapisz zmiany
-            with open(self.substitutes_file, 'w', encoding='utf-8') as f:
-                for group in groups.values():
-                    f.write(json.dumps(group, ensure_ascii=False) + '\n')
+            write_jsonl_atomic(self.substitutes_file, groups.values())
             
-            with open('data/products.txt', 'w', encoding='utf-8') as f:
-                for product in products:
-                    f.write(json.dumps(product, ensure_ascii=False) + '\n')
+            write_jsonl_atomic(self.products_file, products)
+            self._index_from(groups, products)
             
             return True
         
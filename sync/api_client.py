@@ -9,10 +9,24 @@ from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any
 import logging
 
+from utils.metrics import metrics
+
 # Konfiguracja logowania
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Metryki klienta API
+API_REQUEST_SECONDS = metrics.histogram(
+    'sync_api_request_duration_seconds', 'Czas requestu API z ponowieniami', ('method', 'endpoint', 'outcome'),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+)
+API_RETRIES = metrics.counter('sync_api_retries_total', 'Ponowienia requestów API', ('endpoint',))
+BREAKER_TRANSITIONS = metrics.counter(
+    'sync_circuit_breaker_transitions_total', 'Zmiany stanu circuit breakera', ('state',)
+)
+BREAKER_STATE = metrics.gauge('sync_circuit_breaker_state', 'Stan circuit breakera (0 CLOSED, 1 HALF_OPEN, 2 OPEN)')
+BREAKER_STATE_CODES = {'CLOSED': 0, 'HALF_OPEN': 1, 'OPEN': 2}
+
 class CircuitBreaker:
     """Circuit Breaker pattern dla odporności na awarie API"""
     
@@ -23,13 +37,19 @@ class CircuitBreaker:
         self.last_failure_time = None
         self.state = 'CLOSED'  # CLOSED, OPEN, HALF_OPEN
     
+    def _set_state(self, state):
+        if state != self.state:
+            BREAKER_TRANSITIONS.labels(state).inc()
+        self.state = state
+        BREAKER_STATE.set(BREAKER_STATE_CODES[state])
+    
     def call(self, func):
         if self.state == 'OPEN':
             time_since_failure = time.time() - self.last_failure_time
             logger.info(f"Circuit breaker OPEN - time since failure: {time_since_failure:.1f}s, timeout: {self.timeout}s")
             
             if time_since_failure > self.timeout:
-                self.state = 'HALF_OPEN'
+                self._set_state('HALF_OPEN')
                 logger.info("Circuit breaker moving to HALF_OPEN state")
             else:
                 logger.info(f"Circuit breaker staying OPEN - {self.timeout - time_since_failure:.1f}s remaining")
@@ -38,7 +58,7 @@ class CircuitBreaker:
         try:
             result = func()
             if self.state == 'HALF_OPEN':
-                self.state = 'CLOSED'
+                self._set_state('CLOSED')
                 self.failure_count = 0
                 logger.info("Circuit breaker restored to CLOSED state")
             return result
@@ -47,9 +67,15 @@ class CircuitBreaker:
             self.last_failure_time = time.time()
             logger.error(f"Circuit breaker failure {self.failure_count}: {e}")
             if self.failure_count >= self.failure_threshold:
-                self.state = 'OPEN'
+                self._set_state('OPEN')
                 logger.error(f"Circuit breaker opened after {self.failure_count} failures")
             raise
+    
+    def seconds_until_retry(self) -> float:
+        """Ile sekund zostało do przejścia w HALF_OPEN (0 gdy nie jest OPEN)"""
+        if self.state != 'OPEN' or self.last_failure_time is None:
+            return 0.0
+        return max(0.0, self.timeout - (time.time() - self.last_failure_time))
         
 class PriceTrackerAPIClient:
     """Główny klient API z obsługą retry, circuit breaker i offline mode - DOSTOSOWANY DO endpoints/"""
@@ -75,7 +101,16 @@ class PriceTrackerAPIClient:
     def _request_with_retry(self, method: str, endpoint: str, 
                        max_retries: int = 3, **kwargs) -> Dict[str, Any]:
         """Wykonaj request z retry logic - POPRAWIONE DLA endpoints/ i PHP logiki"""
-        
+        started = time.perf_counter()
+        outcome = 'error'
+        try:
+            result = self._request_with_retry_attempts(method, endpoint, max_retries, **kwargs)
+            outcome = 'success' if not isinstance(result, dict) or result.get('success', True) else 'api_error'
+            return result
+        finally:
+            API_REQUEST_SECONDS.labels(method, endpoint, outcome).observe(time.perf_counter() - started)
+    
+    def _request_with_retry_attempts(self, method: str, endpoint: str, max_retries: int, **kwargs) -> Dict[str, Any]:
         def make_request():
             # Buduj URL dla endpoints/
             if not endpoint.startswith('/endpoints/'):
@@ -150,6 +185,7 @@ class PriceTrackerAPIClient:
                 
                 # Exponential backoff z jitter
                 wait_time = (2 ** attempt) + random.uniform(0, 1)
+                API_RETRIES.labels(endpoint).inc()
                 logger.warning(f"Request failed, retrying in {wait_time:.1f}s (attempt {attempt + 1}/{max_retries})")
                 time.sleep(wait_time)
             except Exception as e:
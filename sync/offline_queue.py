@@ -4,11 +4,18 @@ Kolejka offline do przechowywania operacji gdy API jest niedostępne - POPRAWION
 import json
 import os
 from datetime import datetime
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Callable
 import logging
 
+from utils.file_store import write_json_atomic
+from utils.metrics import metrics
+
 logger = logging.getLogger(__name__)
 
+# Metryki kolejki - głębokość liczona przy odczycie /metrics
+QUEUE_DEPTH = metrics.gauge('sync_queue_depth', 'Elementy w kolejce offline', ('status',))
+QUEUE_EVENTS = metrics.counter('sync_queue_events_total', 'Zdarzenia kolejki offline', ('event',))
+
 class OfflineQueue:
     """Kolejka operacji offline z persistent storage - POPRAWIONA"""
     
@@ -17,8 +24,12 @@ class OfflineQueue:
         self.queue: List[Dict[str, Any]] = []
         self.max_queue_size = 1000
         self.max_attempts = 3
+        self._listeners: List[Callable[[Dict[str, Any]], None]] = []
         self.ensure_data_dir()
         self.load_queue()
+        for status in ('pending', 'processing', 'failed'):
+            QUEUE_DEPTH.labels(status).set_function(
+                lambda status=status: sum(1 for item in self.queue if item.get('status') == status))
     
     def ensure_data_dir(self):
         """Upewnij się że folder data istnieje"""
@@ -57,8 +68,7 @@ class OfflineQueue:
             # POPRAWKA: Upewnij się że katalog istnieje
             os.makedirs(os.path.dirname(self.queue_file), exist_ok=True)
             
-            with open(self.queue_file, 'w', encoding='utf-8') as f:
-                json.dump(self.queue, f, ensure_ascii=False, indent=2)
+            write_json_atomic(self.queue_file, self.queue)
             logger.debug(f"Saved {len(self.queue)} items to offline queue")
         except IOError as e:
             logger.error(f"Error saving offline queue: {e}")
@@ -77,6 +87,7 @@ class OfflineQueue:
         if len(self.queue) >= self.max_queue_size:
             logger.warning("Queue is full, removing oldest item")
             self.queue.pop(0)
+            QUEUE_EVENTS.labels('dropped').inc()
         
         queue_item = {
             'id': self._generate_queue_id(),
@@ -96,7 +107,31 @@ class OfflineQueue:
         self.queue.sort(key=lambda x: (x['priority'], x['created_at']))
         
         self.save_queue()
+        QUEUE_EVENTS.labels('added').inc()
         logger.info(f"Added {action} to offline queue (queue size: {len(self.queue)})")
+        
+        self._notify_listeners(queue_item)
+    
+    def add_listener(self, callback: Callable[[Dict[str, Any]], None]):
+        """
+        Dodaj listener wywoływany po dodaniu elementu do kolejki
+        (np. scheduler sync'u budzi się zamiast pollować)
+        """
+        if callback not in self._listeners:
+            self._listeners.append(callback)
+    
+    def remove_listener(self, callback: Callable[[Dict[str, Any]], None]):
+        """Usuń listener kolejki"""
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+    
+    def _notify_listeners(self, queue_item: Dict[str, Any]):
+        """Powiadom listenery o nowym elemencie - błędy listenera nie psują zapisu"""
+        for callback in list(self._listeners):
+            try:
+                callback(queue_item)
+            except Exception as e:
+                logger.error(f"Error in queue listener: {e}")
     
     def _generate_queue_id(self) -> str:
         """Generuj unikalny ID dla elementu kolejki"""
@@ -124,6 +159,7 @@ class OfflineQueue:
         """Oznacz element jako ukończony i usuń z kolejki"""
         self.queue = [item for item in self.queue if item['id'] != queue_id]
         self.save_queue()
+        QUEUE_EVENTS.labels('completed').inc()
         logger.info(f"Removed completed item {queue_id} from queue")
     
     def mark_as_failed(self, queue_id: str, error: str):
@@ -138,9 +174,11 @@ class OfflineQueue:
                 if item['attempts'] >= self.max_attempts:
                     logger.error(f"Item {queue_id} failed after {self.max_attempts} attempts, removing from queue")
                     self.queue = [i for i in self.queue if i['id'] != queue_id]
+                    QUEUE_EVENTS.labels('abandoned').inc()
                 else:
                     # Reset status do pending dla kolejnej próby
                     item['status'] = 'pending'
+                    QUEUE_EVENTS.labels('retried').inc()
                     logger.warning(f"Item {queue_id} failed (attempt {item['attempts']}/{self.max_attempts}), will retry")
                 break
         self.save_queue()
@@ -9,6 +9,8 @@ from typing import Dict, List, Any, Optional
 import logging
 from datetime import datetime
 
+from utils.file_store import write_jsonl_atomic
+
 logger = logging.getLogger(__name__)
 
 # POPRAWKA: Globalne referencje do oryginalnych funkcji
@@ -32,18 +34,9 @@ class SyncWrapper:
         self.sync_manager = sync_manager
     
     def _should_sync(self) -> bool:
-        result = (self.sync_enabled and 
+        return (self.sync_enabled and 
                 self.sync_manager is not None and 
-                hasattr(self.sync_manager, 'sync_enabled') and
-                self.sync_manager.sync_enabled)
-        
-        print(f"DEBUG _should_sync: {result}")
-        print(f"  sync_enabled: {self.sync_enabled}")
-        print(f"  sync_manager exists: {self.sync_manager is not None}")
-        if self.sync_manager:
-            print(f"  manager.sync_enabled: {getattr(self.sync_manager, 'sync_enabled', 'MISSING')}")
-        
-        return result
+                getattr(self.sync_manager, 'sync_enabled', False))
     
     def _log_sync_action(self, action: str, success: bool, details: str = ""):
         """Loguj akcje synchronizacji"""
@@ -56,7 +49,8 @@ class SyncWrapper:
     
     def load_products(self) -> List[Dict[str, Any]]:
         """
-        Załaduj produkty z sync'iem startup'owym jeśli potrzeba
+        Załaduj produkty z lokalnego snapshotu (stale-while-revalidate).
+        Jeśli dane są nieświeże, sync robi worker w tle - request nie czeka.
         """
         try:
             original_func = _original_functions.get('load_products')
@@ -64,15 +58,9 @@ class SyncWrapper:
                 logger.error("Original load_products function not available")
                 return []
             
-            # Sprawdź czy potrzeba sync'u startowego
+            # Nieświeże dane - poproś worker'a o odświeżenie i serwuj to co jest
             if self._should_sync() and self._should_startup_sync():
-                logger.info("Performing startup sync before loading products")
-                try:
-                    sync_result = self.sync_manager.startup_sync()
-                    self._log_sync_action("startup_sync", sync_result['success'], 
-                                        f"Duration: {sync_result.get('duration', 0):.1f}s")
-                except Exception as e:
-                    logger.error(f"Startup sync failed: {e}")
+                self.sync_manager.request_refresh()
             
             products = original_func()
             
@@ -139,9 +127,7 @@ class SyncWrapper:
                 products = load_products()
                 products = [p for p in products if p['id'] != product_id]
                 
-                with open('data/products.txt', 'w', encoding='utf-8') as f:
-                    for product in products:
-                        f.write(json.dumps(product, ensure_ascii=False) + '\n')
+                write_jsonl_atomic('data/products.txt', products)
                 
                 return {'success': True, 'synced': False, 'fallback': True}
                     
@@ -170,9 +156,7 @@ class SyncWrapper:
                         links[i]['updated'] = datetime.now().isoformat()
                         break
                 
-                with open('data/product_links.txt', 'w', encoding='utf-8') as f:
-                    for link in links:
-                        f.write(json.dumps(link, ensure_ascii=False) + '\n')
+                write_jsonl_atomic('data/product_links.txt', links)
                 
                 return {'success': True, 'synced': False, 'fallback': True}
                     
@@ -193,9 +177,7 @@ class SyncWrapper:
                 links = self.load_links()
                 links = [l for l in links if l.get('id') != link_id]
                 
-                with open('data/product_links.txt', 'w', encoding='utf-8') as f:
-                    for link in links:
-                        f.write(json.dumps(link, ensure_ascii=False) + '\n')
+                write_jsonl_atomic('data/product_links.txt', links)
                 
                 return {'success': True, 'synced': False, 'fallback': True}
                     
@@ -447,16 +429,12 @@ class SyncWrapper:
     # ==========================================================================
     
     def _should_startup_sync(self) -> bool:
-        """Sprawdź czy potrzeba sync'u startowego"""
-        if not self.sync_manager:
+        """Sprawdź czy dane lokalne są nieświeże i trzeba je odświeżyć w tle"""
+        if not self.sync_manager or self.sync_manager.sync_in_progress:
             return False
         
         try:
-            if not hasattr(self.sync_manager, 'last_successful_sync') or not self.sync_manager.last_successful_sync:
-                return True
-            
-            time_since_sync = datetime.now() - self.sync_manager.last_successful_sync
-            return time_since_sync.total_seconds() > 3600
+            return self.sync_manager.is_data_stale()
         except Exception as e:
             logger.error(f"Error checking startup sync need: {e}")
             return False
@@ -776,9 +754,7 @@ def _save_shop_config_local(shop_config_data):
             configs[shop_id] = shop_config_data
             
             # Zapisz z powrotem (kopiuję z save_shop_config)
-            with open(config_file, 'w', encoding='utf-8') as f:
-                for config in configs.values():
-                    f.write(json.dumps(config, ensure_ascii=False) + '\n')
+            write_jsonl_atomic(config_file, configs.values())
             
             logger.info(f"Shop config saved directly to file: {shop_id}")
             
@@ -1011,6 +987,15 @@ def ensure_sync_ready():
         logger.error(f"Error checking sync readiness: {e}")
         return False
 
+def get_data_version() -> int:
+    """
+    Wersja danych zsynchronizowanych z API - rośnie gdy worker zapisze świeże dane.
+    Cache'e mogą jej używać jako części klucza.
+    """
+    if not _sync_wrapper or not _sync_wrapper.sync_manager:
+        return 0
+    return getattr(_sync_wrapper.sync_manager, 'data_version', 0)
+
 def get_sync_status_for_ui() -> Dict[str, Any]:
     """Pobierz status sync'u w formacie przyjaznym dla UI"""
     try:
@@ -1233,9 +1218,7 @@ def delete_product_api_first(product_id: int) -> Dict[str, Any]:
                 products = [p for p in products if p['id'] != product_id]
                 
                 # Zapisz bez usuniętego produktu
-                with open('data/products.txt', 'w', encoding='utf-8') as f:
-                    for product in products:
-                        f.write(json.dumps(product, ensure_ascii=False) + '\n')
+                write_jsonl_atomic('data/products.txt', products)
                 
                 # Usuń też powiązane linki i ceny
                 _cleanup_product_references(product_id)
@@ -1395,9 +1378,7 @@ def update_link_api_first(link_id: int, link_data: Dict[str, Any]) -> Dict[str,
                         break
                 
                 # Zapisz zaktualizowane linki
-                with open('data/product_links.txt', 'w', encoding='utf-8') as f:
-                    for link in links:
-                        f.write(json.dumps(link, ensure_ascii=False) + '\n')
+                write_jsonl_atomic('data/product_links.txt', links)
                 
                 return {
                     'success': True,
@@ -1434,9 +1415,7 @@ def delete_link_api_first(link_id: int) -> Dict[str, Any]:
                 links = [l for l in links if l.get('id') != link_id]
                 
                 # Zapisz bez usuniętego linku
-                with open('data/product_links.txt', 'w', encoding='utf-8') as f:
-                    for link in links:
-                        f.write(json.dumps(link, ensure_ascii=False) + '\n')
+                write_jsonl_atomic('data/product_links.txt', links)
                 
                 return {
                     'success': True,
@@ -1634,9 +1613,7 @@ def _fallback_delete_product_local(product_id: int) -> Dict[str, Any]:
         products = load_products()
         products = [p for p in products if p['id'] != product_id]
         
-        with open('data/products.txt', 'w', encoding='utf-8') as f:
-            for product in products:
-                f.write(json.dumps(product, ensure_ascii=False) + '\n')
+        write_jsonl_atomic('data/products.txt', products)
         
         # Cleanup related data
         _cleanup_product_references(product_id)
@@ -1658,17 +1635,13 @@ def _cleanup_product_references(product_id: int):
         links = load_links()
         links = [l for l in links if l.get('product_id') != product_id]
         
-        with open('data/product_links.txt', 'w', encoding='utf-8') as f:
-            for link in links:
-                f.write(json.dumps(link, ensure_ascii=False) + '\n')
+        write_jsonl_atomic('data/product_links.txt', links)
         
         # Usuń ceny
         prices = load_prices()
         prices = [p for p in prices if p.get('product_id') != product_id]
         
-        with open('data/prices.txt', 'w', encoding='utf-8') as f:
-            for price in prices:
-                f.write(json.dumps(price, ensure_ascii=False) + '\n')
+        write_jsonl_atomic('data/prices.txt', prices)
         
         # Usuń z grup zamienników
         try:
@@ -1696,9 +1669,7 @@ def _save_with_temp_update(product_id: int, product_data: Dict[str, Any]) -> Dic
                 products[i]['needs_sync'] = True
                 break
         
-        with open('data/products.txt', 'w', encoding='utf-8') as f:
-            for product in products:
-                f.write(json.dumps(product, ensure_ascii=False) + '\n')
+        write_jsonl_atomic('data/products.txt', products)
         
         return {
             'success': True,
@@ -1741,6 +1712,7 @@ __all__ = [
     
     # Helper functions
     'ensure_sync_ready',
+    'get_data_version',
     'get_sync_status_for_ui',
     'manual_sync_trigger',
     'get_offline_queue_info',
@@ -5,6 +5,7 @@ import os
 import json
 import threading
 import time
+import random
 from datetime import datetime, timedelta
 from typing import Dict, List, Any, Optional, Callable
 import logging
@@ -20,6 +21,7 @@ from utils.data_utils import (
     load_products, save_product, load_links, save_link, 
     load_prices, save_price, get_latest_prices
 )
+from utils.file_store import write_jsonl_atomic
 from shop_config import shop_config
 from substitute_manager import substitute_manager
 from user_manager import user_manager
@@ -38,7 +40,8 @@ class SyncManager:
         # Konfiguracja
         self.api_base_url = api_base_url
         self.sync_enabled = True
-        self.auto_sync_interval = 15  # 5 minut
+        self.auto_sync_interval = 300  # 5 minut - okresowa pełna rekoncyliacja
+        self.sync_interval_jitter = 0.1  # +/- 10% żeby instancje nie biły w API naraz
         
         # Status
         self.is_online = False
@@ -49,6 +52,28 @@ class SyncManager:
         # Background sync
         self.background_sync_thread = None
         self.background_sync_running = False
+        self.stale_after_seconds = 3600  # po tylu sekundach dane lokalne uznajemy za nieświeże
+        
+        # Scheduler - worker śpi aż coś go obudzi (enqueue, request_refresh, termin rekoncyliacji)
+        self._wake_event = threading.Event()
+        self._schedule_lock = threading.Lock()
+        self._refresh_requested = False
+        self._queue_first_event = None  # monotonic czas pierwszego nieobsłużonego enqueue
+        self._queue_last_event = None
+        self.queue_debounce_seconds = 0.2  # czekaj na kolejne zapisy...
+        self.queue_max_delay_seconds = 1.0  # ...ale nie dłużej niż tyle od pierwszego
+        self._next_reconcile_at = 0.0  # 0 = od razu po starcie
+        self._backoff_until = 0.0
+        self._backoff_seconds = 0.0
+        self.min_backoff_seconds = 5.0
+        self.max_backoff_seconds = 300.0
+        self._busy_until = 0.0
+        self.busy_retry_seconds = 2.0  # gdy trwa inny sync (np. force_sync_now) - spróbuj za chwilę
+        
+        # Wersja danych lokalnych - rośnie po każdym udanym sync'u,
+        # żeby cache'e wiedziały że przyszły świeże dane
+        self.data_version = 0
+        self._data_version_lock = threading.Lock()
         
         # Callback'i
         self.status_change_callbacks: List[Callable[[str, Dict], None]] = []
@@ -69,6 +94,9 @@ class SyncManager:
             # Sprawdź połączenie
             self._check_api_connection()
             
+            # Nowe zapisy w kolejce budzą scheduler
+            offline_queue.add_listener(self._on_queue_item_added)
+            
             # Uruchom background sync
             self._start_background_sync()
             
@@ -114,6 +142,37 @@ class SyncManager:
             except Exception as e:
                 logger.error(f"Error in status callback: {e}")
     
+    def _bump_data_version(self) -> int:
+        """Podbij wersję danych lokalnych po zapisaniu świeżych danych z API"""
+        with self._data_version_lock:
+            self.data_version += 1
+            return self.data_version
+    
+    def is_data_stale(self) -> bool:
+        """Sprawdź czy dane lokalne wymagają odświeżenia"""
+        if not self.last_successful_sync:
+            return True
+        time_since_sync = datetime.now() - self.last_successful_sync
+        return time_since_sync.total_seconds() > self.stale_after_seconds
+    
+    def request_refresh(self):
+        """
+        Poproś worker'a o odświeżenie danych (stale-while-revalidate).
+        Nie blokuje - wywołujący dalej korzysta z lokalnych danych.
+        """
+        with self._schedule_lock:
+            self._refresh_requested = True
+        self._wake_event.set()
+    
+    def _on_queue_item_added(self, queue_item: Dict[str, Any]):
+        """Listener offline queue - zaplanuj wysłanie zapisów (debounce/coalescing)"""
+        now = time.monotonic()
+        with self._schedule_lock:
+            if self._queue_first_event is None:
+                self._queue_first_event = now
+            self._queue_last_event = now
+        self._wake_event.set()
+    
     # =============================================================================
     # STARTUP SYNC - pełne pobieranie danych z API przy starcie
     # =============================================================================
@@ -173,6 +232,7 @@ class SyncManager:
             # Zakończ z sukcesem
             progress.complete_sync(True)
             self.last_successful_sync = datetime.now()
+            self._bump_data_version()
             
             result = {
                 'success': True,
@@ -222,9 +282,7 @@ class SyncManager:
             products = api_response.get('products', [])
             
             # Zapisz do lokalnego pliku
-            with open('data/products.txt', 'w', encoding='utf-8') as f:
-                for product in products:
-                    f.write(json.dumps(product, ensure_ascii=False) + '\n')
+            write_jsonl_atomic('data/products.txt', products)
             
             logger.info(f"Downloaded {len(products)} products from API")
             return {'success': True, 'count': len(products)}
@@ -244,9 +302,7 @@ class SyncManager:
             links = api_response.get('links', [])
             
             # Zapisz do lokalnego pliku
-            with open('data/product_links.txt', 'w', encoding='utf-8') as f:
-                for link in links:
-                    f.write(json.dumps(link, ensure_ascii=False) + '\n')
+            write_jsonl_atomic('data/product_links.txt', links)
             
             logger.info(f"Downloaded {len(links)} links from API")
             return {'success': True, 'count': len(links)}
@@ -280,9 +336,7 @@ class SyncManager:
                 local_prices.append(local_price)
             
             # Zapisz do lokalnego pliku
-            with open('data/prices.txt', 'w', encoding='utf-8') as f:
-                for price in local_prices:
-                    f.write(json.dumps(price, ensure_ascii=False) + '\n')
+            write_jsonl_atomic('data/prices.txt', local_prices)
             
             logger.info(f"Downloaded {len(local_prices)} prices from API")
             return {'success': True, 'count': len(local_prices)}
@@ -323,9 +377,7 @@ class SyncManager:
             groups = api_response.get('groups', [])  # ZMIEŃ substitute_groups → groups
             
             # Zapisz grupy do pliku
-            with open('data/substitutes.txt', 'w', encoding='utf-8') as f:
-                for group in groups:
-                    f.write(json.dumps(group, ensure_ascii=False) + '\n')
+            write_jsonl_atomic('data/substitutes.txt', groups)
             
             logger.info(f"Downloaded {len(groups)} substitute groups from API")
             return {'success': True, 'count': len(groups)}
@@ -552,46 +604,146 @@ class SyncManager:
             return
         
         self.background_sync_running = True
+        self._wake_event.clear()
         self.background_sync_thread = threading.Thread(target=self._background_sync_worker, daemon=True)
         self.background_sync_thread.start()
         logger.info("Started background sync worker")
     
     def _background_sync_worker(self):
-        """Worker thread dla background sync"""
+        """
+        Worker thread dla background sync - event-driven scheduler.
+        Śpi do najbliższego terminu (debounce kolejki, rekoncyliacja, backoff)
+        albo do obudzenia przez enqueue / request_refresh.
+        """
         while self.background_sync_running:
+            self._wake_event.wait(self._seconds_until_next_run())
+            self._wake_event.clear()
+            
+            if not self.background_sync_running:
+                break
+            
             try:
-                # Sprawdź czy trzeba robić sync
-                if self._should_run_background_sync():
-                    logger.info("Starting background synchronization")
-                    self.full_background_sync()
-                
-                # Przetwórz offline queue
-                if self.is_online and offline_queue:
-                    offline_queue.process_queue_with_api(self.api_client)
-                
-                # Sprawdź połączenie z API co jakiś czas
-                if not self.is_online:
-                    self._check_api_connection()
-                
-                # Poczekaj przed następną iteracją
-                time.sleep(60)  # Sprawdzaj co minutę
-                
+                self._run_scheduled_work()
             except Exception as e:
                 logger.error(f"Error in background sync worker: {e}")
-                time.sleep(120)  # Poczekaj dłużej po błędzie
+                self._schedule_backoff()
+    
+    def _queue_due_at(self) -> Optional[float]:
+        """Termin wysłania kolejki: koniec okna debounce, ale nie później niż max delay"""
+        if self._queue_first_event is None:
+            return None
+        return min(self._queue_last_event + self.queue_debounce_seconds,
+                   self._queue_first_event + self.queue_max_delay_seconds)
+    
+    def _seconds_until_next_run(self) -> float:
+        """Ile worker może spać do najbliższego zaplanowanego zadania"""
+        now = time.monotonic()
+        with self._schedule_lock:
+            if self._refresh_requested:
+                due = now
+            else:
+                due = self._next_reconcile_at
+                queue_due = self._queue_due_at()
+                if queue_due is not None:
+                    due = min(due, queue_due)
+        
+        # Podczas backoff'u / cudzego sync'u nic nie robimy - enqueue tylko zapisze termin
+        due = max(due, self._backoff_until, self._busy_until)
+        return max(0.0, due - now)
+    
+    def _run_scheduled_work(self):
+        """Wykonaj to, na co przyszedł termin"""
+        now = time.monotonic()
+        if now < self._backoff_until:
+            return
+        
+        if not self.is_online and not self._check_api_connection():
+            self._schedule_backoff()
+            return
+        
+        if self.sync_in_progress:
+            # Trwa inny sync - terminy zostają w przeszłości, więc bez odroczenia worker by się kręcił
+            self._defer_while_busy()
+            return
+        
+        with self._schedule_lock:
+            refresh_requested = self._refresh_requested
+            queue_due = self._queue_due_at()
+            self._refresh_requested = False
+        
+        # Sync startowy / odświeżenie nieświeżych danych
+        if self.is_data_stale():
+            logger.info("Local data is stale - running startup sync in background")
+            self._finish_sync_run(self.startup_sync(), refresh_requested)
+        # Okresowa rekoncyliacja albo prośba o odświeżenie
+        elif refresh_requested or self._should_run_background_sync():
+            logger.info("Starting background synchronization")
+            self._finish_sync_run(self.full_background_sync(), refresh_requested)
+        # Same nowe zapisy - wyślij kolejkę
+        elif queue_due is not None and now >= queue_due:
+            self._clear_queue_schedule()
+            queue_result = offline_queue.process_queue_with_api(self.api_client)
+            if queue_result.get('failed') or queue_result.get('skipped'):
+                # Zostały elementy - ponów po backoff'ie
+                self._on_queue_item_added({})
+                self._schedule_backoff()
+            else:
+                self._reset_backoff()
+    
+    def _finish_sync_run(self, result: Dict[str, Any], refresh_requested: bool = False):
+        """Zaplanuj kolejne uruchomienie po pełnym sync'u (sync przetwarza też kolejkę)"""
+        if result.get('success'):
+            self._clear_queue_schedule()
+            self._reset_backoff()
+            self._schedule_reconcile()
+        elif result.get('error') == 'Sync already in progress':
+            # Ubiegł nas inny sync między sprawdzeniem a startem - prośba o odświeżenie zostaje
+            self._defer_while_busy(refresh_requested)
+        else:
+            self._schedule_backoff()
+    
+    def _defer_while_busy(self, refresh_requested: bool = False):
+        """Odłóż zaplanowaną pracę o busy_retry_seconds, nie gubiąc prośby o odświeżenie"""
+        if refresh_requested:
+            with self._schedule_lock:
+                self._refresh_requested = True
+        self._busy_until = time.monotonic() + self.busy_retry_seconds
+    
+    def _clear_queue_schedule(self):
+        with self._schedule_lock:
+            self._queue_first_event = None
+            self._queue_last_event = None
+    
+    def _schedule_reconcile(self):
+        """Następna pełna rekoncyliacja za auto_sync_interval +/- jitter"""
+        jitter = random.uniform(-self.sync_interval_jitter, self.sync_interval_jitter)
+        self._next_reconcile_at = time.monotonic() + self.auto_sync_interval * (1 + jitter)
+    
+    def _schedule_backoff(self):
+        """Wykładniczy backoff z jitterem - nie krócej niż zostało circuit breaker'owi"""
+        if self._backoff_seconds:
+            self._backoff_seconds = min(self._backoff_seconds * 2, self.max_backoff_seconds)
+        else:
+            self._backoff_seconds = self.min_backoff_seconds
+        
+        delay = self._backoff_seconds * random.uniform(0.8, 1.2)
+        breaker = getattr(self.api_client, 'circuit_breaker', None)
+        if breaker is not None:
+            delay = max(delay, breaker.seconds_until_retry())
+        
+        self._backoff_until = time.monotonic() + delay
+        logger.info(f"Background sync backing off for {delay:.1f}s")
+    
+    def _reset_backoff(self):
+        self._backoff_seconds = 0.0
+        self._backoff_until = 0.0
     
     def _should_run_background_sync(self) -> bool:
         """Sprawdź czy należy uruchomić background sync"""
         if not self.is_online or self.sync_in_progress:
             return False
         
-        # Sprawdź czy minął odpowiedni czas od ostatniego sync'u
-        if self.last_successful_sync:
-            time_since_sync = datetime.now() - self.last_successful_sync
-            return time_since_sync.total_seconds() > self.auto_sync_interval
-        
-        # Jeśli nigdy nie było sync'u, zrób go
-        return True
+        return time.monotonic() >= self._next_reconcile_at
     
     def full_background_sync(self) -> Dict[str, Any]:
         """
@@ -653,6 +805,7 @@ class SyncManager:
             # Krok 8: Finalizacja
             progress.update_progress(8, "Finalizing...")
             self.last_successful_sync = datetime.now()
+            self._bump_data_version()
             
             progress.complete_sync(True)
             
@@ -837,9 +990,7 @@ class SyncManager:
                         break
                 
                 # Zapisz zaktualizowane produkty
-                with open('data/products.txt', 'w', encoding='utf-8') as f:
-                    for product in products:
-                        f.write(json.dumps(product, ensure_ascii=False) + '\n')
+                write_jsonl_atomic('data/products.txt', products)
             
             elif entity_type == 'link':
                 # Aktualizuj link
@@ -850,9 +1001,7 @@ class SyncManager:
                         break
                 
                 # Zapisz zaktualizowane linki
-                with open('data/product_links.txt', 'w', encoding='utf-8') as f:
-                    for link in links:
-                        f.write(json.dumps(link, ensure_ascii=False) + '\n')
+                write_jsonl_atomic('data/product_links.txt', links)
             
             elif entity_type == 'shop_config':
                 # Aktualizuj konfigurację sklepu
@@ -948,7 +1097,8 @@ class SyncManager:
             'user_id': self.user_id,
             'api_url': self.api_base_url,
             'offline_queue_size': len(offline_queue),
-            'background_sync_running': self.background_sync_running
+            'background_sync_running': self.background_sync_running,
+            'data_version': self.data_version
         }
     
     def force_sync_now(self) -> Dict[str, Any]:
@@ -959,6 +1109,7 @@ class SyncManager:
     def pause_background_sync(self):
         """Zatrzymaj background sync"""
         self.background_sync_running = False
+        self._wake_event.set()  # obudź worker'a żeby szybko wyszedł z pętli
         if self.background_sync_thread:
             self.background_sync_thread.join(timeout=5)
         logger.info("Background sync paused")
@@ -983,6 +1134,7 @@ class SyncManager:
     def shutdown(self):
         """Bezpieczne zamknięcie sync manager'a"""
         logger.info("Shutting down SyncManager")
+        offline_queue.remove_listener(self._on_queue_item_added)
         self.pause_background_sync()
         
         # Ostatni sync przed zamknięciem jeśli online
@@ -3,12 +3,123 @@ System trackingu postępu synchronizacji z callback'ami dla UI
 """
 from datetime import datetime
 from typing import Callable, Dict, Any, List, Optional
+from collections import deque
+import heapq
+import itertools
 import threading
 import time
 import logging
 
+from utils.metrics import metrics
+
 logger = logging.getLogger(__name__)
 
+# Po ilu sekundach zakończone operacje znikają z managera (UI zdąży pokazać wynik)
+COMPLETED_RETENTION_SECONDS = 300
+
+
+class _CallbackDispatcher:
+    """
+    Wywołuje callback'i postępu w jednym wątku tła z ograniczonej kolejki.
+    Wątek sync'u tylko dokłada zadanie - nigdy nie czeka na UI. Przy pełnej
+    kolejce raporty postępu są pomijane (następny i tak je zastąpi), a zakończenia
+    (essential) trafiają do kolejki zawsze, więc żaden wynik sync'u nie przepada.
+    """
+    
+    def __init__(self, max_pending: int = 1000):
+        self.max_pending = max_pending
+        self._tasks: deque = deque()
+        self._optional = 0  # zadania które wolno pominąć (limit max_pending)
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self.dropped = 0
+    
+    def submit(self, callbacks: List[Callable], args: tuple, essential: bool = False):
+        """Zleć wywołanie callback'ów z args - bez blokowania wołającego"""
+        if not callbacks:
+            return
+        with self._cond:
+            if not essential:
+                if self._optional >= self.max_pending:
+                    self.dropped += 1
+                    return
+                self._optional += 1
+            self._tasks.append((list(callbacks), args, essential))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True, name='sync-progress-callbacks')
+                self._thread.start()
+            self._cond.notify()
+    
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._tasks)
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._tasks:
+                    self._cond.wait()
+                callbacks, args, essential = self._tasks.popleft()
+                if not essential:
+                    self._optional -= 1
+            for callback in callbacks:
+                try:
+                    callback(*args)
+                except Exception as e:
+                    logger.error(f"Error in sync progress callback: {e}")
+
+
+class _ExpirySweeper:
+    """
+    Jeden wątek usuwający wpisy po terminie - kopiec (termin, nr, callback)
+    zamiast osobnego threading.Timer na każdą operację.
+    """
+    
+    def __init__(self):
+        self._heap: List[tuple] = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+    
+    def schedule(self, delay: float, callback: Callable[[], None]):
+        """Wywołaj callback() za delay sekund (w wątku sweepera)"""
+        with self._cond:
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._counter), callback))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True, name='sync-progress-expiry')
+                self._thread.start()
+            self._cond.notify()
+    
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._heap)
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                deadline, _, callback = self._heap[0]
+                wait = deadline - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue  # nowy wcześniejszy termin albo koniec czekania - sprawdź od nowa
+                heapq.heappop(self._heap)
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Error in sync progress expiry: {e}")
+
+
+# Wspólny dyspozytor callback'ów dla wszystkich SyncProgress
+_callback_dispatcher = _CallbackDispatcher()
+
+# Metryki - liczone przy odczycie /metrics
+CALLBACKS_PENDING = metrics.gauge('sync_progress_callbacks_pending', "Callback'i postępu czekające w kolejce")
+CALLBACKS_PENDING.set_function(_callback_dispatcher.pending)
+CALLBACKS_DROPPED = metrics.gauge('sync_progress_callbacks_dropped', "Callback'i postępu pominięte przy pełnej kolejce")
+CALLBACKS_DROPPED.set_function(lambda: _callback_dispatcher.dropped)
+
 class SyncProgress:
     """Klasa do monitorowania postępu synchronizacji"""
     
@@ -28,6 +139,9 @@ class SyncProgress:
         
         # Thread safety
         self._lock = threading.Lock()
+        
+        # Wewnętrzny hook managera (planowanie usunięcia po zakończeniu)
+        self._on_complete: Optional[Callable[['SyncProgress'], None]] = None
     
     def add_progress_callback(self, callback: Callable[[int, str, Dict], None]):
         """
@@ -105,7 +219,7 @@ class SyncProgress:
         logger.info(f"Sync completed - Success: {success}, Duration: {self.get_duration()}")
         
         # Notify callbacks
-        self._notify_progress_callbacks()
+        self._notify_progress_callbacks(essential=True)
         self._notify_completion_callbacks(success, error)
     
     def get_progress_percent(self) -> int:
@@ -152,22 +266,25 @@ class SyncProgress:
                 'details': self.details.copy()
             }
     
-    def _notify_progress_callbacks(self):
-        """Wywołaj wszystkie callback'i postępu"""
+    def _notify_progress_callbacks(self, essential: bool = False):
+        """Zleć callback'i postępu (migawka statusu z tego wątku, wywołanie w tle)"""
+        if not self.progress_callbacks:
+            return
         status = self.get_status_dict()
-        for callback in self.progress_callbacks:
-            try:
-                callback(status['progress_percent'], self.current_operation, status)
-            except Exception as e:
-                logger.error(f"Error in progress callback: {e}")
+        _callback_dispatcher.submit(
+            self.progress_callbacks,
+            (status['progress_percent'], status['current_operation'], status),
+            essential=essential
+        )
     
     def _notify_completion_callbacks(self, success: bool, error: Optional[str]):
-        """Wywołaj wszystkie callback'i zakończenia"""
-        for callback in self.completion_callbacks:
+        """Zleć callback'i zakończenia (wywołanie w tle)"""
+        _callback_dispatcher.submit(self.completion_callbacks, (success, error), essential=True)
+        if self._on_complete is not None:
             try:
-                callback(success, error)
+                self._on_complete(self)
             except Exception as e:
-                logger.error(f"Error in completion callback: {e}")
+                logger.error(f"Error in sync completion hook: {e}")
 
 class BatchProgress:
     """Klasa do trackingu postępu operacji batch'owych"""
@@ -238,31 +355,40 @@ class BatchProgress:
 class SyncProgressManager:
     """Manager do obsługi wielu równoczesnych operacji sync'u"""
     
-    def __init__(self):
+    def __init__(self, retention_seconds: float = COMPLETED_RETENTION_SECONDS):
         self.active_syncs: Dict[str, SyncProgress] = {}
         self.active_batches: Dict[str, BatchProgress] = {}
+        self.retention_seconds = retention_seconds
         self._lock = threading.Lock()
+        self._sweeper = _ExpirySweeper()
     
     def create_sync(self, sync_id: str, total_steps: int, operation: str = "Starting...") -> SyncProgress:
         """Utwórz nowy sync progress"""
+        sync_progress = SyncProgress()
+        # Zakończenie bezpośrednio na obiekcie (jak w SyncManager) też planuje usunięcie
+        sync_progress._on_complete = lambda progress: self._expire_later(self.active_syncs, sync_id, progress)
+        sync_progress.start_sync(total_steps, operation)
         with self._lock:
-            sync_progress = SyncProgress()
-            sync_progress.start_sync(total_steps, operation)
             self.active_syncs[sync_id] = sync_progress
-            return sync_progress
+        return sync_progress
     
     def get_sync(self, sync_id: str) -> Optional[SyncProgress]:
         """Pobierz sync progress po ID"""
         return self.active_syncs.get(sync_id)
     
     def complete_sync(self, sync_id: str, success: bool = True, error: str = None):
-        """Zakończ sync i usuń z aktywnych"""
-        with self._lock:
-            if sync_id in self.active_syncs:
-                sync_progress = self.active_syncs[sync_id]
-                sync_progress.complete_sync(success, error)
-                # Usuń po 5 minutach (żeby UI mogło jeszcze pokazać wynik)
-                threading.Timer(300, lambda: self.active_syncs.pop(sync_id, None)).start()
+        """Zakończ sync i usuń z aktywnych (po retention_seconds - UI zdąży pokazać wynik)"""
+        sync_progress = self.active_syncs.get(sync_id)
+        if sync_progress is not None:
+            sync_progress.complete_sync(success, error)  # hook planuje usunięcie
+    
+    def _expire_later(self, registry: Dict[str, Any], item_id: str, item: Any):
+        """Zaplanuj usunięcie wpisu - tylko jeśli pod tym ID nadal jest ten sam obiekt"""
+        def expire():
+            with self._lock:
+                if registry.get(item_id) is item:
+                    del registry[item_id]
+        self._sweeper.schedule(self.retention_seconds, expire)
     
     def create_batch(self, batch_id: str, batch_name: str, total_items: int) -> BatchProgress:
         """Utwórz nowy batch progress"""
@@ -277,10 +403,9 @@ class SyncProgressManager:
     
     def complete_batch(self, batch_id: str):
         """Zakończ batch i usuń z aktywnych"""
-        with self._lock:
-            if batch_id in self.active_batches:
-                # Usuń po 5 minutach
-                threading.Timer(300, lambda: self.active_batches.pop(batch_id, None)).start()
+        batch_progress = self.active_batches.get(batch_id)
+        if batch_progress is not None:
+            self._expire_later(self.active_batches, batch_id, batch_progress)
     
     def get_all_active(self) -> Dict[str, Any]:
         """Pobierz status wszystkich aktywnych operacji"""
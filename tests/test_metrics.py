@@ -0,0 +1,14 @@
+"""
+Format tekstowy Prometheusa - escapowanie opisu (HELP) i wartości etykiet
+"""
+from utils.metrics import MetricsRegistry
+
+
+def test_help_escapes_only_backslash_and_newline():
+    registry = MetricsRegistry(prefix='test_')
+    counter = registry.counter('events_total', 'Zdarzenia "sync"\nścieżka C:\\data', ['source'])
+    counter.labels('say "hi"').inc()
+
+    lines = registry.render().splitlines()
+    assert lines[0] == '# HELP test_events_total Zdarzenia "sync"\\nścieżka C:\\\\data'
+    assert lines[2] == 'test_events_total{source="say \\"hi\\""} 1'
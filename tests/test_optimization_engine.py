@@ -0,0 +1,136 @@
+"""
+Silnik optymalizacji - wyniki podawane jako dokładne porównane z pełnym
+przeglądem kombinacji na nieprzyciętych ofertach (małe katalogi z ziarnem)
+"""
+import functools
+import random
+import types
+from itertools import combinations
+
+import pytest
+
+from optimization_benchmark import generate_catalog, synthetic_data_dir
+from optimization_engine import OptimizationEngine
+from optimization_trace import OptimizationTrace
+
+# Sklepy z progiem darmowej dostawy - droższa oferta w sklepie może się opłacić
+THRESHOLD_CASES = [(seed, free_from, delivery_cost)
+                   for seed in range(6) for free_from, delivery_cost in ((60, 19.99), (100, 14.99))]
+
+
+def _catalog(seed, free_from, delivery_cost):
+    catalog = generate_catalog(seed=seed, products=10, shops=5, basket_size=5, max_shops=3,
+                               price_dispersion=0.4, coverage=0.8, substitute_groups=1, threshold_share=1.0)
+    for config in catalog['shop_configs'].values():
+        config['delivery_free_from'] = free_from
+        config['delivery_cost'] = delivery_cost
+    return catalog
+
+
+def _engine():
+    return OptimizationEngine({'max_shops': 3}, OptimizationTrace())
+
+
+def _unpruned(engine, catalog):
+    grouped_needs = engine._group_substitute_products_with_combining(catalog['basket'])
+    expanded_offers, _ = engine._expand_offers_with_substitutes(grouped_needs,
+                                                                engine._normalize_prices(catalog['prices']))
+    need_keys = [need_key for need_key, offers in expanded_offers.items() if offers]
+    return expanded_offers, need_keys, grouped_needs
+
+
+def _brute_force_cost(catalog):
+    engine = _engine()
+    expanded_offers, need_keys, grouped_needs = _unpruned(engine, catalog)
+    result = engine._exhaustive_search_with_shop_filter(expanded_offers, need_keys, grouped_needs,
+                                                        catalog['shop_configs'])
+    return result['total_cost']
+
+
+@pytest.mark.parametrize('seed,free_from,delivery_cost', THRESHOLD_CASES)
+def test_pipeline_matches_unpruned_brute_force(seed, free_from, delivery_cost):
+    catalog = _catalog(seed, free_from, delivery_cost)
+    with synthetic_data_dir(catalog):
+        result = _engine().optimize_basket(catalog['basket'], catalog['products'],
+                                           catalog['prices'], catalog['shop_configs'])
+        assert result['best_option']['total_cost'] == pytest.approx(_brute_force_cost(catalog), abs=0.005)
+
+
+def _pruned(engine, catalog):
+    expanded_offers, need_keys, grouped_needs = _unpruned(engine, catalog)
+    expanded_offers = engine._advanced_preprocessing(expanded_offers, need_keys, catalog['shop_configs'],
+                                                     grouped_needs)
+    return expanded_offers, need_keys, grouped_needs
+
+
+@pytest.mark.parametrize('seed,free_from,delivery_cost', THRESHOLD_CASES)
+def test_shop_subsets_exact_claim_matches_unpruned_brute_force(seed, free_from, delivery_cost):
+    catalog = _catalog(seed, free_from, delivery_cost)
+    with synthetic_data_dir(catalog):
+        engine = _engine()
+        expanded_offers, need_keys, grouped_needs = _pruned(engine, catalog)
+        result = engine._shop_subset_search(expanded_offers, need_keys, grouped_needs, catalog['shop_configs'])
+        assert engine.stats['exact_solution']
+        assert result['total_cost'] == pytest.approx(_brute_force_cost(catalog), abs=0.005)
+        assert engine.cost_lower_bound <= result['total_cost'] + 0.005
+
+
+def test_rank_limit_disables_exact_claim():
+    catalog = _catalog(1, 60, 19.99)
+    with synthetic_data_dir(catalog):
+        engine = OptimizationEngine({'max_shops': 3, 'max_offers_per_need': 1}, OptimizationTrace())
+        expanded_offers, need_keys, grouped_needs = _pruned(engine, catalog)
+        engine._shop_subset_search(expanded_offers, need_keys, grouped_needs, catalog['shop_configs'])
+        assert not engine.pruning_lossless
+        assert not engine.stats['exact_solution']
+
+
+def _brute_force_cover_size(shops_per_need):
+    shops = sorted(set().union(*shops_per_need))
+    for size in range(len(shops) + 1):
+        for subset in combinations(shops, size):
+            if all(need_shops & set(subset) for need_shops in shops_per_need):
+                return size
+    return None
+
+
+def _random_cover_instances(count):
+    rng = random.Random(7)
+    for _ in range(count):
+        shops = [f'shop{index}' for index in range(rng.randint(2, 7))]
+        yield [set(rng.sample(shops, rng.randint(1, len(shops)))) for _ in range(rng.randint(1, 9))]
+
+
+# Zachłanny bierze sklep A (4 potrzeby) i potrzebuje jeszcze dwóch; optimum to B + C
+GREEDY_TRAP = [{'A', 'B'}, {'A', 'C'}, {'A', 'B'}, {'A', 'C'}, {'B'}, {'C'}]
+
+
+def test_exact_set_cover_matches_brute_force():
+    engine = _engine()
+    for shops_per_need in list(_random_cover_instances(200)) + [GREEDY_TRAP]:
+        cover, lower_bound = engine._exact_set_cover(shops_per_need)
+        assert all(need_shops & cover for need_shops in shops_per_need)
+        assert len(cover) == lower_bound == _brute_force_cover_size(shops_per_need)
+
+
+def test_exact_set_cover_node_limit_returns_lower_bound():
+    engine = _engine()
+    cover, lower_bound = engine._exact_set_cover(GREEDY_TRAP, max_nodes=1)
+    assert all(need_shops & cover for need_shops in GREEDY_TRAP)
+    assert len(cover) == 3 and lower_bound == 2
+
+    for shops_per_need in _random_cover_instances(200):
+        cover, lower_bound = engine._exact_set_cover(shops_per_need, max_nodes=2)
+        assert all(need_shops & cover for need_shops in shops_per_need)
+        assert lower_bound <= _brute_force_cover_size(shops_per_need) <= len(cover)
+
+
+def test_minimum_shops_after_node_limit_is_a_lower_bound():
+    engine = _engine()
+    engine._exact_set_cover = functools.partial(engine._exact_set_cover, max_nodes=1)
+    expanded_offers = {f'need_{index}': [types.SimpleNamespace(shop=engine._shop_code(shop))
+                                                for shop in sorted(shops)]
+                       for index, shops in enumerate(GREEDY_TRAP)}
+
+    assert engine._calculate_minimum_shops_required(expanded_offers, list(expanded_offers)) == 2
+    assert engine.stats['min_shops_exact'] is False
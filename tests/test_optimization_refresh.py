@@ -0,0 +1,85 @@
+"""
+Przeliczanie koszyków po zmianach cen - zmiany nieprzeliczonych koszyków
+nie mogą przepaść (błąd partii, nieudany koszyk)
+"""
+import sys
+import types
+
+import pytest
+
+from optimization_refresh import MAX_REFRESH_ATTEMPTS, OptimizationRefreshScheduler
+
+
+def _price(product_id, shop_id, price):
+    return {'product_id': product_id, 'shop_id': shop_id, 'price': f'{price:.2f}', 'currency': 'PLN'}
+
+
+def _basket(basket_id, product_id):
+    return {'basket_id': basket_id,
+            'basket_items': {str(product_id): {'product_id': product_id, 'requested_quantity': 1}}}
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    baskets = {'b1': _basket('b1', 1), 'b2': _basket('b2', 2)}
+    batch_calls = []
+    outcome = {}
+
+    def optimize_baskets(basket_ids, workers=None, time_budget_ms=None):
+        batch_calls.append(sorted(basket_ids))
+        if isinstance(outcome.get('batch'), Exception):
+            raise outcome['batch']
+        return {'success': True, 'summary': {},
+                'results': {basket_id: {'success': basket_id not in outcome.get('failed', ())}
+                            for basket_id in basket_ids}}
+
+    monkeypatch.setitem(sys.modules, 'basket_manager', types.SimpleNamespace(
+        basket_manager=types.SimpleNamespace(load_baskets=lambda: baskets)))
+    monkeypatch.setitem(sys.modules, 'optimization_batch', types.SimpleNamespace(
+        optimize_baskets=optimize_baskets))
+    monkeypatch.setitem(sys.modules, 'substitute_manager', types.SimpleNamespace(
+        substitute_manager=types.SimpleNamespace(load_substitute_groups=lambda: {})))
+
+    refresh = OptimizationRefreshScheduler()
+    refresh._product_prices = {1: {'allegro': 10.0}, 2: {'allegro': 20.0}}
+    refresh.batch_calls = batch_calls
+    refresh.outcome = outcome
+    return refresh
+
+
+def test_changes_kept_when_batch_raises(scheduler):
+    scheduler.on_price_saved(_price(1, 'allegro', 9.0))
+    scheduler.on_price_saved(_price(2, 'allegro', 19.0))
+    scheduler.outcome['batch'] = RuntimeError('pula padła')
+
+    with pytest.raises(RuntimeError):
+        scheduler.refresh()
+    assert scheduler._pending == {(1, 'allegro'): (10.0, 9.0), (2, 'allegro'): (20.0, 19.0)}
+
+    scheduler.outcome.clear()
+    assert scheduler.refresh()['reoptimized'].keys() == {'b1', 'b2'}
+    assert scheduler.pending_changes() == 0
+
+
+def test_only_failed_basket_changes_requeued(scheduler):
+    scheduler.on_price_saved(_price(1, 'allegro', 9.0))
+    scheduler.on_price_saved(_price(2, 'allegro', 19.0))
+    scheduler.outcome['failed'] = {'b2'}
+
+    assert scheduler.refresh()['requeued'] == 1
+    assert scheduler._pending == {(2, 'allegro'): (20.0, 19.0)}
+
+    # Zmiana tej samej oferty w trakcie - stara cena sprzed pierwszej zmiany zostaje
+    scheduler.on_price_saved(_price(2, 'allegro', 18.0))
+    assert scheduler._pending == {(2, 'allegro'): (20.0, 18.0)}
+
+
+def test_failing_change_dropped_after_max_attempts(scheduler):
+    scheduler.on_price_saved(_price(2, 'allegro', 19.0))
+    scheduler.outcome['failed'] = {'b2'}
+
+    for _ in range(MAX_REFRESH_ATTEMPTS):
+        scheduler.refresh()
+    assert len(scheduler.batch_calls) == MAX_REFRESH_ATTEMPTS
+    assert scheduler.pending_changes() == 0
+    assert scheduler.stats['changes_dropped'] == 1
@@ -0,0 +1,84 @@
+"""
+Magazyn historii cen - indeks musi nadążać za przepisaniami prices.txt
+(edycja / usunięcie ceny), nie tylko za dopisaniami
+"""
+import json
+
+from utils.file_store import append_jsonl, write_jsonl_atomic
+from utils.price_history import PriceHistoryStore
+
+
+def _price(product_id, shop_id, day, price):
+    return {
+        'product_id': product_id,
+        'shop_id': shop_id,
+        'price': price,
+        'currency': 'PLN',
+        'created': f'2024-03-{day:02d}T12:00:00',
+    }
+
+
+def _newest_first(records):
+    return sorted(records, key=lambda r: r['created'], reverse=True)
+
+
+def _store(tmp_path):
+    return PriceHistoryStore(str(tmp_path / 'prices.txt'), str(tmp_path / 'price_history'))
+
+
+def test_page_after_two_rewrites(tmp_path):
+    prices_file = str(tmp_path / 'prices.txt')
+    records = [_price(1, 'allegro', 1, 10.0), _price(2, 'ceneo', 2, 20.0),
+               _price(1, 'ceneo', 3, 11.0), _price(2, 'allegro', 4, 21.0)]
+    write_jsonl_atomic(prices_file, records)
+    store = _store(tmp_path)
+    assert store.page(0, 10) == (4, _newest_first(records))
+
+    # Dwa przepisania - system plików może oddać ten sam inode co przed pierwszym,
+    # a plik po edycji (dodane URL-e) nie jest krótszy niż zaindeksowany offset
+    records = [r for r in records if r['created'] != '2024-03-02T12:00:00']
+    write_jsonl_atomic(prices_file, records)
+    records = [dict(r, url=f"https://allegro.pl/oferta/{r['product_id']}-{'x' * 80}")
+               for r in records if r['shop_id'] != 'ceneo']
+    write_jsonl_atomic(prices_file, records)
+
+    assert store.page(0, 10) == (2, _newest_first(records))
+    assert store.shop_ids() == ['allegro']
+
+    # Dopisanie po przepisaniu dalej doczytuje tylko ogon
+    appended = _price(3, 'morele', 5, 30.0)
+    append_jsonl(prices_file, appended)
+    assert store.page(0, 10) == (3, _newest_first(records + [appended]))
+
+
+def test_snapshot_ignored_after_rewrite(tmp_path):
+    prices_file = str(tmp_path / 'prices.txt')
+    records = [_price(1, 'allegro', day, 10.0 + day) for day in range(1, 6)]
+    write_jsonl_atomic(prices_file, records)
+    store = _store(tmp_path)
+    store.refresh()
+    store.save_snapshot()
+
+    records = [_price(2, 'mediaexpert', day, 20.0 + day) for day in range(1, 7)]
+    write_jsonl_atomic(prices_file, records)
+    write_jsonl_atomic(prices_file, records)
+
+    # Zimny start z nieaktualnym snapshotem
+    assert _store(tmp_path).page(0, 10) == (6, _newest_first(records))
+
+
+def test_rewrite_in_place_outside_file_store(tmp_path):
+    prices_file = str(tmp_path / 'prices.txt')
+    records = [_price(1, 'allegro', 1, 10.0), _price(1, 'allegro', 2, 12.0)]
+    write_jsonl_atomic(prices_file, records)
+    store = _store(tmp_path)
+    assert store.page(0, 10)[0] == 2
+
+    # Ręczna edycja tego samego pliku (ten sam inode, rozmiar nie mniejszy)
+    records = [_price(1, 'mediaexpert', 1, 99.0), _price(1, 'mediaexpert', 2, 98.0)]
+    with open(prices_file, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+
+    assert store.page(0, 10) == (2, _newest_first(records))
+    assert store.shop_ids() == ['mediaexpert']
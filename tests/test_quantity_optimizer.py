@@ -0,0 +1,88 @@
+"""
+Dokupienie sztuk do progu darmowej dostawy - plecak po groszach porównany
+z pełnym przeglądem dodatkowych sztuk na małych danych
+"""
+import random
+from itertools import product
+
+import pytest
+
+from quantity_optimizer import QuantityOptimizer, find_free_shipping_top_up
+
+
+def _item(product_id, unit_price, quantity=1, **extra):
+    return dict({'product_id': product_id, 'product_name': f'Produkt {product_id}', 'unit_price_pln': unit_price,
+                 'quantity': quantity, 'total_price_pln': unit_price * quantity}, **extra)
+
+
+def _brute_force_top_up(items, missing_amount, max_quantity_multiplier):
+    """Najmniejsza dopłata w groszach (None gdy progu nie da się dobić)"""
+    target = round(missing_amount * 100)
+    ranges = [range(1 if item.get('is_group') else int(item['quantity'] * max_quantity_multiplier) - item['quantity'] + 1)
+              for item in items]
+    costs = [sum(round(item['unit_price_pln'] * 100) * units for item, units in zip(items, extra))
+             for extra in product(*ranges)]
+    reaching = [cost for cost in costs if cost >= target and cost > 0]
+    return min(reaching) if reaching else None
+
+
+def test_top_up_matches_brute_force():
+    rng = random.Random(3)
+    for _ in range(300):
+        items = [_item(index, round(rng.uniform(0.5, 40), 2), rng.randint(1, 3)) for index in range(rng.randint(1, 4))]
+        if rng.random() < 0.2:
+            items[0]['is_group'] = True
+        missing_amount = round(rng.uniform(0.01, 120), 2)
+        multiplier = rng.choice([1, 2, 3])
+
+        top_up = find_free_shipping_top_up(items, missing_amount, multiplier)
+        expected = _brute_force_top_up(items, missing_amount, multiplier)
+        if expected is None:
+            assert top_up is None
+            continue
+        assert round(top_up['additional_cost'] * 100) == expected
+        for item, units in top_up['additions']:
+            assert not item.get('is_group')
+            assert 0 < units <= item['quantity'] * multiplier - item['quantity']
+
+
+def test_top_up_prefers_cheaper_combination_over_greedy():
+    # Jedna droga sztuka (30) vs dwie tanie (2 x 12) - próg 20
+    items = [_item(1, 30.0), _item(2, 12.0)]
+    top_up = find_free_shipping_top_up(items, 20.0, 3)
+    assert top_up['additional_cost'] == pytest.approx(24.0)
+    assert [(item['product_id'], units) for item, units in top_up['additions']] == [(2, 2)]
+
+
+def _result(items, shipping_cost):
+    subtotal = sum(item['total_price_pln'] for item in items)
+    return {
+        'shops_summary': {'shop1': {'subtotal': subtotal, 'shipping_cost': shipping_cost, 'items': items}},
+        'total_products_cost': subtotal,
+        'total_shipping_cost': shipping_cost,
+        'total_cost': subtotal + shipping_cost,
+    }
+
+
+def _optimizer():
+    return QuantityOptimizer({'suggest_quantities': True, 'min_savings_threshold': 1.0,
+                              'max_quantity_multiplier': 3}, lambda *args, **kwargs: None)
+
+
+def test_top_up_applied_when_cheaper_than_shipping():
+    shop_configs = {'shop1': {'delivery_free_from': 50.0, 'delivery_cost': 15.0}}
+    result = _optimizer().optimize_quantities_in_result(_result([_item(1, 42.0), _item(2, 4.5)], 15.0), shop_configs)
+
+    assert result['total_shipping_cost'] == 0
+    assert result['total_cost'] == pytest.approx(42.0 + 4.5 * 2)
+    assert result['shops_summary']['shop1']['items'][1]['quantity'] == 2
+
+
+def test_top_up_skipped_when_not_worth_it():
+    # Brakuje 2 PLN, ale najtańsza sztuka kosztuje więcej niż dostawa
+    shop_configs = {'shop1': {'delivery_free_from': 50.0, 'delivery_cost': 15.0}}
+    items = [_item(1, 48.0)]
+    result = _optimizer().optimize_quantities_in_result(_result(items, 15.0), shop_configs)
+
+    assert result['total_cost'] == pytest.approx(63.0)
+    assert items[0]['quantity'] == 1 and not items[0].get('quantity_optimized')
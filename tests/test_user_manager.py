@@ -0,0 +1,40 @@
+"""
+Konfiguracja użytkownika i plik wysłanych cen - offset indeksu i współbieżne zapisy
+"""
+import os
+import threading
+
+import pytest
+
+from user_manager import UserManager
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return UserManager()
+
+
+def test_mark_uploaded_advances_offset(manager):
+    for price_id in range(3):
+        manager.mark_price_uploaded(price_id, '2024-03-01T12:00:00')
+    assert manager._uploaded_offset == os.path.getsize(manager.uploaded_prices_file)
+    assert manager.get_uploaded_price(2)['status'] == 'uploaded'
+
+
+def test_settings_and_stats_flush_do_not_lose_updates(manager):
+    threads = []
+    for index in range(20):
+        def update(index=index):
+            manager.increment_prices_scraped()
+            manager.update_user_settings({f'option_{index}': index})
+            manager.flush()
+        threads.append(threading.Thread(target=update))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    config = manager.load_user_config()
+    assert all(config['settings'][f'option_{index}'] == index for index in range(20))
+    assert config['stats']['prices_scraped'] == 20
@@ -1,19 +1,38 @@
 """
 Moduł do zarządzania unikalnymi identyfikatorami użytkowników
+
+Liczniki statystyk (pobrane ceny) są zbierane w pamięci i zapisywane do
+user_config.json co flush_interval sekund i przy zamknięciu - zamiast
+przepisywać plik przy każdej cenie. Wysłane ceny trafiają do osobnego pliku
+JSONL tylko do dopisywania (data/uploaded_prices.jsonl) z indeksem w pamięci.
 """
+import atexit
 import json
 import os
+import threading
 import uuid
 import hashlib
 from datetime import datetime
+from utils.file_store import write_json_atomic, append_jsonl
 
 class UserManager:
     """Zarządzanie unikalnymi ID użytkowników"""
     
     def __init__(self):
         self.user_config_file = 'data/user_config.json'
+        self.uploaded_prices_file = 'data/uploaded_prices.jsonl'
+        self.flush_interval = 5.0  # sekundy między zapisami liczników
+        self._config_lock = threading.Lock()  # każde wczytaj-zmień-zapisz user_config.json
+        self._stats_lock = threading.Lock()
+        self._pending_scraped = 0
+        self._pending_last_scraping = None
+        self._flush_timer = None
+        self._uploaded_lock = threading.Lock()
+        self._uploaded = None  # price_id -> wpis, ładowany leniwie
+        self._uploaded_offset = 0
         self.ensure_data_dir()
         self.ensure_user_id()
+        atexit.register(self.flush)
     
     def ensure_data_dir(self):
         """Upewnij się że folder data istnieje"""
@@ -45,37 +64,37 @@ class UserManager:
     
     def save_user_config(self, config):
         """Zapisuje konfigurację użytkownika"""
-        with open(self.user_config_file, 'w', encoding='utf-8') as f:
-            json.dump(config, f, ensure_ascii=False, indent=2)
+        write_json_atomic(self.user_config_file, config)
     
     def ensure_user_id(self):
         """Zapewnia że użytkownik ma przypisane unikalne ID"""
-        config = self.load_user_config()
-        
-        if 'user_id' not in config:
-            # Pierwszy start - wygeneruj nowe ID
-            user_id = self.generate_unique_user_id()
+        with self._config_lock:
+            config = self.load_user_config()
             
-            config.update({
-                'user_id': user_id,
-                'created': datetime.now().isoformat(),
-                'app_version': '1.0',
-                'instance_name': f'PriceTracker-{user_id[-8:]}',
-                'settings': {
-                    'share_anonymous_data': True,
-                    'auto_upload_prices': False,
-                    'data_source_priority': 'local',
-                    'prices_per_page': 50
-                },
-                'stats': {
-                    'prices_scraped': 0,
-                    'products_added': 0,
-                    'last_scraping': None
-                }
-            })
-            
-            self.save_user_config(config)
-            print(f"Wygenerowano nowe ID użytkownika: {user_id}")
+            if 'user_id' not in config:
+                # Pierwszy start - wygeneruj nowe ID
+                user_id = self.generate_unique_user_id()
+                
+                config.update({
+                    'user_id': user_id,
+                    'created': datetime.now().isoformat(),
+                    'app_version': '1.0',
+                    'instance_name': f'PriceTracker-{user_id[-8:]}',
+                    'settings': {
+                        'share_anonymous_data': True,
+                        'auto_upload_prices': False,
+                        'data_source_priority': 'local',
+                        'prices_per_page': 50
+                    },
+                    'stats': {
+                        'prices_scraped': 0,
+                        'products_added': 0,
+                        'last_scraping': None
+                    }
+                })
+                
+                self.save_user_config(config)
+                print(f"Wygenerowano nowe ID użytkownika: {user_id}")
         
         return config['user_id']
     
@@ -85,37 +104,111 @@ class UserManager:
         return config.get('user_id')
     
     def get_user_info(self):
-        """Zwraca pełne informacje o użytkowniku"""
-        return self.load_user_config()
+        """Zwraca pełne informacje o użytkowniku (z niezapisanymi jeszcze licznikami)"""
+        config = self.load_user_config()
+        with self._stats_lock:
+            if self._pending_scraped and isinstance(config.get('stats'), dict):
+                self._apply_pending_stats(config)
+        return config
     
     def update_user_settings(self, settings):
         """Aktualizuje ustawienia użytkownika"""
-        config = self.load_user_config()
-        config['settings'].update(settings)
-        config['updated'] = datetime.now().isoformat()
-        self.save_user_config(config)
+        with self._config_lock:
+            config = self.load_user_config()
+            config['settings'].update(settings)
+            config['updated'] = datetime.now().isoformat()
+            self.save_user_config(config)
         return True
     
     def increment_prices_scraped(self):
-        """Zwiększa licznik pobranych cen"""
-        config = self.load_user_config()
-        config['stats']['prices_scraped'] = config['stats'].get('prices_scraped', 0) + 1
-        config['stats']['last_scraping'] = datetime.now().isoformat()
-        self.save_user_config(config)
+        """Zwiększa licznik pobranych cen (zapis zbiorczo - patrz flush)"""
+        with self._stats_lock:
+            self._pending_scraped += 1
+            self._pending_last_scraping = datetime.now().isoformat()
+            if self._flush_timer is None:
+                self._flush_timer = threading.Timer(self.flush_interval, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+    
+    def _apply_pending_stats(self, config):
+        stats = config.setdefault('stats', {})
+        stats['prices_scraped'] = stats.get('prices_scraped', 0) + self._pending_scraped
+        stats['last_scraping'] = self._pending_last_scraping
+    
+    def flush(self):
+        """Zapisz zebrane liczniki do user_config.json (jeden zapis na wiele cen)"""
+        with self._stats_lock:
+            timer, self._flush_timer = self._flush_timer, None
+            if timer is not None:
+                timer.cancel()
+            if not self._pending_scraped:
+                return
+            try:
+                with self._config_lock:
+                    config = self.load_user_config()
+                    self._apply_pending_stats(config)
+                    self.save_user_config(config)
+                self._pending_scraped = 0
+                self._pending_last_scraping = None
+            except (OSError, ValueError) as e:
+                print(f"Błąd zapisu statystyk użytkownika: {e}")
+    
+    def _refresh_uploaded(self):
+        """Doczytaj nowe wpisy z pliku wysłanych cen (od ostatniego offsetu) - pod _uploaded_lock"""
+        if self._uploaded is None:
+            self._uploaded = {}
+            self._uploaded_offset = 0
+            self._migrate_uploaded_prices()
+        try:
+            f = open(self.uploaded_prices_file, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            if os.fstat(f.fileno()).st_size < self._uploaded_offset:
+                self._uploaded, self._uploaded_offset = {}, 0  # plik podmieniony
+            f.seek(self._uploaded_offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # niedokończone dopisanie
+                self._uploaded_offset += len(line)
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(entry, dict) and 'price_id' in entry:
+                    self._uploaded[entry['price_id']] = entry
+    
+    def _migrate_uploaded_prices(self):
+        """Przenieś stary słownik uploaded_prices z user_config.json do pliku JSONL"""
+        with self._config_lock:
+            config = self.load_user_config()
+            uploaded = config.pop('uploaded_prices', None)
+            if not uploaded:
+                return
+            for price_id, entry in uploaded.items():
+                append_jsonl(self.uploaded_prices_file, dict(entry, price_id=price_id))
+            self.save_user_config(config)
+        print(f"Przeniesiono {len(uploaded)} wysłanych cen do {self.uploaded_prices_file}")
     
     def mark_price_uploaded(self, price_id, upload_timestamp=None):
-        """Oznacza cenę jako wysłaną na serwer"""
-        config = self.load_user_config()
-        
-        if 'uploaded_prices' not in config:
-            config['uploaded_prices'] = {}
-        
-        config['uploaded_prices'][str(price_id)] = {
+        """Oznacza cenę jako wysłaną na serwer (dopisanie jednej linii)"""
+        entry = {
+            'price_id': str(price_id),
             'uploaded_at': upload_timestamp or datetime.now().isoformat(),
             'status': 'uploaded'
         }
-        
-        self.save_user_config(config)
+        with self._uploaded_lock:
+            self._refresh_uploaded()
+            start, end = append_jsonl(self.uploaded_prices_file, entry)
+            self._uploaded[entry['price_id']] = entry
+            if start == self._uploaded_offset:
+                self._uploaded_offset = end  # inaczej ktoś dopisał przed nami - doczyta _refresh_uploaded
+    
+    def get_uploaded_price(self, price_id):
+        """Wpis wysłanej ceny albo None"""
+        with self._uploaded_lock:
+            self._refresh_uploaded()
+            return self._uploaded.get(str(price_id))
 
 # Singleton instance
 user_manager = UserManager()
\ No newline at end of file
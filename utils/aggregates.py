@@ -0,0 +1,104 @@
+"""
+Agregaty dla stron list (produkty, sklepy, statystyki sklepów) - jedno przejście po danych
+
+Zamiast skanować wszystkie ceny / linki osobno dla każdego produktu i sklepu
+(O(produkty x wiersze)) liczymy raz:
+- per produkt: min/max/liczba cen (surowe ceny > 0, jak lista produktów)
+  oraz min/max w PLN (jak get_product_price_range),
+- per produkt i per sklep: liczba linków,
+- nazwy produktów i URL-e linków (para produkt-sklep) do wzbogacania stron historii.
+Wyniki są w cache danych (utils.data_utils._cached) dla generacji pliku -
+zmiana prices.txt / product_links.txt / products.txt (też przez inny proces) przelicza agregat.
+Zwracane słowniki są współdzielone - tylko do odczytu.
+"""
+from utils.data_utils import (_cached, _latest_prices_shared, _load_links_shared, _load_products_shared,
+                              convert_to_pln)
+
+PRICES_FILE = 'data/prices.txt'
+LINKS_FILE = 'data/product_links.txt'
+PRODUCTS_FILE = 'data/products.txt'
+
+
+def _build_price_stats():
+    stats = {}
+    for price_data in _latest_prices_shared().values():
+        if not isinstance(price_data, dict):
+            continue
+        entry = stats.get(price_data.get('product_id'))
+        if entry is None:
+            entry = stats[price_data.get('product_id')] = {
+                'count': 0, 'min': None, 'max': None, 'min_pln': None, 'max_pln': None
+            }
+
+        price = price_data.get('price')
+        try:
+            price_val = float(price or 0)
+        except (ValueError, TypeError):
+            price_val = 0
+        if price_val > 0:
+            entry['count'] += 1
+            entry['min'] = price_val if entry['min'] is None else min(entry['min'], price_val)
+            entry['max'] = price_val if entry['max'] is None else max(entry['max'], price_val)
+
+        if price:
+            price_pln = convert_to_pln(price, price_data.get('currency', 'PLN'))
+            entry['min_pln'] = price_pln if entry['min_pln'] is None else min(entry['min_pln'], price_pln)
+            entry['max_pln'] = price_pln if entry['max_pln'] is None else max(entry['max_pln'], price_pln)
+    return stats
+
+
+def price_stats():
+    """product_id -> {'count', 'min', 'max', 'min_pln', 'max_pln'} z najnowszych cen"""
+    return _cached(PRICES_FILE, 'price_stats', _build_price_stats)
+
+
+def price_range_pln(product_id):
+    """(min, max) w PLN jak get_product_price_range, bez skanowania cen"""
+    entry = price_stats().get(product_id)
+    if entry is None or entry['min_pln'] is None:
+        return None, None
+    return entry['min_pln'], entry['max_pln']
+
+
+def _build_link_counts():
+    by_product, by_shop, total = {}, {}, 0
+    for link in _load_links_shared():
+        if not isinstance(link, dict):
+            continue
+        total += 1
+        product_id = link.get('product_id')
+        by_product[product_id] = by_product.get(product_id, 0) + 1
+        if 'shop_id' in link:
+            shop_id = link['shop_id']
+            by_shop[shop_id] = by_shop.get(shop_id, 0) + 1
+    return {'by_product': by_product, 'by_shop': by_shop, 'total': total}
+
+
+def link_counts():
+    """{'by_product': {product_id: n}, 'by_shop': {shop_id: n}, 'total': n}"""
+    return _cached(LINKS_FILE, 'link_counts', _build_link_counts)
+
+
+def _build_link_urls():
+    urls = {}
+    for link in _load_links_shared():
+        if isinstance(link, dict):
+            urls[(link.get('product_id', ''), link.get('shop_id', ''))] = link.get('url', '#')
+    return urls
+
+
+def link_urls():
+    """(product_id, shop_id) -> url ostatniego linku tej pary"""
+    return _cached(LINKS_FILE, 'link_urls', _build_link_urls)
+
+
+def _build_product_names():
+    return {
+        product['id']: product.get('name')
+        for product in _load_products_shared() if isinstance(product, dict) and 'id' in product
+    }
+
+
+def product_names():
+    """product_id -> nazwa produktu"""
+    return _cached(PRODUCTS_FILE, 'names', _build_product_names)
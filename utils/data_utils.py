@@ -4,30 +4,93 @@ Utilities do obsługi danych - ładowanie, zapisywanie, konwersje z obsługą za
 import json
 import os
 import hashlib
+import threading
 from datetime import datetime
+from utils.file_store import write_jsonl_atomic, append_jsonl, read_lock, file_generation, add_write_listener
 
-def load_products():
-    """Ładuje produkty z pliku"""
+# Cache odczytów: path -> (generacja pliku, sparsowane rekordy).
+# Generacja = (inode, mtime_ns, size), więc zmiana pliku (też przez inny proces) unieważnia wpis.
+_data_cache = {}
+_data_cache_lock = threading.Lock()
+
+def _clone(obj):
+    """Szybka kopia rekordów JSON - wołający mogą je modyfikować bez psucia cache"""
+    if isinstance(obj, list):
+        return [_clone(v) for v in obj]
+    if isinstance(obj, dict):
+        copy = dict(obj)
+        for k, v in copy.items():
+            if isinstance(v, (dict, list)):
+                copy[k] = _clone(v)
+        return copy
+    return obj
+
+def invalidate_data_cache(path=None):
+    """Unieważnij cache dla pliku (lub cały gdy path=None)"""
+    with _data_cache_lock:
+        if path is None:
+            _data_cache.clear()
+        else:
+            path = os.path.abspath(path)
+            for key in [k for k in _data_cache if k[0] == path]:
+                del _data_cache[key]
+
+add_write_listener(invalidate_data_cache)
+
+def _cached(path, variant, build_func):
+    """
+    Read-through cache: zwraca wynik build_func() dopóki plik się nie zmienił.
+    Wynik jest współdzielony - nie modyfikować, publiczne funkcje zwracają kopie.
+    """
+    key = (os.path.abspath(path), variant)
+    generation = file_generation(path)
+    with _data_cache_lock:
+        entry = _data_cache.get(key)
+    if entry is not None and generation is not None and entry[0] == generation:
+        return entry[1]
+    
+    with read_lock(path):
+        generation = file_generation(path)
+        value = build_func()
+    with _data_cache_lock:
+        _data_cache[key] = (generation, value)
+    return value
+
+def _read_jsonl(path, record_func=None):
+    """Parsuj plik JSONL (bez blokady - woła _cached pod read_lock)"""
     try:
-        with open('data/products.txt', 'r', encoding='utf-8') as f:
-            products = []
+        with open(path, 'r', encoding='utf-8') as f:
+            records = []
             for line in f:
                 if line.strip():
-                    product = json.loads(line)
-                    # Migracja starych produktów - dodaj nowe pola jeśli nie istnieją
-                    if 'substitute_group' not in product:
-                        product['substitute_group'] = None
-                    if 'substitute_settings' not in product:
-                        product['substitute_settings'] = {
-                            'allow_substitutes': True,
-                            'max_price_increase_percent': 20.0,
-                            'max_quantity_multiplier': 1.5
-                        }
-                    products.append(product)
-            return products
+                    record = json.loads(line)
+                    if record_func:
+                        record_func(record)
+                    records.append(record)
+            return records
     except FileNotFoundError:
         return []
 
+def _migrate_product(product):
+    """Migracja starych produktów - dodaj nowe pola jeśli nie istnieją"""
+    if 'substitute_group' not in product:
+        product['substitute_group'] = None
+    if 'substitute_settings' not in product:
+        product['substitute_settings'] = {
+            'allow_substitutes': True,
+            'max_price_increase_percent': 20.0,
+            'max_quantity_multiplier': 1.5
+        }
+
+def _load_products_shared():
+    """Produkty z cache bez kopii - tylko do odczytu"""
+    path = 'data/products.txt'
+    return _cached(path, 'records', lambda: _read_jsonl(path, _migrate_product))
+
+def load_products():
+    """Ładuje produkty z pliku"""
+    return _clone(_load_products_shared())
+
 def save_product(product_data):
     """Zapisuje produkt do pliku"""
     # Upewnij się że nowy produkt ma wszystkie wymagane pola
@@ -40,8 +103,7 @@ def save_product(product_data):
             'max_quantity_multiplier': 1.5
         }
     
-    with open('data/products.txt', 'a', encoding='utf-8') as f:
-        f.write(json.dumps(product_data, ensure_ascii=False) + '\n')
+    append_jsonl('data/products.txt', product_data)
 
 def update_product(product_data):
     """Aktualizuje istniejący produkt"""
@@ -58,43 +120,46 @@ def update_product(product_data):
             break
     
     # Przepisz cały plik
-    with open('data/products.txt', 'w', encoding='utf-8') as f:
-        for product in products:
-            f.write(json.dumps(product, ensure_ascii=False) + '\n')
+    write_jsonl_atomic('data/products.txt', products)
+
+def _load_links_shared():
+    """Linki z cache - współdzielona lista, tylko do odczytu"""
+    path = 'data/product_links.txt'
+    return _cached(path, 'records', lambda: _read_jsonl(path))
 
 def load_links():
     """Ładuje linki produktów"""
-    try:
-        with open('data/product_links.txt', 'r', encoding='utf-8') as f:
-            links = []
-            for line in f:
-                if line.strip():
-                    links.append(json.loads(line))
-            return links
-    except FileNotFoundError:
-        return []
+    return _clone(_load_links_shared())
 
 def save_link(link_data):
     """Zapisuje link produktu"""
-    with open('data/product_links.txt', 'a', encoding='utf-8') as f:
-        f.write(json.dumps(link_data, ensure_ascii=False) + '\n')
+    append_jsonl('data/product_links.txt', link_data)
+
+def _load_prices_shared():
+    """Ceny z cache - współdzielona lista, tylko do odczytu"""
+    path = 'data/prices.txt'
+    return _cached(path, 'records', lambda: _read_jsonl(path))
 
 def load_prices():
     """Ładuje ceny z pliku"""
-    try:
-        with open('data/prices.txt', 'r', encoding='utf-8') as f:
-            prices = []
-            for line in f:
-                if line.strip():
-                    prices.append(json.loads(line))
-            return prices
-    except FileNotFoundError:
-        return []
+    return _clone(_load_prices_shared())
+
+_price_listeners = []
+
+def add_price_listener(callback):
+    """Dodaj callback(price_data) wywoływany po zapisaniu nowej ceny"""
+    if callback not in _price_listeners:
+        _price_listeners.append(callback)
 
 def save_price(price_data):
     """Zapisuje cenę do pliku"""
-    with open('data/prices.txt', 'a', encoding='utf-8') as f:
-        f.write(json.dumps(price_data, ensure_ascii=False) + '\n')
+    append_jsonl('data/prices.txt', price_data)
+    
+    for callback in list(_price_listeners):
+        try:
+            callback(price_data)
+        except Exception as e:
+            print(f"Błąd listenera cen: {e}")
 
 def get_latest_prices(include_url_in_key=False):
     """
@@ -107,7 +172,16 @@ def get_latest_prices(include_url_in_key=False):
     Returns:
         dict: {key: price_data}
     """
-    all_prices = load_prices()
+    latest_prices = _latest_prices_shared(include_url_in_key)
+    return {key: dict(price) for key, price in latest_prices.items()}
+
+def _latest_prices_shared(include_url_in_key=False):
+    """Najnowsze ceny z cache - współdzielony słownik, tylko do odczytu"""
+    variant = 'latest_url' if include_url_in_key else 'latest'
+    return _cached('data/prices.txt', variant,
+                   lambda: _build_latest_prices(_load_prices_shared(), include_url_in_key))
+
+def _build_latest_prices(all_prices, include_url_in_key):
     latest_prices = {}
     
     for price in all_prices:
@@ -131,7 +205,11 @@ def get_latest_prices_by_url():
     Returns:
         dict: {product_id|url: price_data}
     """
-    all_prices = load_prices()
+    latest_prices = _cached('data/prices.txt', 'latest_by_url',
+                            lambda: _build_latest_prices_by_url(_load_prices_shared()))
+    return {key: dict(price) for key, price in latest_prices.items()}
+
+def _build_latest_prices_by_url(all_prices):
     latest_prices = {}
     
     for price in all_prices:
@@ -193,10 +271,13 @@ def get_product_price_range(product_id, latest_prices):
     
     return min(product_prices), max(product_prices)
 
-def get_product_price_range_with_substitutes(product_id, latest_prices):
+def get_product_price_range_with_substitutes(product_id, latest_prices, price_range=None):
     """
     Zwraca zakres cen dla produktu włączając zamienniki
     
+    price_range - funkcja(product_id) -> (min, max); domyślnie skan latest_prices
+    (dla wielu produktów: utils.aggregates.price_range_pln - bez skanowania)
+    
     Returns:
         dict: {
             'original': {'min': float, 'max': float},
@@ -204,18 +285,21 @@ def get_product_price_range_with_substitutes(product_id, latest_prices):
             'combined': {'min': float, 'max': float}
         }
     """
+    if price_range is None:
+        price_range = lambda pid: get_product_price_range(pid, latest_prices)
+    
     try:
         from substitute_manager import substitute_manager
         
         # Ceny oryginału
-        original_min, original_max = get_product_price_range(product_id, latest_prices)
+        original_min, original_max = price_range(product_id)
         
         # Ceny zamienników
         substitute_info = substitute_manager.get_substitutes_for_product(product_id)
         substitute_prices = []
         
         for substitute in substitute_info['substitutes']:
-            sub_min, sub_max = get_product_price_range(substitute['id'], latest_prices)
+            sub_min, sub_max = price_range(substitute['id'])
             if sub_min and sub_max:
                 substitute_prices.extend([sub_min, sub_max])
         
@@ -240,7 +324,7 @@ def get_product_price_range_with_substitutes(product_id, latest_prices):
         
     except ImportError:
         # Fallback jeśli substitute_manager nie jest dostępny
-        original_min, original_max = get_product_price_range(product_id, latest_prices)
+        original_min, original_max = price_range(product_id)
         return {
             'original': {'min': original_min, 'max': original_max},
             'substitutes': {'min': None, 'max': None},
@@ -249,15 +333,16 @@ def get_product_price_range_with_substitutes(product_id, latest_prices):
 
 def get_products_with_substitute_info():
     """Zwraca produkty z informacjami o zamiennikach"""
+    from utils.aggregates import price_range_pln
     products = load_products()
-    latest_prices = get_latest_prices()
+    latest_prices = _latest_prices_shared()
     
     try:
         from substitute_manager import substitute_manager
         
         for product in products:
-            # Dodaj informacje o cenach z zamiennikmi
-            price_info = get_product_price_range_with_substitutes(product['id'], latest_prices)
+            # Dodaj informacje o cenach z zamiennikmi (zakresy cen z agregatów - jedno przejście)
+            price_info = get_product_price_range_with_substitutes(product['id'], latest_prices, price_range_pln)
             product['price_range'] = price_info
             
             # Dodaj informacje o grupie zamienników
@@ -276,7 +361,7 @@ def get_products_with_substitute_info():
     except ImportError:
         # Fallback bez obsługi zamienników
         for product in products:
-            min_price, max_price = get_product_price_range(product['id'], latest_prices)
+            min_price, max_price = price_range_pln(product['id'])
             product['min_price'] = min_price
             product['max_price'] = max_price
             product['substitute_count'] = 0
@@ -376,9 +461,7 @@ def cleanup_orphaned_data():
     valid_prices = [p for p in prices if p['product_id'] in product_ids]
     
     if len(valid_prices) != len(prices):
-        with open('data/prices.txt', 'w', encoding='utf-8') as f:
-            for price in valid_prices:
-                f.write(json.dumps(price, ensure_ascii=False) + '\n')
+        write_jsonl_atomic('data/prices.txt', valid_prices)
         print(f"Usunięto {len(prices) - len(valid_prices)} osieroconych cen")
     
     # Wyczyść linki
@@ -386,9 +469,7 @@ def cleanup_orphaned_data():
     valid_links = [l for l in links if l['product_id'] in product_ids]
     
     if len(valid_links) != len(links):
-        with open('data/product_links.txt', 'w', encoding='utf-8') as f:
-            for link in valid_links:
-                f.write(json.dumps(link, ensure_ascii=False) + '\n')
+        write_jsonl_atomic('data/product_links.txt', valid_links)
         print(f"Usunięto {len(links) - len(valid_links)} osieroconych linków")
     
     # Wyczyść grupy zamienników
@@ -412,9 +493,7 @@ def cleanup_orphaned_data():
                 valid_groups[group_id] = group
         
         if len(valid_groups) != len(groups):
-            with open('data/substitutes.txt', 'w', encoding='utf-8') as f:
-                for group in valid_groups.values():
-                    f.write(json.dumps(group, ensure_ascii=False) + '\n')
+            write_jsonl_atomic('data/substitutes.txt', valid_groups.values())
             print(f"Usunięto {len(groups) - len(valid_groups)} nieprawidłowych grup zamienników")
             
     except ImportError:
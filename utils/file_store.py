@@ -0,0 +1,233 @@
+"""
+Bezpieczny zapis plików danych (JSONL/JSON) - atomowe przepisywanie i blokady
+"""
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl  # blokady między procesami (workery Flask'a) - tylko POSIX
+except ImportError:
+    fcntl = None
+
+
+class _RWLock:
+    """Prosta blokada czytelnicy/pisarz dla wątków jednego procesu"""
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+
+    def acquire_read(self):
+        with self._cond:
+            while self._writer:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writer = True
+
+    def release_write(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+
+_locks = {}
+_locks_guard = threading.Lock()
+_write_listeners = []
+
+
+def add_write_listener(callback):
+    """Dodaj callback(path) wywoływany po każdym zapisie przez ten moduł (np. unieważnienie cache)"""
+    if callback not in _write_listeners:
+        _write_listeners.append(callback)
+
+
+def _notify_written(path):
+    for callback in list(_write_listeners):
+        try:
+            callback(path)
+        except Exception as e:
+            print(f"Błąd listenera zapisu {path}: {e}")
+
+
+def _get_lock(path):
+    key = os.path.abspath(path)
+    with _locks_guard:
+        lock = _locks.get(key)
+        if lock is None:
+            lock = _locks[key] = _RWLock()
+        return lock
+
+
+def _lock_file_path(path):
+    directory, name = os.path.split(os.path.abspath(path))
+    return os.path.join(directory, f'.{name}.lock')
+
+
+@contextmanager
+def _process_lock(path, exclusive):
+    """Blokada flock na pliku obok danych - chroni przed innymi procesami"""
+    if fcntl is None:
+        yield
+        return
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(_lock_file_path(path), 'a') as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+@contextmanager
+def read_lock(path):
+    """Blokada współdzielona - czytanie nie widzi zapisu w trakcie"""
+    lock = _get_lock(path)
+    lock.acquire_read()
+    try:
+        with _process_lock(path, exclusive=False):
+            yield
+    finally:
+        lock.release_read()
+
+
+@contextmanager
+def write_lock(path):
+    """Blokada wyłączna - tylko jeden pisarz, bez czytelników"""
+    lock = _get_lock(path)
+    lock.acquire_write()
+    try:
+        with _process_lock(path, exclusive=True):
+            yield
+    finally:
+        lock.release_write()
+
+
+def file_generation(path):
+    """
+    Numer generacji pliku: (inode, mtime_ns, size) - zmienia się przy każdym zapisie.
+    Nie odróżnia dopisania od przepisania (system plików potrafi ponownie użyć inode) -
+    do tego służy rewrite_count().
+    Zwraca None gdy pliku nie ma.
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def _rewrites_file_path(path):
+    directory, name = os.path.split(os.path.abspath(path))
+    return os.path.join(directory, f'.{name}.rewrites')
+
+
+def rewrite_count(path):
+    """
+    Ile razy plik JSONL był przepisany przez write_jsonl_atomic (też w innym procesie).
+    Dopisania (append_jsonl) go nie zmieniają - indeks czytający plik przyrostowo
+    porównuje licznik żeby wiedzieć czy może doczytać tylko ogon.
+    """
+    try:
+        with open(_rewrites_file_path(path), 'r') as f:
+            return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+
+def _bump_rewrite_count(path):
+    """Zwiększ licznik przepisań - przed os.replace, pod blokadą pisarza"""
+    with open(_rewrites_file_path(path), 'w') as f:
+        f.write(str(rewrite_count(path) + 1))
+
+
+def _fsync_dir(directory):
+    """fsync katalogu żeby rename przetrwał crash (nie wszędzie się da)"""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _write_atomic(path, write_func, binary=False, count_rewrite=False):
+    """Zapisz do pliku tymczasowego, fsync i os.replace na miejsce docelowe"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+
+    with write_lock(path):
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f'.{os.path.basename(path)}.', suffix='.tmp')
+        try:
+            with (os.fdopen(fd, 'wb') if binary else os.fdopen(fd, 'w', encoding='utf-8')) as f:
+                write_func(f)
+                f.flush()
+                os.fsync(f.fileno())
+            if count_rewrite:
+                # Przed podmianą - crash w środku najwyżej wymusi zbędną przebudowę indeksu
+                _bump_rewrite_count(path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        _fsync_dir(directory)
+    _notify_written(path)
+
+
+def write_jsonl_atomic(path, records):
+    """Przepisz cały plik JSONL atomowo - czytelnik widzi stary albo nowy plik, nigdy połowę"""
+    def write_records(f):
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    _write_atomic(path, write_records, count_rewrite=True)
+
+
+def write_json_atomic(path, data, indent=2):
+    """Przepisz plik JSON atomowo"""
+    _write_atomic(path, lambda f: json.dump(data, f, ensure_ascii=False, indent=indent))
+
+
+def write_bytes_atomic(path, data):
+    """Przepisz plik binarny atomowo"""
+    _write_atomic(path, lambda f: f.write(data), binary=True)
+
+
+def append_jsonl(path, record):
+    """
+    Dopisz rekord do pliku JSONL pod blokadą wyłączną
+
+    Returns:
+        tuple: (offset początku, offset końca) dopisanej linii w bajtach
+    """
+    line = json.dumps(record, ensure_ascii=False) + '\n'
+    with write_lock(path):
+        with open(path, 'a', encoding='utf-8') as f:
+            start = os.fstat(f.fileno()).st_size
+            f.write(line)
+            f.flush()
+            end = os.fstat(f.fileno()).st_size
+    _notify_written(path)
+    return start, end
@@ -0,0 +1,51 @@
+"""
+Leniwe importy ciężkich modułów (scraper, wyszukiwarka produktów - requests, BeautifulSoup)
+
+Moduły tras tworzą LazyAttribute zamiast importować singletony na starcie -
+import następuje przy pierwszym użyciu (pierwsze żądanie do danej trasy),
+więc start aplikacji nie płaci za stos scrapera.
+"""
+import importlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class LazyAttribute:
+    """Atrybut modułu importowanego przy pierwszym użyciu (np. singleton scrapera)"""
+
+    def __init__(self, module_name, attribute):
+        self._module_name = module_name
+        self._attribute = attribute
+        self._value = _MISSING
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Zaimportuj moduł (raz) - None gdy import się nie udał"""
+        if self._value is _MISSING:
+            with self._lock:
+                if self._value is _MISSING:
+                    try:
+                        module = importlib.import_module(self._module_name)
+                        self._value = getattr(module, self._attribute)
+                    except ImportError as e:
+                        logger.warning(f"{self._module_name} not available - some features will be disabled: {e}")
+                        self._value = None
+        return self._value
+
+    def available(self):
+        """Czy moduł się zaimportował i obiekt istnieje"""
+        return self.load() is not None
+
+    def __getattr__(self, name):
+        value = self.load()
+        if value is None:
+            raise ImportError(f"{self._module_name}.{self._attribute} niedostępny")
+        return getattr(value, name)
+
+    def __repr__(self):
+        state = 'not loaded' if self._value is _MISSING else repr(self._value)
+        return f'<LazyAttribute {self._module_name}.{self._attribute}: {state}>'
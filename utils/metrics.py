@@ -0,0 +1,276 @@
+"""
+Metryki w stylu Prometheusa - liczniki, wskaźniki i histogramy w pamięci procesu
+
+Rejestr bez zależności zewnętrznych; /metrics zwraca go w formacie tekstowym
+(text exposition format 0.0.4). Aktualizacja to słownik + blokada, więc koszt
+w gorących ścieżkach (scraper, parser, klient API, silnik) jest pomijalny.
+Serie z etykietami są tworzone przy pierwszym użyciu - etykiety muszą mieć
+małą liczbę wartości (sklep, strategia, endpoint), nie URL-e czy id.
+
+    scrapes = metrics.counter('scrape_total', 'Pobrania stron', ('shop', 'outcome'))
+    scrapes.labels('allegro', 'price').inc()
+    with metrics.histogram('parse_seconds', 'Czas parsowania').time():
+        ...
+"""
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Domyślne przedziały histogramów czasu (sekundy)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    """Wartość etykiety - escapowane \\, nowa linia i cudzysłów"""
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _escape_help(value):
+    """Tekst # HELP - tylko \\ i nowa linia (cudzysłów zostaje jak jest)"""
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    """Wspólna część metryk: nazwa, opis, etykiety i serie per wartości etykiet"""
+
+    TYPE = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._series = {}
+        if not self.labelnames:
+            self._series[()] = self._new_series()
+
+    def _new_series(self):
+        raise NotImplementedError
+
+    def labels(self, *values, **kwargs):
+        """Seria dla wartości etykiet (pozycyjnie albo po nazwach)"""
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        series = self._series.get(values)  # szybka ścieżka - etykiety już jako stringi
+        if series is not None:
+            return series
+        if len(values) != len(self.labelnames):
+            raise ValueError(f'{self.name}: oczekiwano etykiet {self.labelnames}, podano {values}')
+        key = tuple('' if value is None else str(value) for value in values)
+        series = self._series.get(key)
+        if series is None:
+            with self._lock:
+                series = self._series.get(key)
+                if series is None:
+                    series = self._series[key] = self._new_series()
+        return series
+
+    def _default(self):
+        if self.labelnames:
+            raise ValueError(f'{self.name} ma etykiety {self.labelnames} - użyj labels()')
+        return self._series[()]
+
+    def collect(self):
+        """Linie formatu tekstowego dla tej metryki"""
+        lines = [f'# HELP {self.name} {_escape_help(self.documentation)}', f'# TYPE {self.name} {self.TYPE}']
+        with self._lock:
+            items = sorted(self._series.items())
+        for values, series in items:
+            lines.extend(series.samples(self.name, self.labelnames, values))
+        return lines
+
+
+class _CounterSeries:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        if amount < 0:
+            raise ValueError('Licznik może tylko rosnąć')
+        with self._lock:
+            self.value += amount
+
+    def samples(self, name, labelnames, values):
+        return [f'{name}{_format_labels(labelnames, values)} {_format_value(self.value)}']
+
+
+class Counter(_Metric):
+    """Licznik - tylko rośnie (nazwy z przyrostkiem _total)"""
+
+    TYPE = 'counter'
+
+    def _new_series(self):
+        return _CounterSeries()
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+
+class _GaugeSeries:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+        self.function = None
+
+    def set(self, value):
+        with self._lock:
+            self.value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set_function(self, function):
+        """Wartość liczona przy odczycie (np. długość kolejki) - zero kosztu przy zmianach"""
+        self.function = function
+
+    def samples(self, name, labelnames, values):
+        value = self.value
+        if self.function is not None:
+            try:
+                value = self.function()
+            except Exception:
+                value = math.nan
+        return [f'{name}{_format_labels(labelnames, values)} {_format_value(float(value))}']
+
+
+class Gauge(_Metric):
+    """Wskaźnik - wartość bieżąca (może maleć)"""
+
+    TYPE = 'gauge'
+
+    def _new_series(self):
+        return _GaugeSeries()
+
+    def set(self, value):
+        self._default().set(value)
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+    def dec(self, amount=1):
+        self._default().dec(amount)
+
+    def set_function(self, function):
+        self._default().set_function(function)
+
+
+class _HistogramSeries:
+    def __init__(self, buckets):
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # ostatni = +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        """Zmierz czas bloku (także gdy kończy się wyjątkiem)"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def samples(self, name, labelnames, values):
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            le = f'le="{_format_value(float(bound))}"'
+            lines.append(f'{name}_bucket{_format_labels(labelnames, values, le)} {cumulative}')
+        lines.append(f'{name}_sum{_format_labels(labelnames, values)} {_format_value(total)}')
+        lines.append(f'{name}_count{_format_labels(labelnames, values)} {cumulative}')
+        return lines
+
+
+class Histogram(_Metric):
+    """Histogram - rozkład wartości w przedziałach (czasy w sekundach)"""
+
+    TYPE = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(float(bound) for bound in buckets if bound != math.inf))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_series(self):
+        return _HistogramSeries(self.buckets)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+
+class MetricsRegistry:
+    """Rejestr metryk procesu - ta sama nazwa zwraca tę samą metrykę"""
+
+    def __init__(self, prefix='pricetracker_'):
+        self.prefix = prefix
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, documentation, labelnames, **kwargs):
+        full_name = self.prefix + name
+        with self._lock:
+            metric = self._metrics.get(full_name)
+            if metric is None:
+                metric = self._metrics[full_name] = cls(full_name, documentation, labelnames, **kwargs)
+            elif not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+                raise ValueError(f'Metryka {full_name} zarejestrowana z innym typem lub etykietami')
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self):
+        """Wszystkie metryki w formacie tekstowym Prometheusa"""
+        with self._lock:
+            metrics = [self._metrics[name] for name in sorted(self._metrics)]
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+# Typ treści odpowiedzi /metrics
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Singleton instance
+metrics = MetricsRegistry()
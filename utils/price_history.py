@@ -0,0 +1,611 @@
+"""
+Kolumnowy magazyn historii cen - segmenty miesięczne, kolumny w array, słowniki dla powtarzalnych stringów
+
+Źródłem prawdy dalej jest data/prices.txt (JSONL, z niego korzysta sync).
+Ten moduł trzyma zbudowany z niego indeks kolumnowy:
+- segment na miesiąc (klucz 'YYYY-MM'),
+- znaczniki czasu jako int64 (mikrosekundy od epoki),
+- shop_id / url / source / currency / product_id zakodowane słownikowo (uint32),
+- offset linii w pliku JSONL - pełny rekord czytamy tylko dla potrzebnych wierszy,
+- indeks czasu i listy wierszy per produkt / sklep (postings) w segmencie - strona
+  historii z filtrami liczy się z długości list, materializujemy tylko jej wiersze.
+Dopisania do prices.txt są doczytywane przyrostowo (od ostatniego offsetu),
+a segmenty zapisywane w data/price_history/ żeby start nie parsował całego JSONL.
+Przepisanie pliku (edycja, usunięcie) wykrywa licznik przepisań z file_store
+i suma kontrolna bajtów przed offsetem - wtedy indeks budujemy od zera.
+"""
+import heapq
+import json
+import os
+import pickle
+import threading
+import zlib
+from array import array
+from datetime import datetime, timedelta, timezone
+
+from utils.file_store import read_lock, file_generation, rewrite_count, write_bytes_atomic, write_json_atomic
+
+EPOCH = datetime(1970, 1, 1)
+ONE_MICROSECOND = timedelta(microseconds=1)
+UNKNOWN_MONTH = '0000-00'  # wiersze z nieczytelną datą
+SNAPSHOT_FORMAT = 2
+TAIL_CHECK_BYTES = 4096  # ile bajtów przed offsetem sprawdzamy przy dopisaniu
+
+
+def to_timestamp(value):
+    """ISO string / datetime -> mikrosekundy od epoki (None gdy się nie da)"""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return (value - EPOCH) // ONE_MICROSECOND
+
+
+def from_timestamp(ts):
+    """Mikrosekundy od epoki -> datetime"""
+    return EPOCH + timedelta(microseconds=ts)
+
+
+_MICROS_PER_DAY = 86400 * 1000000
+_month_by_day = {}
+
+
+def _tail_checksum(path, offset):
+    """CRC ostatnich bajtów przed offsetem - dopisanie ich nie zmienia, przepisanie (prawie) zawsze"""
+    start = max(0, offset - TAIL_CHECK_BYTES)
+    try:
+        with open(path, 'rb') as f:
+            f.seek(start)
+            return zlib.crc32(f.read(offset - start))
+    except OSError:
+        return None
+
+
+def _month_key(ts):
+    if ts is None:
+        return UNKNOWN_MONTH
+    day = ts // _MICROS_PER_DAY
+    key = _month_by_day.get(day)
+    if key is None:
+        dt = from_timestamp(day * _MICROS_PER_DAY)
+        key = _month_by_day[day] = f'{dt.year:04d}-{dt.month:02d}'
+    return key
+
+
+class _Dictionary:
+    """Kodowanie słownikowe wartości -> kolejne int'y"""
+
+    def __init__(self, values=None):
+        self.values = list(values or [])
+        self.codes = {value: code for code, value in enumerate(self.values)}
+
+    def encode(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def lookup(self, value):
+        return self.codes.get(value)
+
+    def decode(self, code):
+        return self.values[code]
+
+
+class _Segment:
+    """Jeden miesiąc historii - kolumny równej długości"""
+
+    COLUMNS = (
+        ('ts', 'q'), ('product', 'I'), ('shop', 'I'), ('url', 'I'),
+        ('source', 'I'), ('currency', 'I'), ('price', 'd'), ('offset', 'q'),
+    )
+
+    def __init__(self, key):
+        self.key = key
+        for name, typecode in self.COLUMNS:
+            setattr(self, name, array(typecode))
+        self._order = None
+        self._postings = None
+
+    def __len__(self):
+        return len(self.ts)
+
+    def append(self, ts, product, shop, url, source, currency, price, offset):
+        self.ts.append(ts)
+        self.product.append(product)
+        self.shop.append(shop)
+        self.url.append(url)
+        self.source.append(source)
+        self.currency.append(currency)
+        self.price.append(price)
+        self.offset.append(offset)
+
+        # Dopisania są zwykle najnowsze - wtedy indeksy rosną o jeden wiersz zamiast przebudowy
+        order = self._order
+        if order is not None and (not order or ts >= self.ts[order[-1]]):
+            i = len(self.ts) - 1
+            order.append(i)
+            if self._postings is not None:
+                self._add_posting(self._postings['product'], product, i)
+                self._add_posting(self._postings['shop'], shop, i)
+        else:
+            self._order = None
+            self._postings = None
+
+    def order(self):
+        """Indeksy wierszy posortowane rosnąco po czasie (liczone leniwie)"""
+        if self._order is None:
+            ts = self.ts
+            self._order = sorted(range(len(ts)), key=ts.__getitem__)
+        return self._order
+
+    @staticmethod
+    def _add_posting(postings, code, i):
+        rows = postings.get(code)
+        if rows is None:
+            rows = postings[code] = array('I')
+        rows.append(i)
+
+    def postings(self, column):
+        """Kod -> indeksy wierszy rosnąco po czasie, dla kolumny 'product' albo 'shop' (leniwie)"""
+        if self._postings is None:
+            by_product, by_shop = {}, {}
+            products, shops = self.product, self.shop
+            for i in self.order():
+                self._add_posting(by_product, products[i], i)
+                self._add_posting(by_shop, shops[i], i)
+            self._postings = {'product': by_product, 'shop': by_shop}
+        return self._postings[column]
+
+    def to_state(self):
+        return {name: getattr(self, name) for name, _ in self.COLUMNS}
+
+    @classmethod
+    def from_state(cls, key, state):
+        segment = cls(key)
+        for name, typecode in cls.COLUMNS:
+            column = state[name]
+            if not isinstance(column, array) or column.typecode != typecode:
+                raise ValueError(f'Nieprawidłowa kolumna {name} w segmencie {key}')
+            setattr(segment, name, column)
+        if len({len(getattr(segment, name)) for name, _ in cls.COLUMNS}) != 1:
+            raise ValueError(f'Kolumny segmentu {key} mają różne długości')
+        return segment
+
+
+class _Selection:
+    """
+    Wiersze segmentu spełniające filtry: listy z postings (każda rosnąco po czasie)
+    i ewentualnie filtr drugiej kolumny. Liczność bez filtra to suma długości list -
+    scalamy i filtrujemy dopiero gdy potrzebne są same wiersze.
+    """
+
+    def __init__(self, segment, runs, column=None, codes=None):
+        self.segment = segment
+        self.runs = runs
+        self.column = column
+        self.codes = codes
+        self._rows = runs[0] if len(runs) == 1 and column is None else None
+        self._count = sum(len(run) for run in runs) if column is None else None
+
+    def __len__(self):
+        if self._count is None:
+            self._count = len(self.rows())
+        return self._count
+
+    def rows(self):
+        """Indeksy wierszy rosnąco po czasie"""
+        if self._rows is None:
+            ts = self.segment.ts
+            if len(self.runs) == 1:
+                rows = self.runs[0]
+            else:
+                # ten sam porządek co segment.order() - czas, potem numer wiersza
+                rows = heapq.merge(*self.runs, key=lambda i: (ts[i], i))
+            if self.column is not None:
+                column, codes = self.column, self.codes
+                rows = [i for i in rows if column[i] in codes]
+            self._rows = rows if isinstance(rows, (list, array)) else list(rows)
+        return self._rows
+
+    def newest(self, skip, limit):
+        """limit wierszy od najnowszych, po pominięciu skip najnowszych"""
+        rows = self.rows()
+        first = len(rows) - 1 - skip
+        return [rows[k] for k in range(first, max(first - limit, -1), -1)]
+
+
+def _runs(postings, codes):
+    """Listy wierszy dla zbioru kodów - iterujemy po mniejszym z dwóch zbiorów"""
+    if len(codes) <= len(postings):
+        return [postings[code] for code in codes if code in postings]
+    return [rows for code, rows in postings.items() if code in codes]
+
+
+class PriceHistoryStore:
+    """Kolumnowy indeks historii cen zbudowany z prices.txt"""
+
+    def __init__(self, prices_file='data/prices.txt', segments_dir='data/price_history'):
+        self.prices_file = prices_file
+        self.segments_dir = segments_dir
+        self.snapshot_every_rows = 5000  # ile dopisanych wierszy zanim zapiszemy segmenty
+        self._lock = threading.RLock()
+        self._reset()
+        self._snapshot_checked = False
+
+    def _reset(self):
+        self.segments = {}
+        self.products = _Dictionary()
+        self.shops = _Dictionary()
+        self.urls = _Dictionary()
+        self.sources = _Dictionary()
+        self.currencies = _Dictionary()
+        self._generation = None
+        self._rewrites = None
+        self._tail_crc = None
+        self._offset = 0
+        self._dirty_segments = set()
+        self._rows_since_snapshot = 0
+
+    # ------------------------------------------------------------------
+    # Budowanie / odświeżanie
+    # ------------------------------------------------------------------
+
+    def refresh(self):
+        """Doczytaj zmiany z prices.txt - przyrostowo gdy plik był tylko dopisywany"""
+        with self._lock:
+            generation = file_generation(self.prices_file)
+            if generation is None:
+                self._reset()
+                return
+            if generation == self._generation:
+                return
+
+            if not self._snapshot_checked:
+                self._snapshot_checked = True
+                self._load_snapshot(generation)
+
+            with read_lock(self.prices_file):
+                generation = file_generation(self.prices_file)
+                rewrites = rewrite_count(self.prices_file)
+                # Sam inode nie wystarcza - kolejne przepisania potrafią dostać ten sam
+                appended = (self._generation is not None
+                            and rewrites == self._rewrites
+                            and generation[0] == self._generation[0]
+                            and generation[2] >= self._offset
+                            and _tail_checksum(self.prices_file, self._offset) == self._tail_crc)
+                if not appended:
+                    # Plik przepisany albo skrócony - budujemy od zera
+                    self._reset()
+                    self._dirty_segments.add(None)
+                self._read_from_offset()
+                self._generation = generation
+                self._rewrites = rewrites
+                self._tail_crc = _tail_checksum(self.prices_file, self._offset)
+
+            if None in self._dirty_segments or self._rows_since_snapshot >= self.snapshot_every_rows:
+                self.save_snapshot()
+
+    def _read_from_offset(self):
+        try:
+            f = open(self.prices_file, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            f.seek(self._offset)
+            position = self._offset
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # niedokończone dopisanie - doczytamy następnym razem
+                line_offset = position
+                position += len(line)
+                if line.strip():
+                    try:
+                        self._add_record(json.loads(line.decode('utf-8')), line_offset)
+                    except (ValueError, TypeError):
+                        continue
+            self._offset = position
+
+    def _add_record(self, price, line_offset):
+        if not isinstance(price, dict) or 'created' not in price:
+            return
+
+        ts = to_timestamp(price.get('created'))
+        key = _month_key(ts)
+        segment = self.segments.get(key)
+        if segment is None:
+            segment = self.segments[key] = _Segment(key)
+
+        try:
+            value = float(str(price.get('price')).replace(',', '.'))
+        except (TypeError, ValueError):
+            value = float('nan')
+
+        segment.append(
+            ts if ts is not None else 0,
+            self.products.encode(price.get('product_id')),
+            self.shops.encode(price.get('shop_id', '')),
+            self.urls.encode(price.get('url', '')),
+            self.sources.encode(price.get('source', '')),
+            self.currencies.encode(price.get('currency', 'PLN')),
+            value,
+            line_offset,
+        )
+        self._dirty_segments.add(key)
+        self._rows_since_snapshot += 1
+
+    # ------------------------------------------------------------------
+    # Snapshot segmentów na dysku
+    # ------------------------------------------------------------------
+
+    def _meta_path(self):
+        return os.path.join(self.segments_dir, 'meta.json')
+
+    def _segment_path(self, key):
+        return os.path.join(self.segments_dir, f'{key}.seg')
+
+    def save_snapshot(self):
+        """Zapisz zmienione segmenty i metadane (metadane na końcu - są punktem spójności)"""
+        with self._lock:
+            if self._generation is None:
+                return
+            try:
+                os.makedirs(self.segments_dir, exist_ok=True)
+                for key in sorted(k for k in self._dirty_segments if k is not None):
+                    segment = self.segments[key]
+                    write_bytes_atomic(self._segment_path(key),
+                                       pickle.dumps(segment.to_state(), protocol=pickle.HIGHEST_PROTOCOL))
+                meta = {
+                    'format': SNAPSHOT_FORMAT,
+                    'source_inode': self._generation[0],
+                    'source_rewrites': self._rewrites,
+                    'tail_crc': self._tail_crc,
+                    'offset': self._offset,
+                    'segments': {key: len(segment) for key, segment in self.segments.items()},
+                    'dictionaries': {
+                        'products': self.products.values,
+                        'shops': self.shops.values,
+                        'urls': self.urls.values,
+                        'sources': self.sources.values,
+                        'currencies': self.currencies.values,
+                    }
+                }
+                write_json_atomic(self._meta_path(), meta, indent=None)
+                self._dirty_segments = set()
+                self._rows_since_snapshot = 0
+            except (OSError, pickle.PickleError) as e:
+                print(f"Błąd zapisu segmentów historii cen: {e}")
+
+    def _load_snapshot(self, generation):
+        """Wczytaj segmenty z dysku jeśli pasują do obecnego prices.txt"""
+        try:
+            with open(self._meta_path(), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if (meta.get('format') != SNAPSHOT_FORMAT or meta.get('source_inode') != generation[0]
+                    or meta.get('offset', 0) > generation[2]):
+                return
+
+            segments = {}
+            for key, rows in meta['segments'].items():
+                with open(self._segment_path(key), 'rb') as f:
+                    segment = _Segment.from_state(key, pickle.load(f))
+                if len(segment) != rows:
+                    return  # segment z innego zapisu - zbuduj od zera
+                segments[key] = segment
+
+            dictionaries = meta['dictionaries']
+            self.segments = segments
+            self.products = _Dictionary(dictionaries['products'])
+            self.shops = _Dictionary(dictionaries['shops'])
+            self.urls = _Dictionary(dictionaries['urls'])
+            self.sources = _Dictionary(dictionaries['sources'])
+            self.currencies = _Dictionary(dictionaries['currencies'])
+            self._offset = meta['offset']
+            self._rewrites = meta['source_rewrites']
+            self._tail_crc = meta['tail_crc']
+            # Sztuczna generacja z tym samym inode - refresh sprawdzi licznik przepisań
+            # i sumę kontrolną, i doczyta tylko ogon pliku (albo zbuduje od zera)
+            self._generation = (generation[0], None, self._offset)
+        except (OSError, ValueError, KeyError, EOFError, pickle.UnpicklingError):
+            self._reset()
+
+    # ------------------------------------------------------------------
+    # Zapytania
+    # ------------------------------------------------------------------
+
+    def _row(self, segment, i):
+        ts = segment.ts[i]
+        return {
+            'product_id': self.products.decode(segment.product[i]),
+            'shop_id': self.shops.decode(segment.shop[i]),
+            'price': segment.price[i],
+            'currency': self.currencies.decode(segment.currency[i]),
+            'url': self.urls.decode(segment.url[i]),
+            'source': self.sources.decode(segment.source[i]),
+            'created': from_timestamp(ts).isoformat() if segment.key != UNKNOWN_MONTH else None,
+            'timestamp': ts,
+        }
+
+    def _segments_in_range(self, start_ts, end_ts, newest_first=False):
+        keys = sorted(self.segments, reverse=newest_first)
+        start_key = _month_key(start_ts) if start_ts is not None else None
+        end_key = _month_key(end_ts) if end_ts is not None else None
+        for key in keys:
+            if start_key and key < start_key:
+                continue
+            if end_key and key > end_key:
+                continue
+            yield self.segments[key]
+
+    def _select(self, segment, shop_codes=None, product_codes=None):
+        """
+        _Selection wierszy segmentu dla filtrów kodów. Przy obu filtrach bierzemy
+        krótsze listy (produktów albo sklepów) i dofiltrowujemy drugą kolumną.
+        """
+        if shop_codes is None and product_codes is None:
+            return _Selection(segment, [segment.order()])
+
+        product_runs = _runs(segment.postings('product'), product_codes) if product_codes is not None else None
+        shop_runs = _runs(segment.postings('shop'), shop_codes) if shop_codes is not None else None
+        if shop_runs is None:
+            return _Selection(segment, product_runs)
+        if product_runs is None:
+            return _Selection(segment, shop_runs)
+
+        if not product_runs or not shop_runs:
+            return _Selection(segment, [])
+        if sum(len(run) for run in product_runs) <= sum(len(run) for run in shop_runs):
+            return _Selection(segment, product_runs, segment.shop, shop_codes)
+        return _Selection(segment, shop_runs, segment.product, product_codes)
+
+    def iter_refs(self, product_id=None, shop_id=None, start=None, end=None,
+                  newest_first=False, shop_codes=None, product_codes=None):
+        """
+        Iteruj (segment, indeks) po wierszach spełniających filtry w kolejności czasu.
+        shop_codes/product_codes - gotowe zbiory kodów słownikowych (np. z filtra po nazwie).
+        Wołający musi trzymać blokadę magazynu (używaj przez metody publiczne / snapshot()).
+        """
+        if product_id is not None:
+            code = self.products.lookup(product_id)
+            if code is None:
+                return
+            product_codes = {code}
+        if shop_id is not None:
+            code = self.shops.lookup(shop_id)
+            if code is None:
+                return
+            shop_codes = {code}
+
+        start_ts = to_timestamp(start) if start is not None else None
+        end_ts = to_timestamp(end) if end is not None else None
+
+        for segment in self._segments_in_range(start_ts, end_ts, newest_first):
+            rows = self._select(segment, shop_codes, product_codes).rows()
+            if newest_first:
+                rows = reversed(rows)
+            ts = segment.ts
+            for i in rows:
+                # wiersze idą po czasie - za końcem przedziału można przerwać segment
+                if start_ts is not None and ts[i] < start_ts:
+                    if newest_first:
+                        break
+                    continue
+                if end_ts is not None and ts[i] > end_ts:
+                    if not newest_first:
+                        break
+                    continue
+                yield segment, i
+
+    def range_scan(self, product_id=None, shop_id=None, start=None, end=None, newest_first=False):
+        """
+        Historia cen dla produktu/sklepu w przedziale czasu [start, end].
+        Zwraca lekkie wiersze z kolumn (bez czytania JSONL).
+        """
+        self.refresh()
+        with self._lock:
+            return [self._row(segment, i) for segment, i in
+                    self.iter_refs(product_id, shop_id, start, end, newest_first)]
+
+    def latest(self, include_url=False, product_id=None, shop_id=None):
+        """
+        Najnowszy wiersz dla każdej pary (product_id, shop_id)
+        albo (product_id, shop_id, url) gdy include_url=True.
+        """
+        self.refresh()
+        with self._lock:
+            best = {}
+            for segment in self.segments.values():
+                ts, products, shops, urls = segment.ts, segment.product, segment.shop, segment.url
+                for i in range(len(ts)):
+                    key = (products[i], shops[i], urls[i]) if include_url else (products[i], shops[i])
+                    current = best.get(key)
+                    if current is None or ts[i] >= current[0]:
+                        best[key] = (ts[i], segment, i)
+
+            result = {}
+            for (ts, segment, i) in best.values():
+                row = self._row(segment, i)
+                if product_id is not None and row['product_id'] != product_id:
+                    continue
+                if shop_id is not None and row['shop_id'] != shop_id:
+                    continue
+                key = (row['product_id'], row['shop_id'], row['url']) if include_url else (row['product_id'], row['shop_id'])
+                result[key] = row
+            return result
+
+    def read_records(self, refs):
+        """Pełne rekordy JSON z prices.txt dla podanych (segment, indeks) - czyta tylko te linie"""
+        offsets = [segment.offset[i] for segment, i in refs]
+        records = []
+        with read_lock(self.prices_file):
+            try:
+                with open(self.prices_file, 'rb') as f:
+                    for offset in offsets:
+                        f.seek(offset)
+                        try:
+                            records.append(json.loads(f.readline()))
+                        except ValueError:
+                            records.append(None)
+            except FileNotFoundError:
+                return []
+        return records
+
+    def reading(self):
+        """
+        Blokada czytelnika prices.txt na kilka zapytań - kody z codes_matching() zostają
+        ważne dla page() (przepisanie pliku przebudowuje słowniki).
+        """
+        return read_lock(self.prices_file)
+
+    def shop_ids(self):
+        """Sklepy występujące w historii"""
+        self.refresh()
+        with self._lock:
+            used = set()
+            for segment in self.segments.values():
+                used.update(segment.postings('shop'))
+            return sorted(self.shops.decode(code) for code in used if self.shops.decode(code))
+
+    def codes_matching(self, dictionary_name, predicate):
+        """Zbiór kodów słownika ('shops', 'products', ...) których wartość spełnia predicate"""
+        self.refresh()
+        with self._lock:
+            dictionary = getattr(self, dictionary_name)
+            return {code for code, value in enumerate(dictionary.values) if predicate(value)}
+
+    def page(self, offset, limit, shop_codes=None, product_codes=None):
+        """
+        Strona historii od najnowszych: (liczba pasujących, pełne rekordy strony).
+        Liczność segmentów bierzemy z list postings, wiersze i rekordy JSON
+        materializujemy tylko dla segmentów, na które wypada strona.
+        """
+        # read_lock przez całe zapytanie - offsety nie mogą się zdezaktualizować przed odczytem
+        with read_lock(self.prices_file):
+            self.refresh()
+            with self._lock:
+                total = 0
+                page_refs = []
+                for segment in self._segments_in_range(None, None, newest_first=True):
+                    selection = self._select(segment, shop_codes, product_codes)
+                    count = len(selection)
+                    if count and total + count > offset and len(page_refs) < limit:
+                        skip = max(0, offset - total)
+                        page_refs.extend((segment, i) for i in selection.newest(skip, limit - len(page_refs)))
+                    total += count
+                records = self.read_records(page_refs)
+        return total, [r for r in records if isinstance(r, dict)]
+
+    def __len__(self):
+        self.refresh()
+        with self._lock:
+            return sum(len(segment) for segment in self.segments.values())
+
+
+# Singleton instance
+price_history = PriceHistoryStore()